@@ -0,0 +1,146 @@
+from api.schemas import Alert
+from api.security import sanitize_input
+from langgraph.memory.redis_store import RedisStore
+from infra.observability import ALERTS_COALESCED_TOTAL
+from infra.coalescing import CoalescedRuns
+from typing import List, Optional
+import hashlib
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# Upper bound, in seconds, on how long a run keeps attaching repeats. The window normally closes
+# earlier, when the worker finishes the run; the TTL only covers runs that never complete.
+ALERT_DEDUP_WINDOW = int(os.getenv("ALERT_DEDUP_WINDOW", "300"))
+
+# Addresses are kept verbatim; any other standalone number (port, counter, timestamp field) is masked.
+# Host-like tokens mixing letters and digits (web01, db-2) are never numbers. Full IPv6 needs 4+ groups,
+# so hh:mm:ss timestamps are not mistaken for one.
+_ADDRESS_OR_NUMBER_RE = re.compile(
+    r"(?P<address>\b\d{1,3}(?:\.\d{1,3}){3}\b"
+    r"|[0-9a-f]*::[0-9a-f:]*"
+    r"|\b[0-9a-f]{1,4}(?::[0-9a-f]{1,4}){3,7}\b)"
+    r"|(?<![\w-])\d+(?![\w-])"
+)
+
+def _mask_numbers(text: str) -> str:
+    return _ADDRESS_OR_NUMBER_RE.sub(lambda m: m.group("address") or "#", text)
+
+def alert_fingerprint(alert: Alert) -> str:
+    """
+    Normalized fingerprint of (source, severity, summary).
+    Standalone numbers are masked so storms that only differ in ports, counters or timestamps collapse
+    together, while alerts about different hosts or IPs keep distinct fingerprints.
+    """
+    summary = sanitize_input(alert.summary).lower()
+    summary = _mask_numbers(summary)
+    normalized = f"{alert.source.lower()}|{alert.severity}|{summary}"
+    return "sha256:" + hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+class AlertDeduplicator:
+    """
+    Coalesces duplicate alerts onto the graph run already in flight.
+    State lives in Redis so every API replica sees the same window; the worker closes it
+    (CoalescedRuns.close) when the run completes.
+    """
+    def __init__(self, redis_store: RedisStore, window: int = ALERT_DEDUP_WINDOW):
+        self.redis_store = redis_store
+        self.window = window
+        self.runs = CoalescedRuns(redis_store)
+
+    def claim(self, alert: Alert) -> Optional[str]:
+        """
+        Returns None if the alert should start a new run (it now owns the window),
+        otherwise the alert_id of the run it was attached to.
+        """
+        return self.claim_many([alert])[0]
+
+    def claim_many(self, alerts: List[Alert]) -> List[Optional[str]]:
+        """
+        Batched claim: same result as calling claim() per alert, in four Redis round-trips total.
+        Repeats within the batch are attached to the first occurrence.
+        """
+        if self.window <= 0 or not alerts:
+            return [None] * len(alerts)
+
+        client = self.redis_store.client
+        raw_keys = [f"dedup:raw:{alert.raw_payload_hash}" for alert in alerts]
+        fingerprint_keys = [f"dedup:fp:{alert_fingerprint(alert)}" for alert in alerts]
+
+        try:
+            # 1. Byte-identical replay (e.g. SIEM retry)
+            pipe = client.pipeline(transaction=False)
+            for key in raw_keys:
+                pipe.get(key)
+            primaries = pipe.execute()
+            matches = ["raw" if primary is not None else "fingerprint" for primary in primaries]
+
+            # 2. Near-identical alert. SET NX makes the claim atomic across replicas.
+            pending = [i for i, primary in enumerate(primaries) if primary is None]
+            pipe = client.pipeline(transaction=False)
+            for i in pending:
+                pipe.set(fingerprint_keys[i], alerts[i].alert_id, nx=True, ex=self.window)
+            claimed = pipe.execute()
+
+            # 3. Winners also own their raw hash and record both keys for the worker to release;
+            # losers look up who won
+            pipe = client.pipeline(transaction=False)
+            lookups = []
+            for i, won in zip(pending, claimed):
+                if won:
+                    pipe.set(raw_keys[i], alerts[i].alert_id, ex=self.window)
+                    self.runs.hold(pipe, alerts[i].alert_id, [raw_keys[i], fingerprint_keys[i]], self.window)
+                    # Replies to the SET and the two hold commands
+                    lookups.extend([None, None, None])
+                else:
+                    pipe.get(fingerprint_keys[i])
+                    lookups.append(i)
+            for i, reply in zip(lookups, pipe.execute()):
+                if i is not None:
+                    # None means the window closed in between; treat as new
+                    primaries[i] = reply
+
+            # 4. Attach the repeats. A run that completed since the lookup no longer accepts them.
+            repeats = [i for i, primary in enumerate(primaries) if primary is not None and primary != alerts[i].alert_id]
+            if repeats:
+                accepted = self.runs.attach([(primaries[i], alerts[i].alert_id) for i in repeats], self.window)
+                for i, ok in zip(repeats, accepted):
+                    if not ok:
+                        primaries[i] = None
+        except Exception as e:
+            # Dedup is an optimisation. Without Redis we process every alert rather than drop any.
+            logger.warning(f"Alert dedup unavailable, processing {len(alerts)} alert(s): {e}")
+            return [None] * len(alerts)
+
+        for primary, match in zip(primaries, matches):
+            if primary is not None:
+                ALERTS_COALESCED_TOTAL.labels(match=match).inc()
+        return primaries
+
+    def release(self, alert: Alert):
+        """
+        Gives up the window claimed by this alert, e.g. when it could not be queued,
+        so later repeats are not attached to a run that never happened.
+        """
+        self.release_many([alert])
+
+    def release_many(self, alerts: List[Alert]):
+        client = self.redis_store.client
+        keys = []
+        for alert in alerts:
+            keys.append((f"dedup:raw:{alert.raw_payload_hash}", alert.alert_id))
+            keys.append((f"dedup:fp:{alert_fingerprint(alert)}", alert.alert_id))
+        pipe = client.pipeline(transaction=False)
+        for key, _ in keys:
+            pipe.get(key)
+        owners = pipe.execute()
+        pipe = client.pipeline(transaction=False)
+        for (key, alert_id), owner in zip(keys, owners):
+            # Only drop claims this alert still owns
+            if owner == alert_id:
+                pipe.delete(key)
+        for alert in alerts:
+            pipe.delete(self.runs.claims_key(alert.alert_id))
+        pipe.execute()
@@ -24,21 +24,54 @@ async def get_api_key(api_key_header: str = Security(api_key_header)):
 
 # Rate Limiting
 # Simple fixed window counter
-redis_store = RedisStore(host="localhost", port=6379) # Should use env vars
-
-async def rate_limiter(request: Request, api_key: str = Depends(get_api_key)):
-    # Limit: 100 requests per minute per key
-    limit = 100
-    window = 60
-    
-    key = f"rate_limit:{api_key}"
-    current = redis_store.client.incr(key)
-    
-    if current == 1:
-        redis_store.client.expire(key, window)
-        
-    if current > limit:
+# redis-py connects on first command, so building the store here is cheap
+redis_store = RedisStore(host=os.getenv("REDIS_HOST", "localhost"), port=int(os.getenv("REDIS_PORT", "6379")))
+
+# Limit: 100 requests per minute per key
+RATE_LIMIT = int(os.getenv("RATE_LIMIT_PER_MINUTE", "100"))
+# Separate quota for alerts ingested through /ingest/batch, per minute per key.
+# Must be at least INGEST_BATCH_MAX_ITEMS or the largest allowed batches can never pass.
+RATE_LIMIT_BATCH_ITEMS = int(os.getenv("RATE_LIMIT_BATCH_ITEMS_PER_MINUTE", "10000"))
+RATE_LIMIT_WINDOW = 60
+
+# KEYS[1]: window counter. ARGV: weight, limit, window.
+# Charges the weight only if the window stays within the limit, so rejected requests cost nothing.
+RATE_LIMIT_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local weight = tonumber(ARGV[1])
+if current + weight > tonumber(ARGV[2]) then
+    return 0
+end
+if redis.call('INCRBY', KEYS[1], weight) == weight then
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+end
+return 1
+"""
+# Registered once per client; register_script only hashes the source, the script is loaded on first use
+_rate_limit_script = None
+
+def _rate_limit_script_for(client):
+    global _rate_limit_script
+    if _rate_limit_script is None or _rate_limit_script.registered_client is not client:
+        _rate_limit_script = client.register_script(RATE_LIMIT_SCRIPT)
+    return _rate_limit_script
+
+def charge_rate_limit(api_key: str, weight: int = 1, limit: int = RATE_LIMIT, quota: str = "requests"):
+    """
+    Charges `weight` units against the key's window for `quota`, or raises 429 without charging
+    if that would exceed `limit`. A weight above the limit itself can never pass and raises 413.
+    Blocking (one Redis round-trip): call it from a thread, not an event loop.
+    """
+    if weight > limit:
+        raise HTTPException(status_code=413, detail=f"Request weight {weight} exceeds the {limit} per-minute quota")
+    key = f"rate_limit:{api_key}" if quota == "requests" else f"rate_limit:{quota}:{api_key}"
+    charge = _rate_limit_script_for(redis_store.client)
+    if not int(charge(keys=[key], args=[weight, limit, RATE_LIMIT_WINDOW])):
         raise HTTPException(
             status_code=HTTP_429_TOO_MANY_REQUESTS, detail="Rate limit exceeded"
         )
+
+def rate_limiter(request: Request, api_key: str = Depends(get_api_key)):
+    # A plain def, so FastAPI runs the Redis round-trip in its threadpool
+    charge_rate_limit(api_key)
     return True
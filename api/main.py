@@ -1,5 +1,5 @@
 from fastapi import FastAPI, HTTPException, Request, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from api.schemas import Alert
 from api.security import sanitize_input, compute_payload_hash
 import json
@@ -12,19 +12,61 @@ logger = logging.getLogger(__name__)
 
 
 from api.routes import approval
-from infra.observability import AGENT_THROUGHPUT, PROMPT_INJECTION_ATTEMPTS, tracer
+from infra.observability import AGENT_THROUGHPUT, PROMPT_INJECTION_ATTEMPTS, tracer, start_metrics_server
+from infra.warmup import readiness, run_warmup
 from opentelemetry.trace import Status, StatusCode
+from contextlib import asynccontextmanager
 
-app = FastAPI(title="Secure Agentic SOC Co-Pilot", version="0.1.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Startup stays cheap: nothing heavy is loaded at import, and the dependency checks
+    run in the background while /health already answers. /ready flips once they pass.
+    """
+    start_metrics_server()
+    warmup = asyncio.create_task(run_warmup({"redis": _warm_redis}))
+    yield
+    warmup.cancel()
+
+app = FastAPI(title="Secure Agentic SOC Co-Pilot", version="0.1.0", lifespan=lifespan)
 app.include_router(approval.router)
 
-from fastapi import FastAPI, HTTPException, Request, status, BackgroundTasks, Depends
-from api.dependencies import get_api_key, rate_limiter
-from langgraph.graph import process_alert
+from fastapi import FastAPI, HTTPException, Request, status, Depends, Header
+from api.dependencies import get_api_key, rate_limiter, charge_rate_limit, redis_store, RATE_LIMIT_BATCH_ITEMS
+from api.dedup import AlertDeduplicator
+from api.audit import audit_logger
+from infra.queue import AlertQueue, QueueFull
+from infra.events import alert_events
+from typing import Optional, Any, Dict, List, Tuple
+import os
 import asyncio
 
+deduplicator = AlertDeduplicator(redis_store)
+# Graph runs happen in separate worker processes (python -m infra.worker) fed by this queue
+alert_queue = AlertQueue(redis_store)
+
+def _warm_redis():
+    # Opens the pool connection and makes sure workers have a group to read from
+    redis_store.client.ping()
+    alert_queue.ensure_group()
+
+# Upper bound on alerts per /ingest/batch request
+INGEST_BATCH_MAX_ITEMS = int(os.getenv("INGEST_BATCH_MAX_ITEMS", "5000"))
+
+def _build_alert(payload_dict: Dict[str, Any], payload_hash: str) -> Alert:
+    """
+    Sanitizes free-text fields and validates the payload against the strict schema.
+    """
+    if "summary" in payload_dict:
+        payload_dict["summary"] = sanitize_input(payload_dict["summary"])
+    if "source" in payload_dict:
+        payload_dict["source"] = sanitize_input(payload_dict["source"])
+        
+    payload_dict["raw_payload_hash"] = payload_hash
+    return Alert(**payload_dict)
+
 @app.post("/ingest", response_model=dict, status_code=status.HTTP_201_CREATED, dependencies=[Depends(rate_limiter)])
-async def ingest_alert(request: Request, background_tasks: BackgroundTasks):
+async def ingest_alert(request: Request):
     """
     Ingests a raw alert from a SIEM webhook.
     Normalizes, sanitizes, and validates the payload.
@@ -47,17 +89,9 @@ async def ingest_alert(request: Request, background_tasks: BackgroundTasks):
                 span.set_status(Status(StatusCode.ERROR, "Malformed JSON"))
                 raise HTTPException(status_code=400, detail="Invalid JSON payload")
 
-            # 3. Sanitize inputs
-            if "summary" in payload_dict:
-                payload_dict["summary"] = sanitize_input(payload_dict["summary"])
-            if "source" in payload_dict:
-                payload_dict["source"] = sanitize_input(payload_dict["source"])
-                
-            payload_dict["raw_payload_hash"] = payload_hash
-            
-            # 4. Validate against strict schema
+            # 3. Sanitize inputs and 4. Validate against strict schema
             try:
-                alert = Alert(**payload_dict)
+                alert = _build_alert(payload_dict, payload_hash)
             except Exception as e:
                 logger.error(f"Schema validation failed: {str(e)}")
                 span.set_status(Status(StatusCode.ERROR, "Schema Validation Failed"))
@@ -67,10 +101,19 @@ async def ingest_alert(request: Request, background_tasks: BackgroundTasks):
             logger.info(f"Alert ingested successfully. ID: {alert.alert_id} Hash: {payload_hash}")
             span.set_status(Status(StatusCode.OK))
             
-            # 6. Trigger Agent in Background
-            background_tasks.add_task(process_alert, alert)
-            
-            return {"status": "accepted", "alert_id": alert.alert_id, "hash": payload_hash}
+            # 6. Coalesce repeats onto the run already in flight and 7. hand off to the worker pool.
+            # Both are blocking Redis round-trips, so they run off the event loop.
+            try:
+                primary_id, position = await asyncio.to_thread(_ingest_alert, alert)
+            except QueueFull:
+                span.set_status(Status(StatusCode.ERROR, "Queue saturated"))
+                raise HTTPException(status_code=503, detail="Alert queue saturated, retry later", headers={"Retry-After": "5"})
+
+            if primary_id:
+                span.set_attribute("alert.coalesced_into", primary_id)
+                audit_logger.log_event("alert_coalesced", {"alert_id": alert.alert_id, "attached_to": primary_id, "hash": payload_hash})
+                return {"status": "duplicate", "alert_id": alert.alert_id, "attached_to": primary_id, "hash": payload_hash}
+            return {"status": "accepted", "alert_id": alert.alert_id, "hash": payload_hash, "queue_position": position}
 
         except HTTPException as he:
             span.set_status(Status(StatusCode.ERROR, str(he.detail)))
@@ -80,6 +123,151 @@ async def ingest_alert(request: Request, background_tasks: BackgroundTasks):
             span.set_status(Status(StatusCode.ERROR, str(e)))
             raise HTTPException(status_code=500, detail="Internal server error")
 
+def _ingest_alert(alert: Alert) -> Tuple[Optional[str], Optional[int]]:
+    """
+    Claims the alert's dedup window and queues it. Returns (primary_id, None) for a duplicate,
+    otherwise (None, queue position); raises QueueFull (with the claim released) if the queue is saturated.
+    """
+    primary_id = deduplicator.claim(alert)
+    if primary_id:
+        return primary_id, None
+    try:
+        return None, alert_queue.enqueue(alert)
+    except QueueFull as e:
+        deduplicator.release(alert)
+        logger.warning(f"Rejecting alert {alert.alert_id}: {e}")
+        raise
+
+def _split_batch(raw_payload: str) -> List[Tuple[str, Any]]:
+    """
+    Splits a batch body into (raw item text, parsed item) pairs.
+    Accepts a JSON array or NDJSON. Unparseable NDJSON lines are returned with a None item.
+    """
+    if raw_payload.lstrip().startswith("["):
+        items = json.loads(raw_payload)
+        # Canonical form, so the per-item hash does not depend on array formatting
+        return [(json.dumps(item, sort_keys=True, separators=(",", ":")), item) for item in items]
+
+    pairs = []
+    for line in raw_payload.splitlines():
+        if not line.strip():
+            continue
+        try:
+            pairs.append((line, json.loads(line)))
+        except json.JSONDecodeError:
+            pairs.append((line, None))
+    return pairs
+
+@app.post("/ingest/batch", response_model=dict)
+async def ingest_alert_batch(request: Request, api_key: str = Depends(get_api_key)):
+    """
+    Ingests many alerts in one request (JSON array or NDJSON).
+    Every item is hashed, sanitized and validated; the result list reports each item's outcome
+    in input order. The items are charged against the key's batch quota, not its request limit.
+    """
+    with tracer.start_as_current_span("ingest_alert_batch") as span:
+        raw_payload = (await request.body()).decode("utf-8")
+        try:
+            items = _split_batch(raw_payload)
+        except json.JSONDecodeError:
+            span.set_status(Status(StatusCode.ERROR, "Malformed JSON"))
+            raise HTTPException(status_code=400, detail="Invalid JSON array payload")
+        if not items:
+            raise HTTPException(status_code=400, detail="Batch is empty")
+        if len(items) > INGEST_BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"Batch exceeds {INGEST_BATCH_MAX_ITEMS} alerts")
+
+        await asyncio.to_thread(charge_rate_limit, api_key, weight=len(items), limit=RATE_LIMIT_BATCH_ITEMS, quota="batch_items")
+        span.set_attribute("batch.size", len(items))
+        AGENT_THROUGHPUT.labels(agent="ingest").inc(len(items))
+
+        # Per-item validation and the Redis round-trips are blocking, so they run off the event loop
+        try:
+            results = await asyncio.to_thread(_ingest_items, items)
+        except QueueFull:
+            span.set_status(Status(StatusCode.ERROR, "Queue saturated"))
+            raise HTTPException(status_code=503, detail="Alert queue saturated, retry later", headers={"Retry-After": "5"})
+
+        counts = {status_name: sum(1 for r in results if r["status"] == status_name) for status_name in ("accepted", "duplicate", "rejected")}
+        logger.info(f"Batch ingested. {counts}")
+        return {"summary": counts, "results": results}
+
+def _ingest_items(items: List[Tuple[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Validates, deduplicates and queues the (raw, parsed) items of a batch.
+    Returns one result per item; raises QueueFull (with every claim released) if the queue is saturated.
+    """
+    # 1. Hash, sanitize and validate every item in one pass
+    results: List[Dict[str, Any]] = []
+    valid: List[Tuple[int, Alert]] = []
+    for index, (raw_item, item) in enumerate(items):
+        payload_hash = compute_payload_hash(raw_item)
+        result = {"index": index, "hash": payload_hash}
+        results.append(result)
+        if not isinstance(item, dict):
+            result.update(status="rejected", error="Invalid JSON object")
+            continue
+        try:
+            alert = _build_alert(item, payload_hash)
+        except Exception as e:
+            result.update(status="rejected", error=f"Schema validation failed: {str(e)}")
+            continue
+        result["alert_id"] = alert.alert_id
+        valid.append((index, alert))
+
+    # 2. Coalesce repeats (against in-flight runs and within the batch)
+    primaries = deduplicator.claim_many([alert for _, alert in valid])
+    fresh = []
+    for (index, alert), primary_id in zip(valid, primaries):
+        if primary_id:
+            results[index].update(status="duplicate", attached_to=primary_id)
+        else:
+            fresh.append((index, alert))
+
+    # 3. Queue the rest in one round-trip
+    if fresh:
+        try:
+            positions = alert_queue.enqueue_many([alert for _, alert in fresh])
+        except QueueFull as e:
+            deduplicator.release_many([alert for _, alert in fresh])
+            logger.warning(f"Rejecting batch of {len(fresh)} alerts: {e}")
+            raise
+        for (index, _), position in zip(fresh, positions):
+            results[index].update(status="accepted", queue_position=position)
+    return results
+
+@app.get("/alerts/{alert_id}/events", dependencies=[Depends(get_api_key)])
+async def stream_alert_events(alert_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    Server-sent events for one alert: node start/end, incremental analyst and planner tokens,
+    and a final `done` event with the remediation. Reconnecting clients resume via Last-Event-ID.
+    """
+    async def event_source():
+        async for item in alert_events.subscribe(alert_id, last_event_id=last_event_id or "0"):
+            if item is None:
+                # Keep idle proxies from closing the connection
+                yield ": keep-alive\n\n"
+                continue
+            event_id, event, data = item
+            yield f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(event_source(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
+
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe: 503 until startup checks have passed and while Redis is unreachable.
+    Unlike /health, this gates traffic rather than restarts.
+    """
+    status_body = readiness.status()
+    if status_body["ready"]:
+        try:
+            await asyncio.to_thread(redis_store.client.ping)
+        except Exception as e:
+            status_body.update(ready=False, errors={"redis": str(e)})
+    return JSONResponse(status_code=200 if status_body["ready"] else 503, content=status_body)
@@ -1,32 +1,158 @@
 import numpy as np
-from typing import List
+import os
+import threading
+from typing import Dict, Hashable, Iterable, Tuple
+
+# Samples per series and the z-score that counts as an anomaly
+ANOMALY_WINDOW_SIZE = int(os.getenv("ANOMALY_WINDOW_SIZE", "50"))
+ANOMALY_Z_THRESHOLD = float(os.getenv("ANOMALY_Z_THRESHOLD", "3.0"))
 
 class AnomalyDetector:
-    def __init__(self, window_size: int = 50):
+    """
+    Z-score detector over a sliding window, updated in O(1) per sample.
+    Values live in a ring buffer; the window's mean and sum of squared deviations are
+    maintained with Welford's update (and its inverse when a sample leaves the window).
+    """
+    # Running sums are recomputed from the buffer every this many windows to bound rounding drift
+    RESYNC_WINDOWS = 64
+
+    def __init__(self, window_size: int = ANOMALY_WINDOW_SIZE, threshold: float = ANOMALY_Z_THRESHOLD, min_samples: int = 10):
         self.window_size = window_size
-        self.history: List[float] = []
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self._buffer = np.zeros(window_size, dtype=np.float64)
+        self._next = 0
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self._updates = 0
 
-    def is_anomaly(self, value: float) -> bool:
+    @property
+    def std(self) -> float:
+        # Population standard deviation, like np.std
+        return (max(self._m2, 0.0) / self.count) ** 0.5 if self.count else 0.0
+
+    @property
+    def history(self) -> np.ndarray:
         """
-        Checks if the value is an anomaly using Z-Score.
+        Values in the window, oldest first.
         """
-        self.history.append(value)
-        if len(self.history) > self.window_size:
-            self.history.pop(0)
-            
-        if len(self.history) < 10:
+        if self.count < self.window_size:
+            return self._buffer[:self.count].copy()
+        return np.roll(self._buffer, -self._next)
+
+    def update(self, value: float):
+        value = float(value)
+        if self.count < self.window_size:
+            self.count += 1
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self._m2 += delta * (value - self.mean)
+        else:
+            old = self._buffer[self._next]
+            old_mean = self.mean
+            self.mean += (value - old) / self.count
+            self._m2 += (value - old) * (value - self.mean + old - old_mean)
+        self._buffer[self._next] = value
+        self._next = (self._next + 1) % self.window_size
+
+        self._updates += 1
+        if self._updates % (self.window_size * self.RESYNC_WINDOWS) == 0:
+            self._resync()
+
+    def _resync(self):
+        window = self._buffer[:self.count]
+        self.mean = float(window.mean())
+        self._m2 = float(((window - self.mean) ** 2).sum())
+
+    def _flag(self, value: float) -> bool:
+        if self.count < self.min_samples:
             return False # Not enough data
-            
-        mean = np.mean(self.history)
-        std = np.std(self.history)
-        
+        std = self.std
         if std == 0:
             return False
-            
-        z_score = (value - mean) / std
-        
-        # Threshold of 3 std devs
-        if abs(z_score) > 3:
-            return True
-            
-        return False
+        return abs((value - self.mean) / std) > self.threshold
+
+    def is_anomaly(self, value: float) -> bool:
+        """
+        Adds the value to the window and checks it against the window's z-score.
+        """
+        self.update(value)
+        return self._flag(value)
+
+    def bulk_update(self, values) -> np.ndarray:
+        """
+        Vectorized equivalent of calling is_anomaly on each value in order.
+        Returns one flag per value. Intended for replaying history.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return np.zeros(0, dtype=bool)
+        series = np.concatenate([self.history, values])
+        start = series.size - values.size
+        # Shifted by a representative value so the prefix sums of squares keep their precision
+        shift = series[start]
+        centered = series - shift
+        sums = np.concatenate([[0.0], np.cumsum(centered)])
+        squares = np.concatenate([[0.0], np.cumsum(centered * centered)])
+
+        ends = np.arange(start + 1, series.size + 1)
+        begins = np.maximum(ends - self.window_size, 0)
+        counts = ends - begins
+        means = (sums[ends] - sums[begins]) / counts
+        variances = np.maximum((squares[ends] - squares[begins]) / counts - means * means, 0.0)
+        stds = np.sqrt(variances)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = np.abs(centered[start:] - means) / stds
+        flags = (counts >= self.min_samples) & (stds > 0) & (z > self.threshold)
+
+        # Continue from the end of the replay
+        tail = series[-self.window_size:]
+        self._buffer[:tail.size] = tail
+        self.count = tail.size
+        self._next = tail.size % self.window_size
+        self._updates += values.size
+        self._resync()
+        return flags
+
+class AnomalyDetectorBank:
+    """
+    One AnomalyDetector per series key, e.g. (agent, model), created on first use.
+    """
+    def __init__(self, window_size: int = ANOMALY_WINDOW_SIZE, threshold: float = ANOMALY_Z_THRESHOLD, min_samples: int = 10):
+        self.window_size = window_size
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.detectors: Dict[Hashable, AnomalyDetector] = {}
+        self._lock = threading.Lock()
+
+    def detector(self, key: Hashable) -> AnomalyDetector:
+        detector = self.detectors.get(key)
+        if detector is None:
+            with self._lock:
+                detector = self.detectors.setdefault(key, AnomalyDetector(self.window_size, self.threshold, self.min_samples))
+        return detector
+
+    def is_anomaly(self, key: Hashable, value: float) -> bool:
+        detector = self.detector(key)
+        with self._lock:
+            return detector.is_anomaly(value)
+
+    def bulk_update(self, rows: Iterable[Tuple[Hashable, float]]) -> Dict[Hashable, np.ndarray]:
+        """
+        Replays (key, value) rows in order, one vectorized pass per series.
+        Returns the anomaly flags of each series' rows.
+        """
+        grouped: Dict[Hashable, list] = {}
+        for key, value in rows:
+            grouped.setdefault(key, []).append(value)
+        flags = {}
+        for key, values in grouped.items():
+            detector = self.detector(key)
+            with self._lock:
+                flags[key] = detector.bulk_update(values)
+        return flags
+
+# Shared by every TokenAccountant in the process, keyed by (agent, model)
+anomaly_detectors = AnomalyDetectorBank()
@@ -1,31 +1,174 @@
-from typing import Dict, Any
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, Tuple
+import atexit
 import logging
+import os
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# "redis" enforces the limits across every worker through a shared ledger; "local" keeps them per process
+BUDGET_LEDGER = os.getenv("BUDGET_LEDGER", "redis")
+# Spend reserved from the shared ledger at a time, so most calls are decided without a round-trip
+BUDGET_LEASE_USD = float(os.getenv("BUDGET_LEASE_USD", "0.05"))
+# After a ledger error, decide locally for this long before trying Redis again
+BUDGET_LEDGER_RETRY_SECONDS = float(os.getenv("BUDGET_LEDGER_RETRY_SECONDS", "30"))
+
+# Amounts are kept in integer micro-dollars so Redis counters stay exact
+MICRO_USD = 1_000_000
+
+# KEYS[1]: spend counter for the day. ARGV: amount, hard limit, TTL.
+# Reserves the amount only if the day's total stays within the limit; returns {granted, total}.
+RESERVE_SCRIPT = """
+local spent = tonumber(redis.call('GET', KEYS[1]) or '0')
+local amount = tonumber(ARGV[1])
+if spent + amount > tonumber(ARGV[2]) then
+    return {0, spent}
+end
+spent = redis.call('INCRBY', KEYS[1], amount)
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+return {1, spent}
+"""
+
+def to_micro(usd: float) -> int:
+    return int(round(usd * MICRO_USD))
+
+def utc_day() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+class RedisBudgetLedger:
+    """
+    Deployment-wide daily spend counter in Redis, one key per UTC day.
+    Reservations are checked against the limit and applied atomically by a server-side script.
+    """
+    def __init__(self, client, key_prefix: str = "budget:spend", ttl: int = 2 * 86400):
+        self.client = client
+        self.key_prefix = key_prefix
+        self.ttl = ttl
+        self._reserve = client.register_script(RESERVE_SCRIPT)
+
+    def key(self, day: str) -> str:
+        return f"{self.key_prefix}:{day}"
+
+    def reserve(self, day: str, amount: int, limit: int) -> Tuple[bool, int]:
+        granted, total = self._reserve(keys=[self.key(day)], args=[amount, limit, self.ttl])
+        return bool(int(granted)), int(total)
+
+    def refund(self, day: str, amount: int):
+        self.client.decrby(self.key(day), amount)
+
 class BudgetPolicy:
-    def __init__(self):
+    """
+    Daily soft/hard spend limits.
+    With a ledger, spend is reserved from the shared counter in leases of lease_usd and
+    consumed locally, so only one call per lease pays a Redis round-trip. Reserved but
+    unused spend counts against the limit until it is refunded at shutdown. If the ledger
+    is unreachable, calls are decided against the last known total plus local spend.
+    """
+    def __init__(self, ledger: Optional[RedisBudgetLedger] = None, lease_usd: float = BUDGET_LEASE_USD,
+                 retry_seconds: float = BUDGET_LEDGER_RETRY_SECONDS):
         # Limits in USD
         self.soft_limit_daily = 10.0
         self.hard_limit_daily = 50.0
-        self.current_spend = 0.0 # In production, fetch from DB/Redis
+        self.ledger = ledger
+        self.lease = to_micro(lease_usd)
+        self.retry_seconds = retry_seconds
+        self._day = utc_day()
+        # Day total last reported by the ledger, and how much of our reservations is left (negative: owed)
+        self._reserved = 0
+        self._remaining = 0
+        self._ledger_down_until = 0.0
+        self._refund_registered = False
+        self._lock = threading.Lock()
+
+    @property
+    def current_spend(self) -> float:
+        return (self._reserved - self._remaining) / MICRO_USD
+
+    def _roll_day(self):
+        day = utc_day()
+        if day != self._day:
+            # Leftover reservations belong to the previous day's counter
+            self._day = day
+            self._reserved = 0
+            self._remaining = 0
+
+    def _top_up(self, needed: int) -> bool:
+        """
+        Reserves enough from the ledger to cover `needed`. Returns False if the shared limit refuses it.
+        """
+        shortfall = needed - self._remaining
+        limit = to_micro(self.hard_limit_daily)
+        try:
+            # A full lease if it fits, else just what this call needs (one attempt if that is the same amount)
+            amounts = (self.lease, shortfall) if shortfall < self.lease else (shortfall,)
+            for amount in amounts:
+                granted, total = self.ledger.reserve(self._day, amount, limit)
+                self._reserved = total
+                if granted:
+                    self._remaining += amount
+                    if not self._refund_registered:
+                        atexit.register(self.close)
+                        self._refund_registered = True
+                    return True
+            return False
+        except Exception as e:
+            logger.error(f"Budget ledger unavailable, enforcing limits locally for {self.retry_seconds}s: {e}")
+            self._ledger_down_until = time.monotonic() + self.retry_seconds
+            return True
 
     def check_budget(self, estimated_cost: float) -> Dict[str, Any]:
         """
         Checks if the call is within budget.
         """
-        projected_spend = self.current_spend + estimated_cost
-        
+        needed = to_micro(estimated_cost)
+        with self._lock:
+            self._roll_day()
+            if self.ledger is not None and needed > self._remaining and time.monotonic() >= self._ledger_down_until:
+                if not self._top_up(needed):
+                    logger.error(f"Hard budget limit exceeded across the deployment. Spend: {self._reserved / MICRO_USD}, Limit: {self.hard_limit_daily}")
+                    return {"allowed": False, "reason": "Hard budget limit exceeded"}
+            projected_spend = self.current_spend + estimated_cost
+
         if projected_spend > self.hard_limit_daily:
             logger.error(f"Hard budget limit exceeded. Spend: {projected_spend}, Limit: {self.hard_limit_daily}")
             return {"allowed": False, "reason": "Hard budget limit exceeded"}
-            
+
         if projected_spend > self.soft_limit_daily:
             logger.warning(f"Soft budget limit exceeded. Spend: {projected_spend}, Limit: {self.soft_limit_daily}")
             # We allow but log warning / trigger alert
             return {"allowed": True, "warning": "Soft budget limit exceeded"}
-            
+
         return {"allowed": True}
 
     def record_spend(self, cost: float):
-        self.current_spend += cost
+        with self._lock:
+            self._roll_day()
+            # Spend beyond the reservation (ledger down) is owed and covered by the next top-up
+            self._remaining -= to_micro(cost)
+
+    def close(self):
+        """
+        Returns the unused part of the lease to the shared counter.
+        """
+        with self._lock:
+            if self.ledger is None or self._remaining <= 0:
+                return
+            try:
+                self.ledger.refund(self._day, self._remaining)
+                self._reserved -= self._remaining
+                self._remaining = 0
+            except Exception as e:
+                logger.warning(f"Could not refund unused budget lease: {e}")
+
+def _default_ledger() -> Optional[RedisBudgetLedger]:
+    if BUDGET_LEDGER != "redis":
+        return None
+    from langgraph.memory.redis_store import RedisStore
+    # The client connects on first use, so building the policy stays cheap
+    store = RedisStore(host=os.getenv("REDIS_HOST", "localhost"), port=int(os.getenv("REDIS_PORT", "6379")))
+    return RedisBudgetLedger(store.client)
+
+# One policy per process: every TokenAccountant charges the same leases and limits
+budget_policy = BudgetPolicy(ledger=_default_ledger())
@@ -0,0 +1,82 @@
+from langgraph.memory.redis_store import RedisStore
+from typing import List, Sequence, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1]: the primary's claims set, KEYS[2]: its attached list. ARGV: alert_id, ttl.
+# Attaches only while the primary still holds its claims, so no repeat lands on a run that has already reported.
+ATTACH_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('RPUSH', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[2]))
+return 1
+"""
+
+# KEYS[1]: the primary's claims set, KEYS[2]: its attached list. ARGV: primary alert_id.
+# Drops the dedup keys the primary still owns and hands back (and clears) everything attached to it.
+CLOSE_SCRIPT = """
+for _, key in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    if redis.call('GET', key) == ARGV[1] then
+        redis.call('DEL', key)
+    end
+end
+redis.call('DEL', KEYS[1])
+local attached = redis.call('LRANGE', KEYS[2], 0, -1)
+redis.call('DEL', KEYS[2])
+return attached
+"""
+
+class CoalescedRuns:
+    """
+    Run-side bookkeeping for alert dedup: the dedup keys each in-flight run holds and the repeats
+    attached to it. The API claims and attaches; the worker closes the run once it completes,
+    which reopens the dedup window and reports the repeats with the outcome.
+    """
+    def __init__(self, redis_store: RedisStore):
+        self.redis_store = redis_store
+        self._attach_script = None
+        self._close_script = None
+
+    @staticmethod
+    def claims_key(primary: str) -> str:
+        return f"dedup:claims:{primary}"
+
+    @staticmethod
+    def attached_key(primary: str) -> str:
+        return f"dedup:attached:{primary}"
+
+    def hold(self, pipe, primary: str, keys: Sequence[str], ttl: int):
+        """
+        Queues on `pipe` the record of the dedup keys the primary now owns.
+        """
+        pipe.sadd(self.claims_key(primary), *keys)
+        pipe.expire(self.claims_key(primary), ttl)
+
+    def attach(self, attachments: List[Tuple[str, str]], ttl: int) -> List[bool]:
+        """
+        Attaches (primary, alert_id) pairs in one round-trip. False where the primary has closed meanwhile.
+        """
+        if self._attach_script is None:
+            self._attach_script = self.redis_store.client.register_script(ATTACH_SCRIPT)
+        pipe = self.redis_store.client.pipeline(transaction=False)
+        for primary, alert_id in attachments:
+            self._attach_script(keys=[self.claims_key(primary), self.attached_key(primary)], args=[alert_id, ttl], client=pipe)
+        return [bool(int(reply)) for reply in pipe.execute()]
+
+    def close(self, primary: str) -> List[str]:
+        """
+        Releases the primary's dedup window and returns the alert IDs coalesced onto it
+        (empty if Redis is unavailable; the window then lapses on its TTL).
+        """
+        try:
+            if self._close_script is None:
+                self._close_script = self.redis_store.client.register_script(CLOSE_SCRIPT)
+            attached = self._close_script(keys=[self.claims_key(primary), self.attached_key(primary)], args=[primary],
+                                          client=self.redis_store.client)
+        except Exception as e:
+            logger.warning(f"Could not close the dedup window of {primary}: {e}")
+            return []
+        return list(attached)
@@ -0,0 +1,196 @@
+from langgraph.memory.redis_store import RedisStore
+from infra.cache import LRUCache
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import redis
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+# Set to 0 to stop publishing per-alert progress events (and token streaming)
+ALERT_EVENT_STREAMING = os.getenv("ALERT_EVENT_STREAMING", "1") == "1"
+ALERT_EVENT_TTL = int(os.getenv("ALERT_EVENT_TTL", "3600"))
+ALERT_EVENT_MAXLEN = 10000
+# Generated tokens are buffered and published as one coalesced chunk per node this often
+ALERT_EVENT_FLUSH_MS = int(os.getenv("ALERT_EVENT_FLUSH_MS", "100"))
+
+# Event that closes an alert's stream
+DONE_EVENT = "done"
+
+def _stream_key(alert_id: str) -> str:
+    return f"alert_events:{alert_id}"
+
+# Settings the asyncio client takes as they are; objects such as retry policies are sync-only
+_ASYNC_CONNECTION_KWARGS = (
+    "host", "port", "path", "db", "username", "password", "credential_provider", "client_name", "protocol",
+    "socket_timeout", "socket_connect_timeout", "socket_keepalive", "socket_keepalive_options",
+    "health_check_interval", "encoding", "encoding_errors",
+    "ssl_keyfile", "ssl_certfile", "ssl_cert_reqs", "ssl_ca_certs", "ssl_ca_data", "ssl_ca_path",
+    "ssl_check_hostname", "ssl_min_version", "ssl_ciphers", "ssl_password",
+)
+
+def async_client_for(client: redis.Redis) -> aioredis.Redis:
+    """
+    asyncio client connecting like the given sync one (credentials, TLS, unix socket), with decoded responses.
+    """
+    pool = client.connection_pool
+    if issubclass(pool.connection_class, redis.SSLConnection):
+        connection_class = aioredis.SSLConnection
+    elif issubclass(pool.connection_class, redis.UnixDomainSocketConnection):
+        connection_class = aioredis.UnixDomainSocketConnection
+    else:
+        connection_class = aioredis.Connection
+    kwargs = {key: value for key, value in pool.connection_kwargs.items() if key in _ASYNC_CONNECTION_KWARGS}
+    return aioredis.Redis(connection_pool=aioredis.ConnectionPool(connection_class=connection_class, decode_responses=True, **kwargs))
+
+class TokenBuffer:
+    """
+    on_token callback for one node that only appends to a buffer, so generation never waits on Redis.
+    """
+    def __init__(self, node: str):
+        self.node = node
+        self._parts: List[str] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, text: str):
+        with self._lock:
+            self._parts.append(text)
+
+    def drain(self) -> str:
+        with self._lock:
+            text = "".join(self._parts)
+            self._parts = []
+        return text
+
+class AlertEventStream:
+    """
+    Per-alert progress events (node start/end, generated tokens, completion) on a Redis Stream.
+    Workers publish; the API replays and tails the stream for SSE clients, so the two can live in
+    different processes and late subscribers still see the whole run.
+
+    Generated tokens are buffered per node and written by a background flusher every flush_ms,
+    one pipeline for every active run; other events flush their run's buffers first, so the
+    stream keeps generation order. The stream's TTL is set once, with its first event.
+    """
+    def __init__(self, redis_store: Optional[RedisStore] = None, enabled: bool = ALERT_EVENT_STREAMING,
+                 flush_ms: int = ALERT_EVENT_FLUSH_MS):
+        self.redis_store = redis_store or RedisStore(host=os.getenv("REDIS_HOST", "localhost"), port=int(os.getenv("REDIS_PORT", "6379")))
+        self.enabled = enabled
+        self.flush_interval = flush_ms / 1000
+        self._async_client = None
+        # alert_id -> token buffers of its nodes, until the run's done event
+        self._buffers: Dict[str, List[TokenBuffer]] = {}
+        # Streams whose TTL this process has already set
+        self._expiring = LRUCache(max_entries=ALERT_EVENT_MAXLEN)
+        # Serializes writes, so a flushed chunk can never land after a later event of its run
+        self._write_lock = threading.Lock()
+        # Guards _buffers only, so registering a buffer on an event loop never waits on a Redis write
+        self._buffers_lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+
+    def _append(self, pipe, key: str, event: str, data: Dict[str, Any], new_keys: List[str]):
+        pipe.xadd(key, {"event": event, "data": json.dumps(data, default=str)}, maxlen=ALERT_EVENT_MAXLEN, approximate=True)
+        if self._expiring.get(key) is None and key not in new_keys:
+            pipe.expire(key, ALERT_EVENT_TTL)
+            new_keys.append(key)
+
+    def _append_tokens(self, pipe, alert_id: str, buffers: List[TokenBuffer], new_keys: List[str]) -> int:
+        chunks = 0
+        for buffer in buffers:
+            text = buffer.drain()
+            if text:
+                self._append(pipe, _stream_key(alert_id), "token", {"node": buffer.node, "text": text}, new_keys)
+                chunks += 1
+        return chunks
+
+    def _execute(self, pipe, new_keys: List[str]):
+        pipe.execute()
+        for key in new_keys:
+            self._expiring.set(key, True)
+
+    def publish(self, alert_id: str, event: str, data: Dict[str, Any]):
+        """
+        Appends an event, after any tokens still buffered for the run. Best-effort: a Redis hiccup must never fail triage.
+        """
+        if not self.enabled:
+            return
+        with self._write_lock:
+            with self._buffers_lock:
+                buffers = self._buffers.pop(alert_id, []) if event == DONE_EVENT else list(self._buffers.get(alert_id, []))
+            new_keys: List[str] = []
+            try:
+                pipe = self.redis_store.client.pipeline()
+                self._append_tokens(pipe, alert_id, buffers, new_keys)
+                self._append(pipe, _stream_key(alert_id), event, data, new_keys)
+                self._execute(pipe, new_keys)
+            except Exception as e:
+                logger.warning(f"Dropping {event} event for alert {alert_id}: {e}")
+
+    async def apublish(self, alert_id: str, event: str, data: Dict[str, Any]):
+        """
+        publish for event loops: the Redis round-trip (and any wait on the flusher) runs in a thread.
+        """
+        if not self.enabled:
+            return
+        await asyncio.to_thread(self.publish, alert_id, event, data)
+
+    def flush(self):
+        """
+        Publishes the tokens buffered for every active run in one pipeline.
+        """
+        with self._write_lock:
+            with self._buffers_lock:
+                active = [(alert_id, list(buffers)) for alert_id, buffers in self._buffers.items()]
+            new_keys: List[str] = []
+            try:
+                pipe = self.redis_store.client.pipeline()
+                chunks = sum(self._append_tokens(pipe, alert_id, buffers, new_keys) for alert_id, buffers in active)
+                if chunks:
+                    self._execute(pipe, new_keys)
+            except Exception as e:
+                logger.warning(f"Dropping buffered tokens: {e}")
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def token_publisher(self, alert_id: str, node: str) -> Optional[TokenBuffer]:
+        """
+        Returns an on_token callback that streams generated text for one node.
+        """
+        if not self.enabled:
+            return None
+        buffer = TokenBuffer(node)
+        with self._buffers_lock:
+            self._buffers.setdefault(alert_id, []).append(buffer)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="alert-event-flusher", daemon=True)
+                self._flusher.start()
+        return buffer
+
+    async def subscribe(self, alert_id: str, last_event_id: str = "0", block_ms: int = 15000) -> AsyncIterator[Optional[Tuple[str, str, Dict[str, Any]]]]:
+        """
+        Yields (event_id, event, data) from last_event_id onwards until the run is done.
+        Yields None whenever block_ms passes without events, so callers can send keep-alives.
+        """
+        if self._async_client is None:
+            self._async_client = async_client_for(self.redis_store.client)
+        key = _stream_key(alert_id)
+        while True:
+            response = await self._async_client.xread({key: last_event_id}, block=block_ms, count=100)
+            if not response:
+                yield None
+                continue
+            for event_id, fields in response[0][1]:
+                last_event_id = event_id
+                yield event_id, fields["event"], json.loads(fields["data"])
+                if fields["event"] == DONE_EVENT:
+                    return
+
+alert_events = AlertEventStream()
@@ -0,0 +1,40 @@
+from typing import Callable, Generic, Optional, TypeVar
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class Lazy(Generic[T]):
+    """
+    Thread-safe lazy provider for heavy resources (models, DB clients).
+    The factory runs once, on the first get(), instead of at import time.
+    """
+    def __init__(self, factory: Callable[[], T], name: Optional[str] = None):
+        self.factory = factory
+        self.name = name or getattr(factory, "__name__", "resource")
+        self._value: Optional[T] = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self) -> T:
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    started = time.perf_counter()
+                    self._value = self.factory()
+                    self._loaded = True
+                    logger.info(f"Initialized {self.name} in {time.perf_counter() - started:.2f}s")
+        return self._value
+
+    def __getattr__(self, name: str):
+        # Lets a Lazy stand in wherever the resource itself was used
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
@@ -7,6 +7,13 @@ from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExport
 from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
 from opentelemetry.sdk.resources import Resource
 from prometheus_client import start_http_server, Counter, Histogram, Gauge
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Each process (API, worker) that scrapes separately needs its own port
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8001"))
 
 # Prometheus Metrics
 # We use prometheus_client directly for simple metrics, 
@@ -18,12 +25,22 @@ AGENT_THROUGHPUT = Counter('agent_throughput_total', 'Total number of requests p
 DECISION_CONFIDENCE = Histogram('decision_confidence_distribution', 'Distribution of decision confidence scores')
 PROMPT_INJECTION_ATTEMPTS = Counter('prompt_injection_attempts_total', 'Total prompt injection attempts', ['result'])
 APPROVAL_WAIT_SECONDS = Histogram('approval_wait_seconds', 'Time waiting for human approval')
+INFERENCE_BATCH_SIZE = Histogram('inference_batch_size', 'Number of prompts per batched generation', buckets=(1, 2, 4, 8, 16, 32))
+INFERENCE_QUEUE_DEPTH = Gauge('inference_queue_depth', 'Generations waiting for an inference slot', ['priority'])
+INFERENCE_QUEUE_WAIT_SECONDS = Histogram('inference_queue_wait_seconds', 'Time a generation waited for an inference slot', ['priority'],
+                                         buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
 
 # FinOps & Governance Metrics
 TOKEN_USAGE_TOTAL = Counter('token_usage_total', 'Total tokens consumed', ['model', 'type']) # type=prompt/completion
 BUDGET_SPEND_DAILY = Gauge('budget_spend_daily_usd', 'Current daily spend in USD')
 POLICY_VIOLATIONS_TOTAL = Counter('policy_violations_total', 'Total policy violations detected', ['policy_type']) # type=regex/guardrail
-CACHE_HITS_TOTAL = Counter('cache_hits_total', 'Total cache hits', ['cache_type']) # type=redis/vector
+USAGE_FLUSH_SECONDS = Histogram('usage_flush_seconds', 'Time to bulk-insert buffered token usage rows')
+USAGE_BACKLOG = Gauge('usage_backlog_rows', 'Token usage rows waiting to be written')
+USAGE_ROWS_DROPPED_TOTAL = Counter('usage_rows_dropped_total', 'Token usage rows dropped because the backlog was full')
+CACHE_HITS_TOTAL = Counter('cache_hits_total', 'Total cache hits', ['cache_type']) # type=llm/redis/vector
+ALERT_QUEUE_DEPTH = Gauge('alert_queue_depth', 'Alerts waiting or in flight in the ingest queue')
+ALERT_DEAD_LETTERS_TOTAL = Counter('alert_dead_letters_total', 'Alerts moved to the dead-letter stream')
+ALERTS_COALESCED_TOTAL = Counter('alerts_coalesced_total', 'Duplicate alerts attached to an in-flight run', ['match']) # match=raw/fingerprint
 
 def setup_observability(service_name: str = "soc-copilot"):
     resource = Resource.create({"service.name": service_name})
@@ -41,13 +58,22 @@ def setup_observability(service_name: str = "soc-copilot"):
     # meter_provider = MeterProvider(resource=resource, metric_readers=[metric_reader])
     # metrics.set_meter_provider(meter_provider)
     
-    # Start Prometheus client server
+    return trace.get_tracer(__name__)
+
+_metrics_server_started = False
+
+def start_metrics_server(port: int = METRICS_PORT):
+    """
+    Starts the Prometheus client server. Called from process startup, never at import.
+    """
+    global _metrics_server_started
+    if _metrics_server_started:
+        return
     # In a real app, this might be on a separate port or mounted on FastAPI
     try:
-        start_http_server(8001)
-    except Exception:
-        pass # Already started
-
-    return trace.get_tracer(__name__)
+        start_http_server(port)
+        _metrics_server_started = True
+    except OSError as e:
+        logger.warning(f"Prometheus metrics server not started on port {port}: {e}")
 
 tracer = setup_observability()
@@ -0,0 +1,134 @@
+from api.schemas import Alert
+from langgraph.memory.redis_store import RedisStore
+from infra.observability import ALERT_QUEUE_DEPTH, ALERT_DEAD_LETTERS_TOTAL
+from typing import List, Tuple
+import logging
+import os
+import redis
+
+logger = logging.getLogger(__name__)
+
+ALERT_STREAM = os.getenv("ALERT_STREAM", "alerts:ingest")
+ALERT_DEAD_LETTER_STREAM = os.getenv("ALERT_DEAD_LETTER_STREAM", "alerts:dead")
+ALERT_CONSUMER_GROUP = os.getenv("ALERT_CONSUMER_GROUP", "soc-workers")
+# Backpressure: /ingest answers 503 once this many alerts are waiting or in flight
+ALERT_QUEUE_MAX_DEPTH = int(os.getenv("ALERT_QUEUE_MAX_DEPTH", "10000"))
+# A delivery not acked within this many ms is considered abandoned (worker crash) and is redelivered.
+# Must exceed the slowest expected graph run.
+ALERT_CLAIM_IDLE_MS = int(os.getenv("ALERT_CLAIM_IDLE_MS", "300000"))
+# Deliveries after which an alert is moved to the dead-letter stream instead of retried again
+ALERT_MAX_DELIVERIES = int(os.getenv("ALERT_MAX_DELIVERIES", "5"))
+
+class QueueFull(Exception):
+    pass
+
+class AlertQueue:
+    """
+    Durable alert work queue on a Redis Stream with a consumer group.
+    Delivery is at-least-once: entries stay pending until a worker acks them, and
+    entries abandoned by a dead worker are reclaimed by the others.
+    """
+    def __init__(self, redis_store: RedisStore, stream: str = ALERT_STREAM, group: str = ALERT_CONSUMER_GROUP,
+                 max_depth: int = ALERT_QUEUE_MAX_DEPTH):
+        self.redis_store = redis_store
+        self.stream = stream
+        self.group = group
+        self.max_depth = max_depth
+
+    @property
+    def client(self):
+        return self.redis_store.client
+
+    def ensure_group(self):
+        """
+        Creates the consumer group (and stream) if needed. Safe to call from every worker.
+        """
+        try:
+            self.client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def depth(self) -> int:
+        # Acked entries are deleted, so the stream length is the number waiting or in flight
+        return self.client.xlen(self.stream)
+
+    def enqueue(self, alert: Alert) -> int:
+        """
+        Appends an alert and returns its position in the queue.
+        Raises QueueFull when the queue is saturated.
+        """
+        depth = self.depth()
+        ALERT_QUEUE_DEPTH.set(depth)
+        if depth >= self.max_depth:
+            raise QueueFull(f"Alert queue is full ({depth} pending)")
+        self.client.xadd(self.stream, {"alert": alert.model_dump_json()})
+        return depth + 1
+
+    def enqueue_many(self, alerts: List[Alert]) -> List[int]:
+        """
+        Appends a batch in one round-trip and returns each alert's queue position.
+        The batch is rejected as a whole (QueueFull) if it does not fit.
+        """
+        depth = self.depth()
+        ALERT_QUEUE_DEPTH.set(depth)
+        if depth + len(alerts) > self.max_depth:
+            raise QueueFull(f"Alert queue cannot take {len(alerts)} more alerts ({depth} pending)")
+        pipe = self.client.pipeline(transaction=False)
+        for alert in alerts:
+            pipe.xadd(self.stream, {"alert": alert.model_dump_json()})
+        pipe.execute()
+        return [depth + i + 1 for i in range(len(alerts))]
+
+    def read(self, consumer: str, count: int = 1, block_ms: int = 2000) -> List[Tuple[str, Alert]]:
+        """
+        Reads new entries for this consumer, blocking up to block_ms.
+        """
+        response = self.client.xreadgroup(self.group, consumer, {self.stream: ">"}, count=count, block=block_ms)
+        if not response:
+            return []
+        _, entries = response[0]
+        return self._decode(entries)
+
+    def ack(self, message_id: str):
+        pipe = self.client.pipeline()
+        pipe.xack(self.stream, self.group, message_id)
+        pipe.xdel(self.stream, message_id)
+        pipe.execute()
+
+    def claim_abandoned(self, consumer: str, count: int = 10, min_idle_ms: int = ALERT_CLAIM_IDLE_MS) -> List[Tuple[str, Alert]]:
+        """
+        Takes over entries other consumers read but never acked.
+        Entries that already exhausted their deliveries are dead-lettered instead.
+        """
+        response = self.client.xautoclaim(self.stream, self.group, consumer, min_idle_time=min_idle_ms,
+                                          start_id="0-0", count=count)
+        entries = response[1]
+        if not entries:
+            return []
+
+        retryable = []
+        for message_id, fields in entries:
+            pending = self.client.xpending_range(self.stream, self.group, min=message_id, max=message_id, count=1)
+            deliveries = pending[0]["times_delivered"] if pending else 0
+            if deliveries > ALERT_MAX_DELIVERIES:
+                self.dead_letter(message_id, fields, reason=f"exceeded {ALERT_MAX_DELIVERIES} deliveries")
+            else:
+                retryable.append((message_id, fields))
+        return self._decode(retryable)
+
+    def dead_letter(self, message_id: str, fields: dict, reason: str):
+        logger.error(f"Dead-lettering alert queue entry {message_id}: {reason}")
+        ALERT_DEAD_LETTERS_TOTAL.inc()
+        self.client.xadd(ALERT_DEAD_LETTER_STREAM, {**fields, "reason": reason, "message_id": message_id})
+        self.ack(message_id)
+
+    def _decode(self, entries) -> List[Tuple[str, Alert]]:
+        decoded = []
+        for message_id, fields in entries:
+            try:
+                decoded.append((message_id, Alert.model_validate_json(fields["alert"])))
+            except Exception as e:
+                # Never retry a poison message
+                self.dead_letter(message_id, fields, reason=f"undecodable payload: {e}")
+        return decoded
@@ -0,0 +1,86 @@
+from typing import Callable, Dict, Optional
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Preload heavy resources (models, cross-encoder, vector store) before taking traffic
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "0") == "1"
+WARMUP_PROMPT = "System: Reply with OK.\nUser: ping\nAssistant:"
+
+class Readiness:
+    """
+    Tracks startup steps so readiness probes can tell a live process from a ready one.
+    """
+    def __init__(self):
+        self.steps: Dict[str, str] = {}
+        self.errors: Dict[str, str] = {}
+
+    def pending(self, name: str):
+        self.steps[name] = "pending"
+
+    def done(self, name: str, error: Optional[Exception] = None):
+        self.steps[name] = "failed" if error else "ready"
+        if error:
+            self.errors[name] = str(error)
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.steps) and all(state == "ready" for state in self.steps.values())
+
+    def status(self) -> Dict[str, object]:
+        return {"ready": self.ready, "steps": dict(self.steps), "errors": dict(self.errors)}
+
+readiness = Readiness()
+
+async def run_warmup(steps: Dict[str, Callable[[], None]], state: Readiness = readiness):
+    """
+    Runs blocking warmup steps one after another in a worker thread, recording each in `state`.
+    A failed step is logged and left "failed"; the resource still loads lazily on first use.
+    """
+    for name in steps:
+        state.pending(name)
+    for name, step in steps.items():
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(step)
+        except Exception as e:
+            logger.error(f"Warmup step {name} failed: {e}")
+            state.done(name, e)
+            continue
+        state.done(name)
+        logger.info(f"Warmup step {name} finished in {time.perf_counter() - started:.2f}s")
+
+def warm_models():
+    """
+    Loads the shared adapter and runs one short generation so the first alert skips the cold path.
+    """
+    from models.registry import model_registry
+    adapter = model_registry.acquire()
+    try:
+        # Bypass the response cache so the weights are actually exercised
+        target = getattr(adapter, "adapter", adapter)
+        target.predict(WARMUP_PROMPT, max_tokens=1, temp=0.0)
+    finally:
+        model_registry.release()
+
+def warm_verifier():
+    from langgraph.nodes.verifier import verifier
+    verifier.safety_classifier
+
+def warm_vector_store():
+    from langgraph.nodes.retriever import vector_store
+    vector_store.get()
+
+def warm_anomaly_history():
+    from middleware.accounting import replay_usage_history
+    replay_usage_history()
+
+WORKER_WARMUP_STEPS = {
+    "anomaly_history": warm_anomaly_history,
+    "models": warm_models,
+    "verifier": warm_verifier,
+    "vector_store": warm_vector_store,
+}
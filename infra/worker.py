@@ -0,0 +1,161 @@
+from infra.queue import AlertQueue, ALERT_CLAIM_IDLE_MS
+from infra.observability import start_metrics_server
+from infra.warmup import WARMUP_ON_START, WORKER_WARMUP_STEPS, run_warmup
+from langgraph.memory.redis_store import RedisStore
+from langgraph.graph import process_alert
+from langgraph.nodes.retriever import retrieve_context_batch
+from middleware.accounting import usage_writer
+from api.schemas import Alert
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+
+logger = logging.getLogger(__name__)
+
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+# Wait after a failed queue read, doubling on consecutive failures up to the max
+WORKER_RETRY_SECONDS = float(os.getenv("WORKER_RETRY_SECONDS", "1"))
+WORKER_RETRY_MAX_SECONDS = float(os.getenv("WORKER_RETRY_MAX_SECONDS", "30"))
+
+class AlertWorker:
+    """
+    Consumes the alert queue and runs the agent graph, up to `concurrency` alerts at a time.
+    Each read takes as many alerts as there are free slots; when it returns several, their
+    context is retrieved in one batch before the runs start.
+    Runs as its own process so workers scale independently of API replicas.
+    """
+    def __init__(self, queue: AlertQueue, concurrency: int = WORKER_CONCURRENCY, consumer: Optional[str] = None):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self._stopping = asyncio.Event()
+        self._tasks = set()
+
+    def stop(self):
+        self._stopping.set()
+
+    async def run(self):
+        slots = asyncio.Semaphore(self.concurrency)
+        reclaimer = asyncio.create_task(self._reclaim_loop(slots))
+        logger.info(f"Worker {self.consumer} consuming {self.queue.stream} with concurrency {self.concurrency}")
+
+        group_ready = False
+        delay = WORKER_RETRY_SECONDS
+        while not self._stopping.is_set():
+            await slots.acquire()
+            free = 1
+            while free < self.concurrency and not slots.locked():
+                await slots.acquire()
+                free += 1
+            try:
+                if not group_ready:
+                    await asyncio.to_thread(self.queue.ensure_group)
+                    group_ready = True
+                messages = await asyncio.to_thread(self.queue.read, self.consumer, free)
+            except Exception as e:
+                # Redis restarts and failovers must not kill the worker (or its reclaimer)
+                for _ in range(free):
+                    slots.release()
+                logger.error(f"Reading {self.queue.stream} failed, retrying in {delay:.0f}s: {e}")
+                # The group may have gone with the data (e.g. Redis restarted without persistence)
+                group_ready = False
+                await self._sleep(delay)
+                delay = min(delay * 2, WORKER_RETRY_MAX_SECONDS)
+                continue
+            delay = WORKER_RETRY_SECONDS
+            for _ in range(free - len(messages)):
+                slots.release()
+            contexts = await self._prefetch_context([alert for _, alert in messages]) if len(messages) > 1 else None
+            for i, (message_id, alert) in enumerate(messages):
+                self._dispatch(slots, message_id, alert, contexts[i] if contexts else None)
+
+        reclaimer.cancel()
+        # Let in-flight alerts finish; anything unfinished stays pending and is reclaimed elsewhere
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _prefetch_context(self, alerts: List[Alert]) -> Optional[List[List[Dict[str, Any]]]]:
+        """
+        Context for several alerts from one embedding batch and one index query; None if that fails,
+        in which case every run retrieves its own.
+        """
+        try:
+            results = await asyncio.to_thread(retrieve_context_batch, [{"alert": alert} for alert in alerts])
+        except Exception as e:
+            logger.warning(f"Batched context retrieval for {len(alerts)} alerts failed: {e}")
+            return None
+        return [result["context"] for result in results]
+
+    async def _sleep(self, seconds: float):
+        # Returns early when the worker is stopped
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _reclaim_loop(self, slots: asyncio.Semaphore):
+        interval = max(ALERT_CLAIM_IDLE_MS / 2000, 1)
+        while not self._stopping.is_set():
+            await asyncio.sleep(interval)
+            try:
+                messages = await asyncio.to_thread(self.queue.claim_abandoned, self.consumer, self.concurrency)
+            except Exception as e:
+                logger.error(f"Reclaiming abandoned alerts failed: {e}")
+                continue
+            for message_id, alert in messages:
+                logger.warning(f"Retrying abandoned alert {alert.alert_id} ({message_id})")
+                await slots.acquire()
+                self._dispatch(slots, message_id, alert)
+
+    def _dispatch(self, slots: asyncio.Semaphore, message_id: str, alert: Alert,
+                  context: Optional[List[Dict[str, Any]]] = None):
+        task = asyncio.create_task(self._handle(message_id, alert, context))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(lambda _: slots.release())
+
+    async def _handle(self, message_id: str, alert: Alert, context: Optional[List[Dict[str, Any]]] = None):
+        try:
+            await process_alert(alert, context=context)
+        except Exception as e:
+            # Not acked: the entry stays pending and is retried once it goes idle
+            logger.error(f"Processing alert {alert.alert_id} failed, will retry: {e}")
+            return
+        try:
+            await asyncio.to_thread(self.queue.ack, message_id)
+        except Exception as e:
+            # Stays pending, so the alert is redelivered and run again once idle
+            logger.error(f"Acking alert {alert.alert_id} ({message_id}) failed: {e}")
+
+async def run_worker(concurrency: int, consumer: Optional[str] = None, warmup: bool = WARMUP_ON_START):
+    start_metrics_server()
+    if warmup:
+        # Readiness gate: take no alerts until the models are loaded and have generated once
+        await run_warmup(WORKER_WARMUP_STEPS)
+
+    redis_store = RedisStore(host=os.getenv("REDIS_HOST", "localhost"), port=int(os.getenv("REDIS_PORT", "6379")))
+    worker = AlertWorker(AlertQueue(redis_store), concurrency=concurrency, consumer=consumer)
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+
+    try:
+        await worker.run()
+    finally:
+        # Persist usage recorded by the last in-flight alerts
+        await asyncio.to_thread(usage_writer.close)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Alert triage worker")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY)
+    parser.add_argument("--name", default=None, help="Consumer name (defaults to host-pid)")
+    parser.add_argument("--warmup", action="store_true", default=WARMUP_ON_START, help="Preload models before consuming")
+    args = parser.parse_args()
+
+    asyncio.run(run_worker(args.concurrency, args.name, args.warmup))
@@ -0,0 +1,119 @@
+import re
+from collections import deque
+from typing import Dict, List, Optional, Set
+
+_REGEX_METACHARS = set(".^$*+?{}[]|()")
+
+def as_literal(pattern: str) -> Optional[str]:
+    """
+    Returns the plain string a pattern matches if it uses no regex features
+    (escaped punctuation such as `eval\\(` counts as literal), otherwise None.
+    """
+    chars = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            if i + 1 >= len(pattern):
+                return None
+            escaped = pattern[i + 1]
+            # \d, \s, \b, \n ... are classes/anchors, not literals
+            if escaped.isalnum():
+                return None
+            chars.append(escaped)
+            i += 2
+            continue
+        if c in _REGEX_METACHARS:
+            return None
+        chars.append(c)
+        i += 1
+    return "".join(chars) if chars else None
+
+class AhoCorasick:
+    """
+    Multi-pattern literal matcher. Finds every pattern occurring in a text in one pass,
+    independent of the number of patterns. Matching is case-insensitive.
+    """
+    def __init__(self, literals: List[str]):
+        # Trie as a list of {char: state}; outputs[state] holds pattern indices ending there
+        self.goto: List[Dict[str, int]] = [{}]
+        self.outputs: List[Set[int]] = [set()]
+        self.fail: List[int] = [0]
+
+        for index, literal in enumerate(literals):
+            state = 0
+            for c in literal.lower():
+                nxt = self.goto[state].get(c)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][c] = nxt
+                    self.goto.append({})
+                    self.outputs.append(set())
+                    self.fail.append(0)
+                state = nxt
+            self.outputs[state].add(index)
+
+        # Breadth-first construction of failure links
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and c not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(c, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                self.outputs[nxt] |= self.outputs[self.fail[nxt]]
+
+    def find_all(self, text: str) -> Set[int]:
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        found: Set[int] = set()
+        state = 0
+        for c in text.lower():
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            if outputs[state]:
+                found |= outputs[state]
+        return found
+
+class CompiledRuleSet:
+    """
+    A policy rule set compiled for single-pass matching.
+    Literal rules go through one Aho-Corasick automaton. The remaining regex rules are
+    combined into one alternation used as a prefilter, so they are only evaluated
+    individually when at least one of them matches.
+    """
+    def __init__(self, patterns: List[str]):
+        self.patterns = list(patterns)
+        literal_indices, literals, regex_indices = [], [], []
+        for index, pattern in enumerate(self.patterns):
+            literal = as_literal(pattern)
+            if literal is None:
+                regex_indices.append(index)
+            else:
+                literal_indices.append(index)
+                literals.append(literal)
+
+        self._literal_indices = literal_indices
+        self._automaton = AhoCorasick(literals) if literals else None
+        self._regexes = [(index, re.compile(self.patterns[index], re.IGNORECASE)) for index in regex_indices]
+        self._regex_prefilter = None
+        if self._regexes:
+            try:
+                self._regex_prefilter = re.compile("|".join(f"(?:{self.patterns[i]})" for i in regex_indices), re.IGNORECASE)
+            except re.error:
+                # e.g. numbered backreferences shift when combined; fall back to per-rule matching
+                self._regex_prefilter = None
+
+    def match(self, text: str) -> List[str]:
+        """
+        Returns every pattern that matches the text, in rule order.
+        """
+        hits: Set[int] = set()
+        if self._automaton:
+            hits.update(self._literal_indices[i] for i in self._automaton.find_all(text))
+        if self._regexes and (self._regex_prefilter is None or self._regex_prefilter.search(text)):
+            hits.update(index for index, regex in self._regexes if regex.search(text))
+        return [self.patterns[i] for i in sorted(hits)]
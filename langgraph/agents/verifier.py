@@ -1,75 +1,214 @@
 import re
-from typing import List, Dict, Any
+import logging
+import os
+import threading
+import time
+from typing import List, Dict, Any, Optional
+from langgraph.agents.policy_matcher import CompiledRuleSet
+from infra.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Optional rules file (one pattern per line, '#' comments). Edits are picked up without a restart.
+POLICY_RULES_PATH = os.getenv("POLICY_RULES_PATH")
+POLICY_RELOAD_INTERVAL = float(os.getenv("POLICY_RELOAD_INTERVAL", "1.0"))
+
+DEFAULT_FORBIDDEN_PATTERNS = [
+    r"sudo ", r"rm -rf", r"chmod ", r"wget ", r"curl ",  # Shell commands
+    r"eval\(", r"exec\(",  # Code execution
+    r"ignore previous instructions", # Prompt injection
+    r"<script>", # XSS
+]
+
+def load_rules(path: str) -> List[str]:
+    """
+    Reads one pattern per line, skipping blanks and '#' comments.
+    """
+    with open(path, encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f if line.strip() and not line.lstrip().startswith("#")]
 
 class PolicyEngine:
-    def __init__(self):
-        self.forbidden_patterns = [
-            r"sudo ", r"rm -rf", r"chmod ", r"wget ", r"curl ",  # Shell commands
-            r"eval\(", r"exec\(",  # Code execution
-            r"ignore previous instructions", # Prompt injection
-            r"<script>", # XSS
-        ]
+    def __init__(self, rules_path: Optional[str] = POLICY_RULES_PATH, reload_interval: float = POLICY_RELOAD_INTERVAL):
+        self.rules_path = rules_path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._rules_mtime = None
+        self._next_reload_check = 0.0
+        self.forbidden_patterns = list(DEFAULT_FORBIDDEN_PATTERNS)
+        if self.rules_path:
+            self.reload()
+
+    @property
+    def forbidden_patterns(self) -> List[str]:
+        return self._rules.patterns
+
+    @forbidden_patterns.setter
+    def forbidden_patterns(self, patterns: List[str]):
+        # Compile before swapping so concurrent checks always see a complete rule set
+        self._rules = CompiledRuleSet(patterns)
+
+    def reload(self) -> bool:
+        """
+        Recompiles the rules file if it changed. A broken or empty file (e.g. caught mid-write)
+        keeps the current rules: an empty rule set would approve everything.
+        """
+        try:
+            mtime = os.stat(self.rules_path).st_mtime_ns
+        except OSError as e:
+            logger.error(f"Policy rules file unavailable, keeping current rules: {e}")
+            return False
+        if mtime == self._rules_mtime:
+            return False
+        try:
+            patterns = load_rules(self.rules_path)
+            if not patterns:
+                # Remembered, so the error is logged once per edit; the next write is picked up again
+                self._rules_mtime = mtime
+                logger.error(f"Policy rules file {self.rules_path} has no rules, keeping current rules")
+                return False
+            self.forbidden_patterns = patterns
+        except (OSError, re.error) as e:
+            logger.error(f"Failed to load policy rules from {self.rules_path}, keeping current rules: {e}")
+            return False
+        self._rules_mtime = mtime
+        logger.info(f"Loaded {len(self.forbidden_patterns)} policy rules from {self.rules_path}")
+        return True
+
+    def _maybe_reload(self):
+        if not self.rules_path:
+            return
+        now = time.monotonic()
+        if now < self._next_reload_check or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._next_reload_check = now + self.reload_interval
+            self.reload()
+        finally:
+            self._lock.release()
 
     def check_policy(self, text: str) -> Dict[str, Any]:
         """
         Checks text against forbidden patterns.
         """
-        violations = []
-        for pattern in self.forbidden_patterns:
-            if re.search(pattern, text, re.IGNORECASE):
-                violations.append(pattern)
+        self._maybe_reload()
+        violations = self._rules.match(text)
         
         if violations:
             return {"verdict": "FAIL", "violations": violations}
         return {"verdict": "PASS"}
 
-from sentence_transformers import CrossEncoder
+import hashlib
 import numpy as np
 
+GROUNDEDNESS_MODEL = os.getenv("GROUNDEDNESS_MODEL", "cross-encoder/nli-distilroberta-base")
+# off: skip the cross-encoder; report: attach scores only; enforce: FAIL plans with ungrounded steps
+GROUNDEDNESS_MODE = os.getenv("GROUNDEDNESS_MODE", "report")
+GROUNDEDNESS_THRESHOLD = float(os.getenv("GROUNDEDNESS_THRESHOLD", "0.5"))
+GROUNDEDNESS_CACHE_SIZE = int(os.getenv("GROUNDEDNESS_CACHE_SIZE", "10000"))
+# nli-distilroberta-base labels: 0 contradiction, 1 entailment, 2 neutral (see model card)
+ENTAILMENT_INDEX = 1
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
 class OutputVerifier:
-    def __init__(self, policy_engine: PolicyEngine):
+    def __init__(self, policy_engine: PolicyEngine, model_name: str = GROUNDEDNESS_MODEL,
+                 mode: str = GROUNDEDNESS_MODE, threshold: float = GROUNDEDNESS_THRESHOLD):
         self.policy_engine = policy_engine
-        # Load a small cross-encoder for safety classification
-        # For MVP, we use a small model. In production, this would be a specialized safety model.
-        self.safety_classifier = CrossEncoder('cross-encoder/nli-distilroberta-base')
-        self.groundedness_threshold = 0.5
+        self.model_name = model_name
+        self.mode = mode
+        self.groundedness_threshold = threshold
+        # The cross-encoder is loaded on first use, so policy-only callers never pay for it
+        self._safety_classifier = None
+        self._load_lock = threading.Lock()
+        self._score_cache = LRUCache(max_entries=GROUNDEDNESS_CACHE_SIZE)
 
-    def verify(self, output: str, context: List[Dict[str, Any]]) -> Dict[str, Any]:
+    @property
+    def safety_classifier(self):
+        if self._safety_classifier is None:
+            with self._load_lock:
+                if self._safety_classifier is None:
+                    from sentence_transformers import CrossEncoder
+                    logger.info(f"Loading groundedness cross-encoder {self.model_name}")
+                    self._safety_classifier = CrossEncoder(self.model_name)
+        return self._safety_classifier
+
+    def verify(self, output: str, context: List[Dict[str, Any]], steps: Optional[List[str]] = None) -> Dict[str, Any]:
         """
         Verifies model output against policy and context.
+        steps are the claims checked for groundedness; defaults to the non-empty lines of output.
         """
         # 1. Policy Check
         policy_result = self.policy_engine.check_policy(output)
         if policy_result["verdict"] == "FAIL":
             return policy_result
 
-        # 2. Safety Classifier (Cross-Encoder)
-        # We check if the output contradicts safety guidelines (simplified)
-        # Or we can use it to check entailment with context.
-        # Here we demonstrate groundedness: Does the context support the output?
-        
-        if not context:
+        return self.check_groundedness(output, context, steps)
+
+    def check_groundedness(self, output: str, context: List[Dict[str, Any]], steps: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Cross-encoder check only (no policy). Lets callers run the cheap regex policy first
+        and schedule this alongside other expensive checks.
+        """
+        if self.mode == "off":
+            return {"verdict": "PASS", "confidence": 0.5, "note": "Groundedness check disabled"}
+
+        chunks = [item["content"] for item in context if item.get("content")] if context else []
+        if not chunks:
             # If no context, we can't check groundedness. 
             # Depending on policy, we might warn or pass.
             return {"verdict": "PASS", "confidence": 0.5, "note": "No context for groundedness check"}
 
-        # Check groundedness against top context chunk
-        # We take the output and the top context chunk and check entailment.
-        top_context = context[0]["content"]
-        scores = self.safety_classifier.predict([(top_context, output)])
-        # Scores are [contradiction, neutral, entailment] for NLI models usually, 
-        # or just a float for binary classifiers. 
-        # 'cross-encoder/nli-distilroberta-base' outputs logits for [contradiction, entailment, neutral] (check model card)
-        # Actually, nli-distilroberta-base outputs 3 classes.
-        # Let's assume a simpler binary "relatedness" or use a specific model.
-        # For this MVP, let's use the score as a proxy for "relevance/support".
-        # If the model predicts "entailment" (index 1 usually, or 2 depending on training), we pass.
-        
-        # Simpler approach for MVP: Use a similarity score or just pass if policy passes.
-        # Real implementation requires a fine-tuned model.
-        # We will mock the logic but load the model to show integration.
-        
-        return {"verdict": "PASS", "confidence": 0.9}
+        # 2. Groundedness: is each step entailed by at least one retrieved chunk?
+        steps = [step for step in (steps if steps is not None else output.splitlines()) if step.strip()]
+        if not steps:
+            return {"verdict": "PASS", "confidence": 0.5, "note": "No steps to check"}
+
+        scores = self.score_groundedness(chunks, steps)
+        step_scores = scores.max(axis=0)
+        ungrounded = [step for step, score in zip(steps, step_scores) if score < self.groundedness_threshold]
+        result = {
+            "verdict": "PASS",
+            "confidence": float(step_scores.min()),
+            "groundedness": {
+                "mode": self.mode,
+                "step_scores": [round(float(score), 4) for score in step_scores],
+                "ungrounded_steps": ungrounded,
+            },
+        }
+        if ungrounded and self.mode == "enforce":
+            result["verdict"] = "FAIL"
+            result["reasoning"] = f"{len(ungrounded)} step(s) not supported by retrieved context"
+        return result
+
+    def score_groundedness(self, chunks: List[str], steps: List[str]) -> np.ndarray:
+        """
+        Returns a (chunks x steps) matrix of entailment probabilities.
+        Uncached pairs are scored in a single batched predict call.
+        """
+        chunk_keys = [_digest(chunk) for chunk in chunks]
+        step_keys = [_digest(step) for step in steps]
+        scores = np.zeros((len(chunks), len(steps)), dtype=np.float32)
+
+        missing = []
+        for i, chunk_key in enumerate(chunk_keys):
+            for j, step_key in enumerate(step_keys):
+                cached = self._score_cache.get((chunk_key, step_key))
+                if cached is None:
+                    missing.append((i, j))
+                else:
+                    scores[i, j] = cached
+
+        if missing:
+            logits = np.asarray(self.safety_classifier.predict([(chunks[i], steps[j]) for i, j in missing]), dtype=np.float32)
+            # Softmax over the NLI classes, keep P(entailment)
+            logits = logits - logits.max(axis=1, keepdims=True)
+            probs = np.exp(logits)
+            probs /= probs.sum(axis=1, keepdims=True)
+            for (i, j), prob in zip(missing, probs[:, ENTAILMENT_INDEX]):
+                scores[i, j] = prob
+                self._score_cache.set((chunk_keys[i], step_keys[j]), float(prob))
+        return scores
 
 from models.adapter import ModelAdapter
 from models.prompts import get_system_prompt
@@ -79,18 +218,32 @@ class LLMGuardrail:
     def __init__(self, model_adapter: ModelAdapter):
         self.model = model_adapter
         self.system_prompt = get_system_prompt("guardrail")
+        # The long guardrail prompt is identical on every call, so the adapter can keep it evaluated
+        self.prefix = f"{self.system_prompt}\n\n"
+        register_prefix = getattr(self.model, "register_prefix", None)
+        if register_prefix:
+            register_prefix("guardrail", self.prefix)
+
+    def _build_prompt(self, input_text: str) -> str:
+        # Construct the full prompt
+        return f"{self.prefix}Input to AI Agent:\n{input_text}\n\nOutput (JSON):"
 
     def check(self, input_text: str) -> Dict[str, Any]:
         """
         Uses an LLM to check if the input is safe.
         """
-        # Construct the full prompt
-        full_prompt = f"{self.system_prompt}\n\nInput to AI Agent:\n{input_text}\n\nOutput (JSON):"
-        
         # Call the model
-        response = self.model.predict(full_prompt, max_tokens=100, temp=0.0)
-        text = response["text"]
-        
+        response = self.model.predict(self._build_prompt(input_text), max_tokens=100, temp=0.0)
+        return self._parse_decision(response["text"])
+
+    async def acheck(self, input_text: str) -> Dict[str, Any]:
+        """
+        Async variant of check. Does not block the event loop.
+        """
+        response = await self.model.apredict(self._build_prompt(input_text), max_tokens=100, temp=0.0)
+        return self._parse_decision(response["text"])
+
+    def _parse_decision(self, text: str) -> Dict[str, Any]:
         # Parse JSON
         try:
             # Try to find JSON block if model chats around it
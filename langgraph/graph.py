@@ -1,22 +1,51 @@
 from langgraph.graph import StateGraph, END
 from langgraph.state import AgentState
-from langgraph.nodes.retriever import retrieve_context
-from langgraph.nodes.analyst import analyze_alert
-from langgraph.nodes.planner import plan_remediation
-from langgraph.nodes.verifier import verify_plan
+from langgraph.nodes.retriever import aretrieve_context
+from langgraph.nodes.analyst import aanalyze_alert
+from langgraph.nodes.planner import aplan_remediation
+from langgraph.nodes.verifier import averify_plan
+from langgraph.nodes.router import aroute_alert, next_node, ROUTE_TEMPLATE, ROUTE_LLM
+from langgraph.nodes.template import atemplate_remediation
+from infra.events import alert_events, DONE_EVENT
+from models.scheduler import set_request_priority
+from infra.coalescing import CoalescedRuns
+import asyncio
+import time
+
+# Closes each run's dedup window and collects the duplicates the API attached to it
+coalesced_runs = CoalescedRuns(alert_events.redis_store)
+
+def _with_events(name, node):
+    """
+    Wraps a node so subscribers see when it starts and finishes.
+    """
+    async def run(state):
+        alert_id = state["alert"].alert_id
+        await alert_events.apublish(alert_id, "node_start", {"node": name})
+        started = time.perf_counter()
+        result = await node(state)
+        await alert_events.apublish(alert_id, "node_end", {"node": name, "duration_ms": round((time.perf_counter() - started) * 1000, 1)})
+        return result
+    return run
 
 # Define the Graph
 workflow = StateGraph(AgentState)
 
 # Add Nodes
-workflow.add_node("retrieve", retrieve_context)
-workflow.add_node("analyze", analyze_alert)
-workflow.add_node("plan", plan_remediation)
-workflow.add_node("verify", verify_plan)
+# Async variants keep blocking inference off the API event loop
+workflow.add_node("retrieve", _with_events("retrieve", aretrieve_context))
+workflow.add_node("route", _with_events("route", aroute_alert))
+workflow.add_node("template", _with_events("template", atemplate_remediation))
+workflow.add_node("analyze", _with_events("analyze", aanalyze_alert))
+workflow.add_node("plan", _with_events("plan", aplan_remediation))
+workflow.add_node("verify", _with_events("verify", averify_plan))
 
 # Define Edges
 workflow.set_entry_point("retrieve")
-workflow.add_edge("retrieve", "analyze")
+workflow.add_edge("retrieve", "route")
+# Alerts matching a routing rule (e.g. LOW severity) skip the analyst and planner LLM calls
+workflow.add_conditional_edges("route", next_node, {ROUTE_TEMPLATE: "template", ROUTE_LLM: "analyze"})
+workflow.add_edge("template", "verify")
 workflow.add_edge("analyze", "plan")
 workflow.add_edge("plan", "verify")
 workflow.add_edge("verify", END)
@@ -24,23 +53,44 @@ workflow.add_edge("verify", END)
 # Compile
 app = workflow.compile()
 
-async def process_alert(alert):
+async def process_alert(alert, context=None):
     """
-    Entry point for the API to trigger the graph.
+    Entry point for queue workers to run the graph for one alert.
+    context: retrieval results already fetched for this alert (e.g. batched by the worker);
+    the retrieve node then skips its own lookup.
     """
     # Initialize state
     initial_state = {
         "alert": alert,
-        "context": [],
+        "attached_alerts": [],
+        "context": context or [],
         "normalized_summary": None,
         "remediation": None,
         "verification_result": None,
+        "route": None,
         "next_step": "start"
     }
     
+    # Inference slots are handed out by severity; the priority follows this run into every node
+    set_request_priority(alert.severity)
+
     # Run the graph
-    # Note: In a real async app, use ainvoke or stream
-    # For MVP with synchronous local models, we use invoke
-    result = app.invoke(initial_state)
+    # Nodes offload model calls to the bounded inference executor, so awaiting here
+    # leaves the event loop free for /ingest and /health
+    try:
+        result = await app.ainvoke(initial_state)
+    except Exception as e:
+        await alert_events.apublish(alert.alert_id, DONE_EVENT, {"status": "error", "error": str(e)})
+        raise
+    
+    remediation = result.get("remediation")
+    # The remediation covers the repeats too. Closing the window in the same step means a repeat
+    # either makes this list or starts a run of its own, never neither.
+    result["attached_alerts"] = await asyncio.to_thread(coalesced_runs.close, alert.alert_id)
+    await alert_events.apublish(alert.alert_id, DONE_EVENT, {
+        "status": "completed",
+        "remediation": remediation.model_dump(mode="json") if remediation else None,
+        "attached_alerts": result["attached_alerts"]
+    })
     
     return result
@@ -0,0 +1,402 @@
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import fcntl
+import json
+import logging
+import math
+import os
+import re
+import threading
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+# Directory for the snapshot + journal, so restarts load term frequencies instead of re-tokenizing.
+# Set to an empty string to keep the index in memory only.
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", "./bm25_data") or None
+# Journal entries after which the snapshot is rewritten and the journal truncated
+BM25_COMPACT_AFTER = int(os.getenv("BM25_COMPACT_AFTER", "1000"))
+# Writes since the last matrix build after which the scoring matrix is rebuilt, as a fraction
+# of the corpus (with a floor). Until then new docs are scored from the postings.
+BM25_REBUILD_FRACTION = float(os.getenv("BM25_REBUILD_FRACTION", "0.05"))
+BM25_REBUILD_MIN = 256
+# Docs scored outside the matrix (one Python loop per query) before a rebuild is forced regardless of corpus size
+BM25_PENDING_MAX = int(os.getenv("BM25_PENDING_MAX", "128"))
+
+_TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased word tokens. Unlike split(" "), punctuation and newlines never glue tokens together.
+    """
+    return _TOKEN_RE.findall(text.lower())
+
+class BM25Index:
+    """
+    Incremental Okapi BM25 inverted index with add/update/delete by doc_id.
+
+    Documents are stored as term frequencies, so persistence never re-tokenizes the corpus:
+    every mutation is appended to a journal, replayed on load over the last snapshot.
+    Implements the VectorStore listener interface, so it can follow vector-store writes.
+
+    Scoring runs on a CSR term-document matrix of term frequencies: a query (or a batch of
+    queries) is one sparse product over the rows of its terms, and the top k are picked with
+    argpartition. IDF and document-length normalisation use live corpus statistics, so results
+    are exact even between matrix rebuilds; docs written since the last build are tombstoned in
+    the matrix and scored from the postings until the next rebuild.
+
+    The files may be shared by several processes: journal appends, compaction and loading hold
+    an exclusive file lock. Each process only journals its own writes, so the persisted index is
+    a warm start; reconcile() brings it in line with the vector store.
+    """
+    SNAPSHOT_FILE = "bm25_snapshot.json"
+    JOURNAL_FILE = "bm25_journal.jsonl"
+    LOCK_FILE = "bm25.lock"
+
+    def __init__(self, path: Optional[str] = BM25_INDEX_PATH, k1: float = 1.5, b: float = 0.75,
+                 compact_after: int = BM25_COMPACT_AFTER):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.compact_after = compact_after
+        # term -> {doc_id: tf}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_tf: Dict[str, Dict[str, int]] = {}
+        self.doc_len: Dict[str, int] = {}
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.total_len = 0
+        self._journal_entries = 0
+        self._lock = threading.RLock()
+        self._reset_matrix()
+        if self.path:
+            os.makedirs(self.path, exist_ok=True)
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.doc_len
+
+    # Mutations
+
+    def add(self, doc_id: str, content: str, metadata: Optional[Dict[str, Any]] = None):
+        """
+        Adds a document, replacing any previous version with the same doc_id.
+        """
+        tf = dict(Counter(tokenize(content)))
+        with self._lock:
+            self._apply_add(doc_id, tf, content, metadata or {})
+            self._journal({"op": "add", "doc_id": doc_id, "tf": tf, "content": content, "metadata": metadata or {}})
+
+    def add_many(self, documents: Iterable[Tuple[str, str, Dict[str, Any]]]):
+        """
+        Adds (doc_id, content, metadata) triples with a single journal write.
+        """
+        entries = []
+        with self._lock:
+            for doc_id, content, metadata in documents:
+                tf = dict(Counter(tokenize(content)))
+                self._apply_add(doc_id, tf, content, metadata or {})
+                entries.append({"op": "add", "doc_id": doc_id, "tf": tf, "content": content, "metadata": metadata or {}})
+            self._journal(*entries)
+
+    update = add
+
+    def delete(self, doc_id: str) -> bool:
+        with self._lock:
+            if doc_id not in self.doc_len:
+                return False
+            self._apply_delete(doc_id)
+            self._journal({"op": "delete", "doc_id": doc_id})
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._apply_clear()
+            self._journal({"op": "clear"})
+
+    def reconcile(self, doc_ids: Iterable[str],
+                  fetch: Callable[[List[str]], Iterable[Tuple[str, str, Dict[str, Any]]]]) -> Tuple[int, int]:
+        """
+        Brings the index in line with a source of truth holding doc_ids: documents it lacks are
+        fetched as (doc_id, content, metadata) and added, documents no longer in the source are
+        deleted. Returns (added, deleted).
+        """
+        doc_ids = set(doc_ids)
+        with self._lock:
+            stale = [doc_id for doc_id in self.doc_len if doc_id not in doc_ids]
+            missing = [doc_id for doc_id in doc_ids if doc_id not in self.doc_len]
+            for doc_id in stale:
+                self._apply_delete(doc_id)
+            self._journal(*({"op": "delete", "doc_id": doc_id} for doc_id in stale))
+            if missing:
+                self.add_many(fetch(missing))
+        if stale or missing:
+            logger.info(f"Reconciled BM25 index: {len(missing)} documents added, {len(stale)} removed")
+        return len(missing), len(stale)
+
+    def _apply_add(self, doc_id: str, tf: Dict[str, int], content: str, metadata: Dict[str, Any]):
+        if doc_id in self.doc_len:
+            self._apply_delete(doc_id)
+        self._pending.add(doc_id)
+        for term, count in tf.items():
+            self.postings.setdefault(term, {})[doc_id] = count
+        self.doc_tf[doc_id] = tf
+        self.doc_len[doc_id] = sum(tf.values())
+        self.documents[doc_id] = {"content": content, "metadata": metadata}
+        self.total_len += self.doc_len[doc_id]
+
+    def _apply_delete(self, doc_id: str):
+        self._pending.discard(doc_id)
+        col = self._doc_col.pop(doc_id, None)
+        if col is not None:
+            self._alive[col] = False
+            self._dead += 1
+        for term in self.doc_tf.pop(doc_id):
+            docs = self.postings[term]
+            del docs[doc_id]
+            if not docs:
+                del self.postings[term]
+        self.total_len -= self.doc_len.pop(doc_id)
+        del self.documents[doc_id]
+
+    def _apply_clear(self):
+        self.postings.clear()
+        self.doc_tf.clear()
+        self.doc_len.clear()
+        self.documents.clear()
+        self.total_len = 0
+        self._reset_matrix()
+
+    # VectorStore listener interface
+
+    def on_document_added(self, doc_id: str, content: str, metadata: Dict[str, Any]):
+        self.add(doc_id, content, metadata)
+
+    def on_documents_added(self, documents: List[Tuple[str, str, Dict[str, Any]]]):
+        self.add_many(documents)
+
+    def on_document_deleted(self, doc_id: str):
+        self.delete(doc_id)
+
+    def on_reset(self):
+        self.clear()
+
+    # Scoring
+
+    def _reset_matrix(self):
+        # term -> row of the tf matrix; column -> doc_id
+        self._matrix: Optional[sparse.csr_matrix] = None
+        self._term_row: Dict[str, int] = {}
+        self._col_doc: List[str] = []
+        self._doc_col: Dict[str, int] = {}
+        self._col_len = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._dead = 0
+        self._pending = set(self.doc_len) if hasattr(self, "doc_len") else set()
+
+    def _maybe_rebuild(self):
+        stale = len(self._pending) + self._dead
+        if self._matrix is None and not self._pending:
+            return
+        # Dead columns only cost a mask; pending docs cost a Python loop per query, so they are capped on their own
+        if (self._matrix is not None and len(self._pending) <= BM25_PENDING_MAX
+                and stale <= max(BM25_REBUILD_MIN, BM25_REBUILD_FRACTION * len(self.doc_len))):
+            return
+        self._rebuild_matrix()
+
+    def _rebuild_matrix(self):
+        col_doc = list(self.doc_tf)
+        term_row: Dict[str, int] = {term: row for row, term in enumerate(self.postings)}
+        nnz = sum(len(tf) for tf in self.doc_tf.values())
+        rows = np.empty(nnz, dtype=np.int32)
+        cols = np.empty(nnz, dtype=np.int32)
+        data = np.empty(nnz, dtype=np.float32)
+        pos = 0
+        for col, doc_id in enumerate(col_doc):
+            tf = self.doc_tf[doc_id]
+            end = pos + len(tf)
+            rows[pos:end] = [term_row[term] for term in tf]
+            cols[pos:end] = col
+            data[pos:end] = list(tf.values())
+            pos = end
+        self._matrix = sparse.csr_matrix((data, (rows, cols)), shape=(len(term_row), len(col_doc)))
+        self._term_row = term_row
+        self._col_doc = col_doc
+        self._doc_col = {doc_id: col for col, doc_id in enumerate(col_doc)}
+        self._col_len = np.array([self.doc_len[doc_id] for doc_id in col_doc], dtype=np.float32)
+        self._alive = np.ones(len(col_doc), dtype=bool)
+        self._dead = 0
+        self._pending = set()
+        logger.info(f"Built BM25 matrix: {len(term_row)} terms x {len(col_doc)} docs, {nnz} postings")
+
+    def _idf(self, term: str, n_docs: int) -> float:
+        df = len(self.postings[term])
+        # Non-negative IDF variant, so very common terms never subtract score
+        return math.log((n_docs - df + 0.5) / (df + 0.5) + 1)
+
+    def search(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
+        """
+        Returns the top k documents by BM25 score (only documents sharing a term with the query).
+        """
+        return self.search_batch([query], k=k)[0]
+
+    def search_batch(self, queries: List[str], k: int = 3) -> List[List[Dict[str, Any]]]:
+        """
+        Scores many queries with a single sparse product and returns the top k for each.
+        """
+        with self._lock:
+            n_docs = len(self.doc_len)
+            if not n_docs:
+                return [[] for _ in queries]
+            self._maybe_rebuild()
+            avgdl = self.total_len / n_docs
+            query_terms = [[term for term in set(tokenize(query)) if term in self.postings] for query in queries]
+
+            matrix_hits = self._score_matrix(query_terms, n_docs, avgdl)
+            results = []
+            for terms, (cols, values) in zip(query_terms, matrix_hits):
+                doc_ids = [self._col_doc[col] for col in cols]
+                scores = list(values)
+                # Docs written since the last build are not in the matrix yet
+                for doc_id in self._pending:
+                    score = self._score_doc(doc_id, terms, n_docs, avgdl)
+                    if score > 0:
+                        doc_ids.append(doc_id)
+                        scores.append(score)
+                results.append(self._top_k(doc_ids, np.asarray(scores, dtype=np.float64), k))
+            return results
+
+    def _score_matrix(self, query_terms: List[List[str]], n_docs: int, avgdl: float):
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+        if self._matrix is None:
+            return [empty for _ in query_terms]
+
+        # Rows for every term used by the batch (terms added after the build are only in pending docs)
+        union = sorted({term for terms in query_terms for term in terms if term in self._term_row})
+        if not union:
+            return [empty for _ in query_terms]
+        union_index = {term: i for i, term in enumerate(union)}
+        sub = self._matrix[[self._term_row[term] for term in union]]
+
+        # BM25 term saturation with the current avgdl, dead columns zeroed
+        tf = sub.data
+        dl = self._col_len[sub.indices]
+        weights = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * dl / avgdl))
+        weights *= self._alive[sub.indices]
+        sub = sparse.csr_matrix((weights, sub.indices, sub.indptr), shape=sub.shape)
+
+        # Query matrix: idf of each query's terms
+        q_rows, q_cols, q_data = [], [], []
+        for i, terms in enumerate(query_terms):
+            for term in terms:
+                if term in union_index:
+                    q_rows.append(i)
+                    q_cols.append(union_index[term])
+                    q_data.append(self._idf(term, n_docs))
+        queries = sparse.csr_matrix((q_data, (q_rows, q_cols)), shape=(len(query_terms), len(union)))
+
+        scores = (queries @ sub).tocsr()
+        scores.eliminate_zeros()
+        return [(scores.indices[scores.indptr[i]:scores.indptr[i + 1]], scores.data[scores.indptr[i]:scores.indptr[i + 1]])
+                for i in range(len(query_terms))]
+
+    def _score_doc(self, doc_id: str, terms: List[str], n_docs: int, avgdl: float) -> float:
+        tf_doc = self.doc_tf[doc_id]
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / avgdl)
+        score = 0.0
+        for term in terms:
+            tf = tf_doc.get(term)
+            if tf:
+                score += self._idf(term, n_docs) * tf * (self.k1 + 1) / (tf + norm)
+        return score
+
+    def _top_k(self, doc_ids: List[str], scores: np.ndarray, k: int) -> List[Dict[str, Any]]:
+        if not len(scores):
+            return []
+        if len(scores) > k:
+            # O(N) selection, then sort only the k survivors
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [{"doc_id": doc_ids[i], "score": float(scores[i]), **self.documents[doc_ids[i]]} for i in top]
+
+    # Persistence
+
+    def _snapshot_path(self) -> str:
+        return os.path.join(self.path, self.SNAPSHOT_FILE)
+
+    def _journal_path(self) -> str:
+        return os.path.join(self.path, self.JOURNAL_FILE)
+
+    @contextmanager
+    def _file_lock(self):
+        with open(os.path.join(self.path, self.LOCK_FILE), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _journal(self, *entries: Dict[str, Any]):
+        if not self.path or not entries:
+            return
+        # One write per batch, under the lock, so entries from different processes never interleave
+        lines = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+        with self._file_lock(), open(self._journal_path(), "a", encoding="utf-8") as f:
+            f.write(lines)
+        self._journal_entries += len(entries)
+        if self._journal_entries >= self.compact_after:
+            self.compact()
+
+    def compact(self):
+        """
+        Writes a full snapshot and truncates the journal.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            snapshot = {
+                "docs": {doc_id: {"tf": self.doc_tf[doc_id], **self.documents[doc_id]} for doc_id in self.doc_len}
+            }
+            with self._file_lock():
+                tmp_path = self._snapshot_path() + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(snapshot, f, ensure_ascii=False)
+                # Atomic swap: a crash leaves either the old snapshot + journal or the new snapshot
+                os.replace(tmp_path, self._snapshot_path())
+                open(self._journal_path(), "w").close()
+            self._journal_entries = 0
+
+    def _load(self):
+        with self._file_lock():
+            self._replay()
+        logger.info(f"Loaded BM25 index with {len(self)} documents from {self.path}")
+
+    def _replay(self):
+        if os.path.exists(self._snapshot_path()):
+            with open(self._snapshot_path(), encoding="utf-8") as f:
+                snapshot = json.load(f)
+            for doc_id, doc in snapshot["docs"].items():
+                self._apply_add(doc_id, doc["tf"], doc["content"], doc["metadata"])
+
+        if os.path.exists(self._journal_path()):
+            with open(self._journal_path(), encoding="utf-8") as f:
+                for line_no, line in enumerate(f, 1):
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn final write from a crash; everything before it is intact
+                        logger.warning(f"Ignoring corrupt BM25 journal entry at line {line_no}")
+                        continue
+                    if entry["op"] == "add":
+                        self._apply_add(entry["doc_id"], entry["tf"], entry["content"], entry["metadata"])
+                    elif entry["op"] == "delete" and entry["doc_id"] in self.doc_len:
+                        self._apply_delete(entry["doc_id"])
+                    elif entry["op"] == "clear":
+                        self._apply_clear()
+                    self._journal_entries += 1
@@ -0,0 +1,233 @@
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings, DefaultEmbeddingFunction
+from infra.cache import LRUCache
+from infra.observability import CACHE_HITS_TOTAL
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+import fcntl
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Directory for the on-disk tier (one memory-mapped file per model). Unset keeps only the in-memory tier.
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR")
+# Hot entries kept in memory
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class _class_or_instance:
+    """
+    Method that answers differently on the class and on instances. Chroma calls name() and
+    build_from_config() on embedding function classes too, but a wrapper only knows the function
+    it wraps once it is an instance.
+    """
+    def __init__(self, on_class, on_instance):
+        self.on_class = on_class
+        self.on_instance = on_instance
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self.on_class
+        return functools.partial(self.on_instance, instance)
+
+class EmbeddingDiskStore:
+    """
+    Append-only store of float32 vectors in a memory-mapped file, addressed by content hash.
+    Rows are written before their key is appended to the key log, so a crash can only
+    lose the last vectors, never map a key to a half-written row.
+    The directory may be shared by several processes (API, workers, loader): appends take an
+    exclusive file lock, and the row of each key is its line number in the key log, so every
+    process agrees on where a vector lives.
+    """
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.keys_path = os.path.join(directory, "keys.log")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.lock_path = os.path.join(directory, "lock")
+        self.rows: Dict[str, int] = {}
+        self.dim: Optional[int] = None
+        self.capacity = 0
+        # Lines (rows) and bytes of the key log already read
+        self._row_count = 0
+        self._keys_offset = 0
+        self._mmap: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+        with self._lock, self._file_lock():
+            self._refresh()
+        if self.rows:
+            logger.info(f"Loaded {len(self.rows)} cached embeddings from {self.directory}")
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _remap(self):
+        if self._mmap is not None:
+            self._mmap.flush()
+            del self._mmap
+            self._mmap = None
+        self.capacity = os.path.getsize(self.vectors_path) // (4 * self.dim) if os.path.exists(self.vectors_path) else 0
+        if self.capacity:
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+
+    def _refresh(self):
+        """
+        Picks up keys appended since the last read, including other processes'. Call with both locks held.
+        """
+        if self.dim is None:
+            if not os.path.exists(self.meta_path):
+                return
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)["dim"]
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path) as f:
+                f.seek(self._keys_offset)
+                # Only complete lines; every line is a row, even one that is not a valid key
+                for line in iter(f.readline, ""):
+                    if not line.endswith("\n"):
+                        break
+                    key = line.strip()
+                    if len(key) == 64:
+                        self.rows[key] = self._row_count
+                    self._row_count += 1
+                    self._keys_offset = f.tell()
+        if self._row_count > self.capacity or self._mmap is None:
+            # Another process grew the vectors file
+            self._remap()
+
+    def _ensure_capacity(self, needed: int):
+        if needed <= self.capacity:
+            return
+        capacity = max(self.INITIAL_CAPACITY, self.capacity)
+        while capacity < needed:
+            capacity *= 2
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(capacity * self.dim * 4)
+        self._remap()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        # Under the lock: a concurrent put_many may be swapping the mapping
+        with self._lock:
+            row = self.rows.get(key)
+            if row is None or row >= self.capacity:
+                return None
+            return np.array(self._mmap[row])
+
+    def put_many(self, items: Dict[str, np.ndarray]):
+        with self._lock, self._file_lock():
+            self._refresh()
+            items = {key: vector for key, vector in items.items() if key not in self.rows}
+            if not items:
+                return
+            if self.dim is None:
+                self.dim = len(next(iter(items.values())))
+                with open(self.meta_path, "w") as f:
+                    json.dump({"dim": self.dim}, f)
+            # The next row is the locked key log's length, whichever process appended last
+            start = self._row_count
+            keys = list(items)
+            self._ensure_capacity(start + len(keys))
+            self._mmap[start:start + len(keys)] = np.stack([items[key] for key in keys])
+            self._mmap.flush()
+            with open(self.keys_path, "a") as f:
+                f.write("".join(key + "\n" for key in keys))
+            self._refresh()
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    Embedding function wrapper that caches vectors by (model id, sha256(text)).
+    Hot vectors live in an in-process LRU, the rest in a memory-mapped file per model,
+    so re-ingested chunks and repeated alert queries are embedded once.
+    Reports the wrapped function's name and config, so Chroma records (and can rebuild) the function
+    actually used; on the class itself they fall back to the default function.
+    """
+    def __init__(self, embedding_function: Optional[EmbeddingFunction] = None, model_id: Optional[str] = None,
+                 cache_dir: Optional[str] = EMBEDDING_CACHE_DIR, max_entries: int = EMBEDDING_CACHE_SIZE):
+        self.embedding_function = embedding_function or DefaultEmbeddingFunction()
+        self.model_id = model_id or self._default_model_id()
+        self.memory = LRUCache(max_entries=max_entries)
+        self.cache_dir = cache_dir
+        self.disk = None
+        if cache_dir:
+            safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", self.model_id)
+            self.disk = EmbeddingDiskStore(os.path.join(cache_dir, safe_id))
+
+    def _default_model_id(self) -> str:
+        name = self.embedding_function.name()
+        if name is NotImplemented:
+            return type(self.embedding_function).__name__
+        config = self.embedding_function.get_config()
+        return f"{name}-{content_hash(json.dumps(config, sort_keys=True, default=str))[:12]}" if config else name
+
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [content_hash(text) for text in input]
+        vectors: List[Optional[np.ndarray]] = [None] * len(input)
+        missing: Dict[str, List[int]] = {}
+        for i, key in enumerate(keys):
+            vector = self.memory.get(key)
+            if vector is not None:
+                CACHE_HITS_TOTAL.labels(cache_type="embedding").inc()
+            elif self.disk is not None:
+                vector = self.disk.get(key)
+                if vector is not None:
+                    CACHE_HITS_TOTAL.labels(cache_type="embedding_disk").inc()
+                    self.memory.set(key, vector)
+            if vector is None:
+                # Duplicates within one call are embedded once
+                missing.setdefault(key, []).append(i)
+            vectors[i] = vector
+
+        if missing:
+            texts = [input[positions[0]] for positions in missing.values()]
+            embedded = self.embedding_function(texts)
+            fresh = {}
+            for key, vector in zip(missing, embedded):
+                vector = np.asarray(vector, dtype=np.float32)
+                fresh[key] = vector
+                self.memory.set(key, vector)
+                for i in missing[key]:
+                    vectors[i] = vector
+            if self.disk is not None:
+                self.disk.put_many(fresh)
+        return vectors
+
+    name = _class_or_instance(
+        on_class=DefaultEmbeddingFunction.name,
+        on_instance=lambda self: self.embedding_function.name(),
+    )
+
+    def get_config(self) -> Dict[str, Any]:
+        return self.embedding_function.get_config()
+
+    build_from_config = _class_or_instance(
+        on_class=lambda config: CachedEmbeddingFunction(DefaultEmbeddingFunction.build_from_config(config)),
+        # Same wrapped type and cache settings, new config
+        on_instance=lambda self, config: CachedEmbeddingFunction(
+            type(self.embedding_function).build_from_config(config), cache_dir=self.cache_dir, max_entries=self.memory.max_entries),
+    )
+
+    def is_legacy(self) -> bool:
+        return self.embedding_function.is_legacy()
+
+    def default_space(self):
+        return self.embedding_function.default_space()
+
+    def supported_spaces(self):
+        return self.embedding_function.supported_spaces()
@@ -0,0 +1,159 @@
+from langgraph.memory.vector_store import VectorStore
+from langgraph.memory.bm25_index import BM25Index, BM25_INDEX_PATH
+from langgraph.memory.retriever import HybridRetriever
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import argparse
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Chunking in words; overlap keeps a step that straddles a boundary retrievable from either side
+LOADER_CHUNK_SIZE = int(os.getenv("LOADER_CHUNK_SIZE", "200"))
+LOADER_CHUNK_OVERLAP = int(os.getenv("LOADER_CHUNK_OVERLAP", "40"))
+LOADER_BATCH_SIZE = int(os.getenv("LOADER_BATCH_SIZE", "64"))
+LOADER_WORKERS = int(os.getenv("LOADER_WORKERS", "4"))
+
+# Markdown/YAML playbooks and text extracted from PDFs
+SUPPORTED_EXTENSIONS = {".md", ".markdown", ".txt", ".yaml", ".yml"}
+
+def chunk_text(text: str, chunk_size: int = LOADER_CHUNK_SIZE, overlap: int = LOADER_CHUNK_OVERLAP) -> List[str]:
+    """
+    Splits text into windows of chunk_size words, each sharing `overlap` words with the previous one.
+    """
+    if overlap >= chunk_size:
+        raise ValueError("overlap must be smaller than chunk_size")
+    words = text.split()
+    if not words:
+        return []
+    step = chunk_size - overlap
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_size]))
+        if start + chunk_size >= len(words):
+            break
+    return chunks
+
+def chunk_id(source: str, chunk: str) -> str:
+    # Content-addressed: re-loading an unchanged chunk maps to the same id and is skipped
+    return f"{source}:{hashlib.sha256(chunk.encode('utf-8')).hexdigest()[:32]}"
+
+class KnowledgeLoader:
+    """
+    Bulk loader for playbook/knowledge directories.
+    Files are chunked, chunks already stored are skipped by content hash, and new chunks are
+    embedded in parallel batches and upserted in bulk. Chunks are tagged with their source and
+    path, so when a file is reloaded the chunks it no longer produces are deleted. Listeners on
+    the store (the BM25 index) are updated by the same writes.
+    """
+    def __init__(self, vector_store: VectorStore, chunk_size: int = LOADER_CHUNK_SIZE, overlap: int = LOADER_CHUNK_OVERLAP,
+                 batch_size: int = LOADER_BATCH_SIZE, workers: int = LOADER_WORKERS):
+        self.vector_store = vector_store
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.workers = workers
+
+    def iter_files(self, root: str) -> Iterator[str]:
+        for dirpath, _, filenames in os.walk(root):
+            for filename in sorted(filenames):
+                if os.path.splitext(filename)[1].lower() in SUPPORTED_EXTENSIONS:
+                    yield os.path.join(dirpath, filename)
+
+    @staticmethod
+    def source_for(root: str, path: str, source: Optional[str] = None) -> str:
+        """
+        The explicit source, else the first directory under root (e.g. root/playbook-ssh/brute-force.md).
+        """
+        if source:
+            return source
+        parts = os.path.relpath(path, root).split(os.sep)
+        return parts[0] if len(parts) > 1 else "unknown"
+
+    def collect(self, root: str, source: Optional[str] = None) -> Tuple[List[Tuple[str, str, Dict[str, Any]]], Dict[str, int], Dict[str, str]]:
+        """
+        Reads and chunks every supported file. Files from sources outside the allowlist are rejected.
+        Returns the chunks, stats, and the source of every file read, by path relative to root.
+        """
+        stats = {"files": 0, "rejected_files": 0, "chunks": 0}
+        chunks: Dict[str, Tuple[str, str, Dict[str, Any]]] = {}
+        files: Dict[str, str] = {}
+        for path in self.iter_files(root):
+            file_source = self.source_for(root, path, source)
+            if file_source not in self.vector_store.allowed_sources:
+                logger.warning(f"Skipping {path}: source {file_source} is not in the allowlist")
+                stats["rejected_files"] += 1
+                continue
+            with open(path, encoding="utf-8", errors="replace") as f:
+                text = f.read()
+            stats["files"] += 1
+            rel_path = os.path.relpath(path, root)
+            files[rel_path] = file_source
+            for index, chunk in enumerate(chunk_text(text, self.chunk_size, self.overlap)):
+                doc_id = chunk_id(file_source, chunk)
+                # Identical chunks (within or across files) are stored once
+                chunks.setdefault(doc_id, (doc_id, chunk, {"source": file_source, "path": rel_path, "chunk": index}))
+                stats["chunks"] += 1
+        return list(chunks.values()), stats, files
+
+    def superseded(self, files: Dict[str, str], doc_ids: set) -> List[str]:
+        """
+        Ids of stored chunks that came from these (path -> source) files but are not among doc_ids.
+        """
+        if not files:
+            return []
+        stored = self.vector_store.find_documents({"path": {"$in": list(files)}})
+        return [doc["doc_id"] for doc in stored
+                if doc["doc_id"] not in doc_ids and files.get(doc["metadata"].get("path")) == doc["metadata"].get("source")]
+
+    def load_directory(self, root: str, source: Optional[str] = None) -> Dict[str, int]:
+        chunks, stats, files = self.collect(root, source)
+        batches = [chunks[i:i + self.batch_size] for i in range(0, len(chunks), self.batch_size)]
+        stats.update(unchanged=0, added=0, removed=0)
+
+        embed = self.vector_store.embedding_function
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            # Skip what is already stored before paying for embeddings
+            pending = []
+            for batch in batches:
+                existing = self.vector_store.existing_ids([doc_id for doc_id, _, _ in batch])
+                stats["unchanged"] += len(existing)
+                new = [item for item in batch if item[0] not in existing]
+                if new:
+                    pending.append((new, pool.submit(embed, [content for _, content, _ in new])))
+
+            # Writes stay on this thread, in order, so the BM25 journal sees one batch at a time
+            for new, future in pending:
+                ids, contents, metadatas = (list(column) for column in zip(*new))
+                self.vector_store.add_documents(ids, contents, metadatas, embeddings=future.result())
+                stats["added"] += len(new)
+                logger.info(f"Loaded {stats['added']} new chunks")
+
+        # Chunks of edited files that the new text no longer produces (ids are content hashes)
+        stale = self.superseded(files, {doc_id for doc_id, _, _ in chunks})
+        self.vector_store.delete_documents(stale)
+        stats["removed"] = len(stale)
+        return stats
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Bulk-load a playbook/knowledge directory into the vector store")
+    parser.add_argument("directory")
+    parser.add_argument("--source", default=None, help="Source for every file (defaults to the first subdirectory name)")
+    parser.add_argument("--persist-directory", default="./chroma_data")
+    parser.add_argument("--bm25-path", default=BM25_INDEX_PATH, help="Persisted BM25 index to update in the same pass")
+    parser.add_argument("--chunk-size", type=int, default=LOADER_CHUNK_SIZE)
+    parser.add_argument("--overlap", type=int, default=LOADER_CHUNK_OVERLAP)
+    parser.add_argument("--batch-size", type=int, default=LOADER_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=LOADER_WORKERS)
+    args = parser.parse_args()
+
+    store = VectorStore(persist_directory=args.persist_directory)
+    if args.bm25_path:
+        # Subscribes the persisted index to the store (building it first if it is empty)
+        HybridRetriever(store, bm25_index=BM25Index(path=args.bm25_path), cache_size=0)
+    loader = KnowledgeLoader(store, chunk_size=args.chunk_size, overlap=args.overlap,
+                             batch_size=args.batch_size, workers=args.workers)
+    print(loader.load_directory(args.directory, source=args.source))
@@ -29,3 +29,15 @@ class RedisStore:
 
     def clear_context(self, session_id: str):
         self.client.delete(f"session:{session_id}")
+
+    def set_value(self, key: str, data: Dict[str, Any], ttl: Optional[int] = None):
+        """
+        Stores an arbitrary JSON value under a caller-namespaced key, with a TTL.
+        """
+        self.client.setex(key, ttl or self.ttl, json.dumps(data))
+
+    def get_value(self, key: str) -> Optional[Dict[str, Any]]:
+        data = self.client.get(key)
+        if data:
+            return json.loads(data)
+        return None
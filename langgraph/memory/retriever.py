@@ -1,68 +1,163 @@
-from typing import List, Dict, Any
-from rank_bm25 import BM25Okapi
+from typing import List, Dict, Any, Optional
 from langgraph.memory.vector_store import VectorStore
+from langgraph.memory.bm25_index import BM25Index
+from infra.cache import LRUCache
+from infra.observability import CACHE_HITS_TOTAL
 import logging
+import os
+import threading
 
 logger = logging.getLogger(__name__)
 
+# Fused results for repeated queries (alert storms). 0 disables the cache.
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))
+RETRIEVAL_CACHE_TTL = int(os.getenv("RETRIEVAL_CACHE_TTL", "300"))
+
+# Reciprocal Rank Fusion constant: a hit at rank r (from 0) in either result list adds 1 / (r + RRF_K).
+# Fused scores are therefore small: 1/60 for a top hit from one retriever, 2/60 at most.
+RRF_K = 60
+RRF_MAX_SCORE = 2 / RRF_K
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
 class HybridRetriever:
-    def __init__(self, vector_store: VectorStore):
+    def __init__(self, vector_store: VectorStore, bm25_index: Optional[BM25Index] = None,
+                 cache_size: int = RETRIEVAL_CACHE_SIZE, cache_ttl: int = RETRIEVAL_CACHE_TTL):
         self.vector_store = vector_store
-        # In a real system, we'd maintain a corpus for BM25. 
-        # For MVP, we might fetch all docs or maintain a separate index.
-        # Here we assume we can fetch a small corpus or build it on the fly (inefficient for large scale).
-        # Let's assume we have a way to get documents for BM25.
-        self.documents = [] # List of text
-        self.doc_ids = []
-        self.bm25 = None
+        self.cache = LRUCache(max_entries=cache_size, ttl=cache_ttl) if cache_size > 0 else None
+        # Bumped when the BM25 corpus is replaced outside the vector store
+        self.index_version = 0
+        # Set once index_documents replaces the corpus, which then no longer mirrors the store
+        self._detached = False
+        # Keyword index kept in sync with the vector store through its listener hook,
+        # so playbooks and approved memories are searchable as soon as they are written.
+        # Writes by other processes never reach the hook; they are read from the store's
+        # shared change log whenever its shared version moves (see catch_up).
+        self.bm25 = bm25_index if bm25_index is not None else BM25Index()
+        vector_store.add_listener(self.bm25)
+        self._sync_lock = threading.Lock()
+        self._synced_version = vector_store.shared_version()
+        # A persisted index may have missed writes made while this process was down
+        self.sync_index()
+
+    def sync_index(self):
+        """
+        Reconciles the BM25 index with every id held by the vector store (a full scan).
+        Only needed at startup and when the change log cannot be followed.
+        """
+        if self._detached:
+            return
+        self.bm25.reconcile(self.vector_store.all_ids(), self._fetch)
+
+    def _fetch(self, doc_ids: List[str]) -> List[tuple]:
+        return [(doc["doc_id"], doc["content"], doc["metadata"]) for doc in self.vector_store.get_documents(doc_ids)]
+
+    def catch_up(self, shared_version: int):
+        """
+        Applies to the BM25 index the writes other processes made up to `shared_version`.
+        Upserted documents are re-read from the store, so updated content is re-indexed too.
+        """
+        with self._sync_lock:
+            if self._synced_version == shared_version:
+                return
+            changes = self.vector_store.changes_since(self._synced_version) if self._synced_version is not None else None
+            if changes is None:
+                # Too far behind the log (or Redis restarted): fall back to the full scan
+                self.sync_index()
+                self._synced_version = shared_version
+                return
+            for change in changes:
+                # Writes by this store already reached the index through the listener
+                if change["origin"] != self.vector_store.origin and not self._detached:
+                    self._apply_change(change)
+                self._synced_version = change["version"]
+
+    def _apply_change(self, change: Dict[str, Any]):
+        if change["op"] == "reset":
+            self.sync_index()
+        elif change["op"] == "delete":
+            for doc_id in change["doc_ids"]:
+                self.bm25.delete(doc_id)
+        else:
+            documents = self._fetch(change["doc_ids"])
+            self.bm25.add_many(documents)
+            # Deleted again since; the later delete entry is a no-op then
+            for doc_id in set(change["doc_ids"]) - {doc_id for doc_id, _, _ in documents}:
+                self.bm25.delete(doc_id)
 
     def index_documents(self, documents: List[str], doc_ids: List[str]):
         """
-        Updates the BM25 index.
+        Replaces the BM25 corpus. Documents added this way carry no metadata.
         """
-        self.documents = documents
-        self.doc_ids = doc_ids
-        tokenized_corpus = [doc.split(" ") for doc in documents]
-        self.bm25 = BM25Okapi(tokenized_corpus)
+        self.bm25.clear()
+        self.bm25.add_many((doc_id, doc, {}) for doc, doc_id in zip(documents, doc_ids))
+        self.index_version += 1
+        self._detached = True
 
     def retrieve(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
         """
         Hybrid retrieval using RRF (Reciprocal Rank Fusion).
+        Fused results are cached per (normalized query, k, corpus versions).
         """
-        # 1. Vector Search
-        vector_results = self.vector_store.query(query, n_results=k)
-        
-        # 2. Keyword Search (BM25)
-        bm25_results = []
-        if self.bm25:
-            tokenized_query = query.split(" ")
-            doc_scores = self.bm25.get_scores(tokenized_query)
-            # Get top k indices
-            top_n = sorted(range(len(doc_scores)), key=lambda i: doc_scores[i], reverse=True)[:k]
-            for i in top_n:
-                bm25_results.append({
-                    "doc_id": self.doc_ids[i],
-                    "score": doc_scores[i],
-                    "content": self.documents[i]
-                })
+        return self.retrieve_batch([query], k=k)[0]
 
+    def retrieve_batch(self, queries: List[str], k: int = 3) -> List[List[Dict[str, Any]]]:
+        """
+        Hybrid retrieval for many queries. Cache misses share one vector-store query
+        (one embedding batch) and one BM25 batch; RRF fusion is applied per query.
+        """
+        shared_version = self.vector_store.shared_version()
+        if shared_version is not None and shared_version != self._synced_version:
+            # The corpus changed since the last sync, possibly in another process
+            self.catch_up(shared_version)
+            shared_version = self._synced_version
+        # Versions are part of the key, so any write makes older entries unreachable. The shared
+        # version covers writes by other processes; the local one still moves while Redis is down.
+        versions = (shared_version, self.vector_store.version, self.index_version)
+        keys = [(normalize_query(query), k) + versions for query in queries]
+        results: List[Optional[List[Dict[str, Any]]]] = [None] * len(queries)
+        misses = []
+        for i, key in enumerate(keys):
+            cached = self.cache.get(key) if self.cache is not None else None
+            if cached is not None:
+                CACHE_HITS_TOTAL.labels(cache_type="vector").inc()
+                results[i] = cached
+            else:
+                misses.append(i)
+
+        if misses:
+            miss_queries = [queries[i] for i in misses]
+            # 1. Vector Search
+            vector_batch = self.vector_store.query_batch(miss_queries, n_results=k)
+            # 2. Keyword Search (BM25)
+            bm25_batch = self.bm25.search_batch(miss_queries, k=k)
+            for i, vector_results, bm25_results in zip(misses, vector_batch, bm25_batch):
+                results[i] = self._fuse(vector_results, bm25_results, k)
+                if self.cache is not None:
+                    self.cache.set(keys[i], results[i])
+
+        return [[dict(result) for result in fused] for fused in results]
+
+    def _fuse(self, vector_results: List[Dict[str, Any]], bm25_results: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
         # 3. RRF Fusion
-        # Simple RRF: score = 1 / (rank + 60)
+        # Simple RRF: score = 1 / (rank + RRF_K)
         fusion_scores = {}
         
         for rank, res in enumerate(vector_results):
             doc_id = res["doc_id"]
             if doc_id not in fusion_scores:
                 fusion_scores[doc_id] = {"score": 0, "content": res["content"], "metadata": res["metadata"]}
-            fusion_scores[doc_id]["score"] += 1 / (rank + 60)
+            fusion_scores[doc_id]["score"] += 1 / (rank + RRF_K)
             
         for rank, res in enumerate(bm25_results):
             doc_id = res["doc_id"]
             if doc_id not in fusion_scores:
-                # We might miss metadata if it's only in BM25 results (need a lookup)
-                # For MVP, we skip or assume we have it.
-                continue 
-            fusion_scores[doc_id]["score"] += 1 / (rank + 60)
+                # Keyword-only hit: the index stores metadata, but the allowlist still applies
+                if res["metadata"].get("source") not in self.vector_store.allowed_sources:
+                    continue
+                fusion_scores[doc_id] = {"score": 0, "content": res["content"], "metadata": res["metadata"]}
+            fusion_scores[doc_id]["score"] += 1 / (rank + RRF_K)
             
         # Sort by fusion score
         sorted_results = sorted(fusion_scores.values(), key=lambda x: x["score"], reverse=True)
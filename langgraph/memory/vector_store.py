@@ -1,12 +1,141 @@
 import chromadb
 from chromadb.config import Settings
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+import json
 import logging
+import numpy as np
+import os
+import threading
+import time
+import uuid
+from langgraph.memory.embedding_cache import CachedEmbeddingFunction
 
 logger = logging.getLogger(__name__)
 
+# Set to 0 to version the corpus per process only (single-process deployments)
+CORPUS_VERSION_REDIS = os.getenv("CORPUS_VERSION_REDIS", "1") == "1"
+# After a Redis error, version the corpus locally for this long before trying again
+CORPUS_VERSION_RETRY_SECONDS = float(os.getenv("CORPUS_VERSION_RETRY_SECONDS", "30"))
+# Approximate number of writes kept in the change log. A process further behind than this resyncs in full.
+CORPUS_CHANGES_MAXLEN = int(os.getenv("CORPUS_CHANGES_MAXLEN", "10000"))
+# Writes remembered while Redis is down; past this, readers are told to resync in full instead
+CORPUS_MISSED_CHANGES_MAX = 1000
+
+# KEYS[1]: version counter, KEYS[2]: change stream. ARGV: maxlen, op, doc_ids (JSON), origin.
+# The entry id is the new version, so readers can fetch everything after the version they hold.
+CORPUS_CHANGE_SCRIPT = """
+local version = redis.call('INCR', KEYS[1])
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[1], version .. '-0', 'op', ARGV[2], 'doc_ids', ARGV[3], 'origin', ARGV[4])
+return version
+"""
+
+class CorpusVersion:
+    """
+    Write counter and change log for a collection, shared by every process through Redis.
+    Every write bumps the counter and logs (op, doc_ids), so a process that sees the counter move
+    can apply just the writes it missed. Ops are "upsert", "delete" and "reset".
+    While Redis is unreachable the counter reads as None and callers fall back to local versions.
+    """
+    def __init__(self, client, key: str, changes_key: Optional[str] = None,
+                 retry_seconds: float = CORPUS_VERSION_RETRY_SECONDS, maxlen: int = CORPUS_CHANGES_MAXLEN):
+        self.client = client
+        self.key = key
+        self.changes_key = changes_key or f"{key}:changes"
+        self.retry_seconds = retry_seconds
+        self.maxlen = maxlen
+        self._down_until = 0.0
+        self._script = None
+        # Writes that failed to publish are published once Redis is back, so other processes still see them
+        self._missed: List[Tuple[str, List[str], str]] = []
+        self._lock = threading.Lock()
+
+    def _available(self) -> bool:
+        if time.monotonic() < self._down_until:
+            return False
+        if self._missed:
+            with self._lock:
+                while self._missed:
+                    self._publish(*self._missed[0])
+                    self._missed.pop(0)
+        return True
+
+    def _publish(self, op: str, doc_ids: List[str], origin: str):
+        if self._script is None:
+            self._script = self.client.register_script(CORPUS_CHANGE_SCRIPT)
+        self._script(keys=[self.key, self.changes_key], args=[self.maxlen, op, json.dumps(doc_ids), origin])
+
+    def _failed(self, e: Exception):
+        self._down_until = time.monotonic() + self.retry_seconds
+        logger.warning(f"Corpus version unavailable, versioning locally for {self.retry_seconds}s: {e}")
+
+    def get(self) -> Optional[int]:
+        try:
+            if not self._available():
+                return None
+            return int(self.client.get(self.key) or 0)
+        except Exception as e:
+            self._failed(e)
+            return None
+
+    def bump(self, op: str, doc_ids: List[str], origin: str = ""):
+        """
+        Records a write of `doc_ids` (none for a reset) by the store tagged `origin`.
+        """
+        try:
+            if self._available():
+                self._publish(op, doc_ids, origin)
+                return
+        except Exception as e:
+            self._failed(e)
+        with self._lock:
+            self._missed.append((op, doc_ids, origin))
+            if len(self._missed) > CORPUS_MISSED_CHANGES_MAX:
+                self._missed = [("reset", [], origin)]
+
+    def changes_since(self, version: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Writes logged after `version`, oldest first, as {"version", "op", "doc_ids", "origin"}.
+        None if they cannot all be listed (trimmed from the log, Redis down or restarted),
+        in which case the caller has to resync in full.
+        """
+        try:
+            if not self._available():
+                return None
+            entries = self.client.xrange(self.changes_key, min=f"{version}-1")
+        except Exception as e:
+            self._failed(e)
+            return None
+        changes = [
+            {"version": int(entry_id.split("-")[0]), "op": fields["op"],
+             "doc_ids": json.loads(fields["doc_ids"]), "origin": fields["origin"]}
+            for entry_id, fields in entries
+        ]
+        if not changes or changes[0]["version"] != version + 1:
+            return None
+        return changes
+
+# One counter per collection and process, so a Redis outage is backed off once for every store
+_corpus_versions: Dict[str, CorpusVersion] = {}
+_corpus_versions_lock = threading.Lock()
+
+def _default_corpus_version(collection_name: str) -> Optional[CorpusVersion]:
+    if not CORPUS_VERSION_REDIS:
+        return None
+    with _corpus_versions_lock:
+        if collection_name not in _corpus_versions:
+            from langgraph.memory.redis_store import RedisStore
+            # The client connects on first use, so building the store stays cheap
+            store = RedisStore(host=os.getenv("REDIS_HOST", "localhost"), port=int(os.getenv("REDIS_PORT", "6379")))
+            _corpus_versions[collection_name] = CorpusVersion(store.client, f"vector_store:version:{collection_name}",
+                                                              changes_key=f"vector_store:changes:{collection_name}")
+        return _corpus_versions[collection_name]
+
 class VectorStore:
-    def __init__(self, persist_directory: Optional[str] = "./chroma_data", client: Optional[chromadb.ClientAPI] = None):
+    COLLECTION_NAME = "soc_knowledge"
+
+    def __init__(self, persist_directory: Optional[str] = "./chroma_data", client: Optional[chromadb.ClientAPI] = None,
+                 embedding_function: Optional[CachedEmbeddingFunction] = None,
+                 corpus_version: Optional[CorpusVersion] = None):
         if client:
             self.client = client
         elif persist_directory:
@@ -15,9 +144,56 @@ class VectorStore:
             # Ephemeral client for testing
             self.client = chromadb.Client(Settings(allow_reset=True))
             
-        self.collection = self.client.get_or_create_collection("soc_knowledge")
+        # Every add and query embeds through the cache, so unchanged text is never re-embedded
+        self.embedding_function = embedding_function or CachedEmbeddingFunction()
+        self.collection = self._get_collection()
         # Source allowlist - in production this might be in a config file or DB
         self.allowed_sources = {"playbook-ssh", "playbook-phishing", "policy-access-control"}
+        # Secondary indexes (e.g. BM25) notified of every write; see add_listener
+        self._listeners = []
+        # Bumped on every write, so caches keyed on it can never serve results from an older corpus
+        self.version = 0
+        # The same count across processes; see shared_version
+        self.corpus_version = corpus_version if corpus_version is not None else _default_corpus_version(self.COLLECTION_NAME)
+        # Tags this store's entries in the shared change log, so it can skip its own writes
+        self.origin = uuid.uuid4().hex
+
+    def _get_collection(self):
+        return self.client.get_or_create_collection(self.COLLECTION_NAME, embedding_function=self.embedding_function)
+
+    def shared_version(self) -> Optional[int]:
+        """
+        Deployment-wide write count of the collection, None if it is unavailable.
+        Unlike version, it also moves when another process writes.
+        """
+        return self.corpus_version.get() if self.corpus_version is not None else None
+
+    def changes_since(self, version: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Writes made by any process after the given shared version; see CorpusVersion.changes_since.
+        """
+        return self.corpus_version.changes_since(version) if self.corpus_version is not None else None
+
+    def _written(self, op: str, doc_ids: List[str]):
+        self.version += 1
+        if self.corpus_version is not None:
+            self.corpus_version.bump(op, doc_ids, self.origin)
+
+    def add_listener(self, listener):
+        """
+        Registers an index to keep in sync with this store. The listener must implement
+        on_document_added(doc_id, content, metadata), on_documents_added(documents),
+        on_document_deleted(doc_id) and on_reset().
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, event: str, *args):
+        for listener in self._listeners:
+            try:
+                getattr(listener, event)(*args)
+            except Exception as e:
+                # A secondary index must never fail the primary write
+                logger.error(f"Listener {type(listener).__name__}.{event} failed: {e}")
 
     def add_document(self, doc_id: str, content: str, metadata: Dict[str, Any]):
         """
@@ -34,38 +210,140 @@ class VectorStore:
             metadatas=[metadata],
             ids=[doc_id]
         )
+        self._written("upsert", [doc_id])
+        self._notify("on_document_added", doc_id, content, metadata)
+
+    def add_documents(self, doc_ids: List[str], contents: List[str], metadatas: List[Dict[str, Any]],
+                      embeddings: Optional[List[Any]] = None):
+        """
+        Upserts many documents in one collection call (bulk loading).
+        The whole batch is rejected if any document comes from a source outside the allowlist.
+        Pass precomputed embeddings to skip embedding inside Chroma.
+        """
+        blocked = {metadata.get("source", "unknown") for metadata in metadatas} - self.allowed_sources
+        if blocked:
+            logger.warning(f"Blocked bulk addition from unauthorized sources: {sorted(blocked)}")
+            raise ValueError(f"Sources {sorted(blocked)} are not in the allowlist")
+        if not doc_ids:
+            return
+
+        self.collection.upsert(
+            documents=contents,
+            metadatas=metadatas,
+            ids=doc_ids,
+            embeddings=embeddings
+        )
+        self._written("upsert", doc_ids)
+        self._notify("on_documents_added", list(zip(doc_ids, contents, metadatas)))
+
+    def delete_documents(self, doc_ids: List[str]):
+        """
+        Removes many documents in one collection call, and from the secondary indexes.
+        """
+        if not doc_ids:
+            return
+        self.collection.delete(ids=doc_ids)
+        self._written("delete", doc_ids)
+        for doc_id in doc_ids:
+            self._notify("on_document_deleted", doc_id)
+
+    def find_documents(self, where: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Returns the ids and metadata (no content) of documents whose metadata matches a Chroma where filter.
+        """
+        results = self.collection.get(where=where, include=["metadatas"])
+        return [{"doc_id": doc_id, "metadata": metadata or {}} for doc_id, metadata in zip(results["ids"], results["metadatas"])]
+
+    def existing_ids(self, doc_ids: List[str]) -> set:
+        """
+        Returns the subset of doc_ids already stored.
+        """
+        if not doc_ids:
+            return set()
+        return set(self.collection.get(ids=doc_ids, include=[])["ids"])
+
+    def delete_document(self, doc_id: str):
+        """
+        Removes a document from the store and its secondary indexes.
+        """
+        self.collection.delete(ids=[doc_id])
+        self._written("delete", [doc_id])
+        self._notify("on_document_deleted", doc_id)
+
+    def all_ids(self) -> List[str]:
+        """
+        Returns the ids of every stored document, without fetching the documents.
+        """
+        return self.collection.get(include=[])["ids"]
+
+    def get_documents(self, doc_ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        Returns the given documents (without embeddings); ids that are not stored are skipped.
+        """
+        if not doc_ids:
+            return []
+        return self._documents(self.collection.get(ids=doc_ids, include=["documents", "metadatas"]))
+
+    def get_all_documents(self) -> List[Dict[str, Any]]:
+        """
+        Returns every stored document (without embeddings), e.g. to rebuild a secondary index.
+        """
+        return self._documents(self.collection.get(include=["documents", "metadatas"]))
+
+    @staticmethod
+    def _documents(results: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [
+            {"doc_id": doc_id, "content": content, "metadata": metadata or {}}
+            for doc_id, content, metadata in zip(results["ids"], results["documents"], results["metadatas"])
+        ]
 
     def query(self, query_text: str, n_results: int = 3) -> List[Dict[str, Any]]:
         """
         Retrieves documents relevant to the query.
         Returns a list of results with metadata and scores.
         """
+        return self.query_batch([query_text], n_results=n_results)[0]
+
+    def query_batch(self, query_texts: List[str], n_results: int = 3) -> List[List[Dict[str, Any]]]:
+        """
+        Retrieves documents for many queries with one embedding batch and one collection query.
+        Returns one result list per query, in input order.
+        """
+        if not query_texts:
+            return []
         results = self.collection.query(
-            query_texts=[query_text],
+            query_texts=query_texts,
             n_results=n_results
         )
-        
+        if not results["ids"]:
+            return [[] for _ in query_texts]
+
+        # Double check allowlist on retrieval (defense in depth), for all queries at once
+        sizes = [len(ids) for ids in results["ids"]]
+        sources = np.array([(metadata or {}).get("source") for metadatas in results["metadatas"] for metadata in metadatas], dtype=object)
+        allowed = np.isin(sources, list(self.allowed_sources)) if len(sources) else np.zeros(0, dtype=bool)
+        offsets = np.concatenate(([0], np.cumsum(sizes)))
+
         # Format results
-        formatted_results = []
-        if results["ids"]:
-            for i in range(len(results["ids"][0])):
-                metadata = results["metadatas"][0][i]
-                # Double check allowlist on retrieval (defense in depth)
-                if metadata.get("source") not in self.allowed_sources:
-                    continue
-                    
-                formatted_results.append({
-                    "doc_id": results["ids"][0][i],
-                    "content": results["documents"][0][i],
-                    "metadata": metadata,
-                    "score": results["distances"][0][i] if results["distances"] else 0.0
-                })
-        
-        return formatted_results
+        batch = []
+        for q, size in enumerate(sizes):
+            distances = results["distances"][q] if results.get("distances") else None
+            batch.append([
+                {
+                    "doc_id": results["ids"][q][i],
+                    "content": results["documents"][q][i],
+                    "metadata": results["metadatas"][q][i],
+                    "score": distances[i] if distances else 0.0
+                }
+                for i in np.flatnonzero(allowed[offsets[q]:offsets[q] + size])
+            ])
+        return batch
 
     def reset(self):
         """
         Resets the database. For testing purposes only.
         """
         self.client.reset()
-        self.collection = self.client.get_or_create_collection("soc_knowledge")
+        self.collection = self._get_collection()
+        self._written("reset", [])
+        self._notify("on_reset")
@@ -1,10 +1,33 @@
 from langgraph.state import AgentState
 from models.llm import LocalLLM
 from models.prompts import get_system_prompt
+from infra.events import alert_events
+from models.context_packer import ContextPacker
 from typing import Dict, Any
 
 # Initialize LLM
 llm = LocalLLM()
+# Prompts are budgeted with the shared adapter's tokenizer
+packer = ContextPacker(llm.adapter.count_tokens)
+
+USER_PROMPT = """
+    Alert: {alert}
+    
+    Context:
+    {context}
+    
+    Task: Perform a deep-dive analysis. Is this a False Positive? Map to MITRE ATT&CK.
+    """
+
+def _build_user_prompt(state: AgentState, system_prompt: str) -> str:
+    alert = state["alert"]
+    # Oversized alert details may take at most half the budget; context chunks get what is left
+    alert_str = packer.trim(alert.json(), packer.budget // 2)
+    context_lines = packer.pack(
+        [system_prompt, USER_PROMPT.format(alert=alert_str, context="")],
+        [f"- {c['content']}" for c in state["context"]]
+    )
+    return USER_PROMPT.format(alert=alert_str, context="\n".join(context_lines))
 
 def analyze_alert(state: AgentState) -> Dict[str, Any]:
     """
@@ -12,24 +35,24 @@ def analyze_alert(state: AgentState) -> Dict[str, Any]:
     Goal: Analyze the alert and context to understand the threat.
     """
     print("--- NODE: ANALYZING ALERT ---")
-    alert = state["alert"]
-    context = state["context"]
-    
-    # Prepare context string
-    context_str = "\n".join([f"- {c['content']}" for c in context])
-    
-    # Construct Prompt
     system_prompt = get_system_prompt("analyst")
-    user_prompt = f"""
-    Alert: {alert.json()}
+    user_prompt = _build_user_prompt(state, system_prompt)
     
-    Context:
-    {context_str}
+    # Call LLM
+    analysis = llm.generate_with_system_prompt(system_prompt, user_prompt, prompt_name="analyst")
     
-    Task: Perform a deep-dive analysis. Is this a False Positive? Map to MITRE ATT&CK.
+    return {"normalized_summary": analysis}
+
+async def aanalyze_alert(state: AgentState) -> Dict[str, Any]:
+    """
+    Node: Analyst (async)
+    Same as analyze_alert, but generation runs off the event loop and tokens are streamed to subscribers.
     """
+    print("--- NODE: ANALYZING ALERT ---")
+    system_prompt = get_system_prompt("analyst")
+    user_prompt = _build_user_prompt(state, system_prompt)
     
-    # Call LLM
-    analysis = llm.generate_with_system_prompt(system_prompt, user_prompt)
+    on_token = alert_events.token_publisher(state["alert"].alert_id, "analyze")
+    analysis = await llm.agenerate_with_system_prompt(system_prompt, user_prompt, on_token=on_token, prompt_name="analyst")
     
     return {"normalized_summary": analysis}
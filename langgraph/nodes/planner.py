@@ -2,11 +2,36 @@ from langgraph.state import AgentState
 from models.llm import LocalLLM
 from models.prompts import get_system_prompt
 from api.schemas import Remediation, Provenance
+from infra.events import alert_events
+from models.context_packer import ContextPacker
 from typing import Dict, Any
 import json
 import uuid
 
 llm = LocalLLM()
+packer = ContextPacker(llm.adapter.count_tokens)
+
+USER_PROMPT = """
+    Analyst Findings: {analysis}
+    Original Alert: {summary}
+    Severity: {severity}
+    
+    Context:
+    {context}
+    
+    Generate a strict JSON remediation plan based on the findings and context.
+    """
+
+def _build_user_prompt(state: AgentState, system_prompt: str) -> str:
+    alert = state["alert"]
+    fields = {"analysis": state["normalized_summary"], "summary": alert.summary, "severity": alert.severity}
+    # Same rendering as json.dumps(context), keeping the best-ranked items that fit
+    items = packer.pack(
+        [system_prompt, USER_PROMPT.format(context="[]", **fields)],
+        [json.dumps(c, default=str) for c in state["context"]],
+        separator=", "
+    )
+    return USER_PROMPT.format(context="[" + ", ".join(items) + "]", **fields)
 
 def plan_remediation(state: AgentState) -> Dict[str, Any]:
     """
@@ -14,24 +39,31 @@ def plan_remediation(state: AgentState) -> Dict[str, Any]:
     Goal: Generate a structured remediation plan.
     """
     print("--- NODE: PLANNING REMEDIATION ---")
-    alert = state["alert"]
-    analysis = state["normalized_summary"]
-    context = state["context"]
-    
     system_prompt = get_system_prompt("planner")
-    user_prompt = f"""
-    Analyst Findings: {analysis}
-    Original Alert: {alert.summary}
-    Severity: {alert.severity}
+    user_prompt = _build_user_prompt(state, system_prompt)
     
-    Context:
-    {json.dumps(context, default=str)}
+    # Call LLM
+    response_text = llm.generate_with_system_prompt(system_prompt, user_prompt, prompt_name="planner")
     
-    Generate a strict JSON remediation plan based on the findings and context.
+    return _parse_plan(state, response_text)
+
+async def aplan_remediation(state: AgentState) -> Dict[str, Any]:
+    """
+    Node: Planner (async)
+    Same as plan_remediation, but generation runs off the event loop and tokens are streamed to subscribers.
     """
+    print("--- NODE: PLANNING REMEDIATION ---")
+    system_prompt = get_system_prompt("planner")
+    user_prompt = _build_user_prompt(state, system_prompt)
     
-    # Call LLM
-    response_text = llm.generate_with_system_prompt(system_prompt, user_prompt)
+    on_token = alert_events.token_publisher(state["alert"].alert_id, "plan")
+    response_text = await llm.agenerate_with_system_prompt(system_prompt, user_prompt, on_token=on_token, prompt_name="planner")
+    
+    return _parse_plan(state, response_text)
+
+def _parse_plan(state: AgentState, response_text: str) -> Dict[str, Any]:
+    alert = state["alert"]
+    context = state["context"]
     
     # Parse JSON (Basic cleanup)
     try:
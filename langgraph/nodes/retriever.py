@@ -1,12 +1,14 @@
 from langgraph.state import AgentState
 from langgraph.memory.retriever import HybridRetriever
 from langgraph.memory.vector_store import VectorStore
-from typing import Dict, Any
+from infra.lazy import Lazy
+from typing import Dict, Any, List
+import asyncio
 
 # Initialize singletons (in prod, use dependency injection)
-# We assume Chroma and Redis are running
-vector_store = VectorStore()
-retriever = HybridRetriever(vector_store)
+# We assume Chroma and Redis are running. Chroma is opened on first retrieval, not at import.
+vector_store = Lazy(VectorStore, name="vector_store")
+retriever = Lazy(lambda: HybridRetriever(vector_store.get()), name="hybrid_retriever")
 
 def retrieve_context(state: AgentState) -> Dict[str, Any]:
     """
@@ -14,13 +16,34 @@ def retrieve_context(state: AgentState) -> Dict[str, Any]:
     Goal: Fetch relevant playbooks and threat intel based on the alert.
     """
     print("--- NODE: RETRIEVING CONTEXT ---")
-    alert = state["alert"]
-    query = f"{alert.source} {alert.severity} {alert.summary}"
+    query = _alert_query(state["alert"])
     
     # Fetch docs
-    docs = retriever.search(query, k=3)
+    docs = retriever.get().retrieve(query, k=3)
     
+    return {"context": _context_items(docs)}
+
+def retrieve_context_batch(states: List[AgentState]) -> List[Dict[str, Any]]:
+    """
+    Retrieves context for a group of alerts with one embedding batch and one index query.
+    """
+    batch = retriever.get().retrieve_batch([_alert_query(state["alert"]) for state in states], k=3)
+    return [{"context": _context_items(docs)} for docs in batch]
+
+def _alert_query(alert) -> str:
+    return f"{alert.source} {alert.severity} {alert.summary}"
+
+def _context_items(docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     # Format for state
-    context_items = [{"content": doc["content"], "metadata": doc["metadata"]} for doc in docs]
-    
-    return {"context": context_items}
+    # The fused score lets routing rules act on a strong playbook match
+    return [{"content": doc["content"], "metadata": doc["metadata"], "score": doc["score"]} for doc in docs]
+
+async def aretrieve_context(state: AgentState) -> Dict[str, Any]:
+    """
+    Node: Context Retriever (async)
+    Chroma and BM25 calls are blocking, so the lookup runs in a worker thread.
+    Context already in the state (prefetched for a batch of alerts by the worker) is kept as is.
+    """
+    if state.get("context"):
+        return {}
+    return await asyncio.to_thread(retrieve_context, state)
@@ -0,0 +1,88 @@
+from langgraph.state import AgentState
+from langgraph.memory.retriever import RRF_K, RRF_MAX_SCORE
+from typing import Dict, Any, List, Optional
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Optional JSON file with a list of rules; first match wins, no match goes through the LLM path.
+ROUTING_RULES_PATH = os.getenv("ROUTING_RULES_PATH")
+
+ROUTE_TEMPLATE = "template"
+ROUTE_LLM = "llm"
+
+# Rule fields (all optional, all must hold):
+#   severity: [..]            alert severity is one of these
+#   source: [..]              alert source is one of these (case-insensitive)
+#   context_sources: [..]     a retrieved chunk comes from one of these sources...
+#   min_context_score: float  ...with a fused retrieval score of at least this. The score is RRF, not a
+#                             similarity: 1/(rank + 60) summed over the vector and keyword results, so at
+#                             most 2/60 (~0.033). Defaults to 1/60 (~0.0167): the chunk is the top hit of one
+#                             retriever or is found by both. ~0.032 asks for a top-2 hit in both.
+DEFAULT_MIN_CONTEXT_SCORE = 1 / RRF_K
+DEFAULT_ROUTING_RULES: List[Dict[str, Any]] = [
+    {"name": "low-severity", "severity": ["LOW"], "route": ROUTE_TEMPLATE},
+]
+
+def load_routing_rules(path: Optional[str] = ROUTING_RULES_PATH) -> List[Dict[str, Any]]:
+    if not path:
+        return list(DEFAULT_ROUTING_RULES)
+    with open(path, encoding="utf-8") as f:
+        rules = json.load(f)
+    for rule in rules:
+        if rule.get("route") not in (ROUTE_TEMPLATE, ROUTE_LLM):
+            raise ValueError(f"Routing rule {rule.get('name')} has invalid route {rule.get('route')}")
+        if rule.get("min_context_score", 0.0) > RRF_MAX_SCORE:
+            # e.g. 0.7 written on a similarity scale: no chunk could ever match
+            raise ValueError(f"Routing rule {rule.get('name')} has min_context_score {rule['min_context_score']}, "
+                             f"above the highest fused retrieval score {RRF_MAX_SCORE:.4f}")
+    return rules
+
+routing_rules = load_routing_rules()
+
+def _matches(rule: Dict[str, Any], state: AgentState) -> bool:
+    alert = state["alert"]
+    if "severity" in rule and alert.severity not in rule["severity"]:
+        return False
+    if "source" in rule and alert.source.lower() not in {s.lower() for s in rule["source"]}:
+        return False
+    if "context_sources" in rule or "min_context_score" in rule:
+        sources = rule.get("context_sources")
+        min_score = rule.get("min_context_score", DEFAULT_MIN_CONTEXT_SCORE)
+        if not any(
+            (sources is None or item.get("metadata", {}).get("source") in sources) and item.get("score", 0.0) >= min_score
+            for item in state.get("context") or []
+        ):
+            return False
+    return True
+
+def select_route(state: AgentState, rules: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Returns the route and the name of the rule that chose it.
+    """
+    for rule in routing_rules if rules is None else rules:
+        if _matches(rule, state):
+            return {"route": rule["route"], "rule": rule.get("name", "unnamed")}
+    return {"route": ROUTE_LLM, "rule": None}
+
+def route_alert(state: AgentState) -> Dict[str, Any]:
+    """
+    Node: Router
+    Goal: Send alerts that match a routing rule to the deterministic template path.
+    """
+    print("--- NODE: ROUTING ALERT ---")
+    decision = select_route(state)
+    logger.info(f"Alert {state['alert'].alert_id} routed to {decision['route']} (rule: {decision['rule']})")
+    return {"route": decision["route"]}
+
+async def aroute_alert(state: AgentState) -> Dict[str, Any]:
+    # Pure CPU and microseconds; no need to leave the event loop
+    return route_alert(state)
+
+def next_node(state: AgentState) -> str:
+    """
+    Conditional edge after the router.
+    """
+    return state.get("route") or ROUTE_LLM
@@ -0,0 +1,66 @@
+from langgraph.state import AgentState
+from api.schemas import Remediation, Provenance
+from typing import Dict, Any, List
+import hashlib
+import uuid
+
+TEMPLATE_VERSION = "template-v1"
+# Deterministic plans are deliberately conservative: they triage, they never contain
+TEMPLATE_CONFIDENCE = 0.6
+
+TEMPLATE_STEPS: Dict[str, List[str]] = {
+    "LOW": [
+        "Confirm the alert details in {source}.",
+        "Check for related alerts from the same source in the last 24 hours.",
+        "Close as informational if no related activity is found; otherwise escalate for analyst review.",
+    ],
+    "DEFAULT": [
+        "Confirm the alert details in {source}.",
+        "Collect related alerts and logs for the affected assets.",
+        "Escalate for analyst review.",
+    ],
+}
+
+def build_template_remediation(state: AgentState) -> Remediation:
+    alert = state["alert"]
+    context = state.get("context") or []
+    steps = [step.format(source=alert.source) for step in TEMPLATE_STEPS.get(alert.severity, TEMPLATE_STEPS["DEFAULT"])]
+
+    provenance = []
+    playbooks = [item for item in context if item.get("metadata", {}).get("source", "").startswith("playbook-")]
+    if playbooks:
+        top = playbooks[0]
+        steps.insert(-1, f"Apply the matching playbook ({top['metadata']['source']}).")
+        provenance.append(Provenance(
+            doc_id=top["metadata"]["source"],
+            chunk_id=str(top["metadata"].get("chunk", "chk-1")),
+            score=min(max(float(top.get("score", 0.0)), 0.0), 1.0)
+        ))
+
+    template_id = f"{TEMPLATE_VERSION}:{alert.severity}:{bool(playbooks)}"
+    return Remediation(
+        action_id=str(uuid.uuid4()),
+        alert_id=alert.alert_id,
+        title=f"Standard triage for {alert.severity} alert from {alert.source}",
+        steps=steps,
+        confidence=TEMPLATE_CONFIDENCE,
+        provenance=provenance,
+        model_version=TEMPLATE_VERSION,
+        prompt_hash="sha256:" + hashlib.sha256(template_id.encode("utf-8")).hexdigest(),
+        policy_verdict="PENDING"
+    )
+
+def template_remediation(state: AgentState) -> Dict[str, Any]:
+    """
+    Node: Template Remediation
+    Goal: Produce a deterministic plan without any LLM call for alerts routed off the LLM path.
+    """
+    print("--- NODE: TEMPLATE REMEDIATION ---")
+    alert = state["alert"]
+    return {
+        "normalized_summary": f"{alert.severity} alert from {alert.source}: {alert.summary}",
+        "remediation": build_template_remediation(state)
+    }
+
+async def atemplate_remediation(state: AgentState) -> Dict[str, Any]:
+    return template_remediation(state)
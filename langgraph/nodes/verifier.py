@@ -1,19 +1,76 @@
+from langgraph.state import AgentState
 from langgraph.agents.verifier import OutputVerifier, PolicyEngine, LLMGuardrail
-from models.local_adapter import LocalAdapter
-from typing import Dict, Any
+from langgraph.nodes.router import ROUTE_TEMPLATE
+from models.registry import model_registry
+from typing import Dict, Any, Awaitable, Callable, Tuple
 from infra.observability import POLICY_VIOLATIONS_TOTAL
+import asyncio
+import time
 
 # Initialize Verifiers
 policy_engine = PolicyEngine()
 verifier = OutputVerifier(policy_engine)
-# We need an adapter for the guardrail
-adapter = LocalAdapter() 
+# The guardrail shares the process-wide adapter with the analyst and planner
+adapter = model_registry.acquire()
 guardrail = LLMGuardrail(adapter)
 
+def _plan_text(remediation) -> str:
+    # Convert plan to text for verification
+    return f"{remediation.title}\n" + "\n".join(remediation.steps)
+
+def _timed(check: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    result = check()
+    return {**result, "duration_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+async def _atimed(check: Awaitable[Dict[str, Any]]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    result = await check
+    return {**result, "duration_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+# Which violation counter a failing check increments
+_VIOLATION_TYPES = {"policy": "regex_verifier", "groundedness": "groundedness", "guardrail": "llm_guardrail"}
+
+def _apply_verdicts(remediation, checks: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    final_verdict = "PASS"
+    for name, result in checks.items():
+        if result["verdict"] == "FAIL":
+            final_verdict = "FAIL"
+            POLICY_VIOLATIONS_TOTAL.labels(policy_type=_VIOLATION_TYPES[name]).inc()
+        
+    # Update Remediation object
+    remediation.policy_verdict = final_verdict
+    
+    return {
+        "verification_result": {
+            "verdict": final_verdict,
+            "checks": checks
+        },
+        "remediation": remediation
+    }
+
+SKIPPED = {"verdict": "SKIPPED", "reasoning": "Policy check already failed"}
+# Template plans are fixed text: policy still applies, model-based checks add nothing
+TEMPLATE_SKIPPED = {"verdict": "SKIPPED", "reasoning": "Deterministic template plan"}
+
+def _policy_stage(state: AgentState, plan_text: str) -> Tuple[Dict[str, Dict[str, Any]], bool]:
+    """
+    Runs the regex policy (microseconds). Returns the checks so far and whether they are final.
+    """
+    checks = {"policy": _timed(lambda: policy_engine.check_policy(plan_text))}
+    if checks["policy"]["verdict"] == "FAIL":
+        checks.update(groundedness=SKIPPED, guardrail=SKIPPED)
+        return checks, True
+    if state.get("route") == ROUTE_TEMPLATE:
+        checks.update(groundedness=TEMPLATE_SKIPPED, guardrail=TEMPLATE_SKIPPED)
+        return checks, True
+    return checks, False
+
 def verify_plan(state: AgentState) -> Dict[str, Any]:
     """
     Node: Verifier
     Goal: Check if the plan is safe and grounded.
+    Cheap-first cascade: a regex policy failure rejects the plan without any model call.
     """
     print("--- NODE: VERIFYING PLAN ---")
     remediation = state["remediation"]
@@ -22,31 +79,41 @@ def verify_plan(state: AgentState) -> Dict[str, Any]:
     if not remediation:
         return {"next_step": "END"}
         
-    # 1. Convert plan to text for verification
-    plan_text = f"{remediation.title}\n" + "\n".join(remediation.steps)
+    plan_text = _plan_text(remediation)
     
-    # 2. Run OutputVerifier (Regex + CrossEncoder)
-    verdict = verifier.verify(plan_text, context)
+    # 1. Regex policy
+    checks, final = _policy_stage(state, plan_text)
+    if final:
+        return _apply_verdicts(remediation, checks)
     
-    # 3. Run LLM Guardrail (The new pattern we added)
-    # We check the *steps* specifically
-    guardrail_result = guardrail.check(plan_text)
+    # 2. Cross-encoder groundedness, 3. LLM Guardrail on the steps
+    checks["groundedness"] = _timed(lambda: verifier.check_groundedness(plan_text, context, remediation.steps))
+    checks["guardrail"] = _timed(lambda: guardrail.check(plan_text))
     
-    final_verdict = "PASS"
-    if verdict["verdict"] == "FAIL":
-        final_verdict = "FAIL"
-        POLICY_VIOLATIONS_TOTAL.labels(policy_type="regex_verifier").inc()
-    elif guardrail_result["verdict"] == "FAIL":
-        final_verdict = "FAIL"
-        POLICY_VIOLATIONS_TOTAL.labels(policy_type="llm_guardrail").inc()
+    return _apply_verdicts(remediation, checks)
+
+async def averify_plan(state: AgentState) -> Dict[str, Any]:
+    """
+    Node: Verifier (async)
+    Same cascade as verify_plan, but the cross-encoder and guardrail run concurrently
+    and off the event loop.
+    """
+    print("--- NODE: VERIFYING PLAN ---")
+    remediation = state["remediation"]
+    context = state["context"]
+    
+    if not remediation:
+        return {"next_step": "END"}
         
-    # Update Remediation object
-    remediation.policy_verdict = final_verdict
+    plan_text = _plan_text(remediation)
     
-    return {
-        "verification_result": {
-            "verifier": verdict,
-            "guardrail": guardrail_result
-        },
-        "remediation": remediation
-    }
+    checks, final = _policy_stage(state, plan_text)
+    if final:
+        return _apply_verdicts(remediation, checks)
+    
+    checks["groundedness"], checks["guardrail"] = await asyncio.gather(
+        _atimed(asyncio.to_thread(verifier.check_groundedness, plan_text, context, remediation.steps)),
+        _atimed(guardrail.acheck(plan_text)),
+    )
+    
+    return _apply_verdicts(remediation, checks)
@@ -5,6 +5,9 @@ import operator
 class AgentState(TypedDict):
     # The raw input alert
     alert: Alert
+
+    # IDs of duplicate alerts that were coalesced onto this run instead of starting their own
+    attached_alerts: List[str]
     
     # Normalized/Enriched data
     normalized_summary: Optional[str]
@@ -22,5 +25,7 @@ class AgentState(TypedDict):
     human_feedback: Optional[str]
     
     # Flow control
+    # "template" for alerts a routing rule sends to the deterministic path, else "llm"
+    route: Optional[str]
     next_step: str
     retry_count: int
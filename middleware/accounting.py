@@ -1,8 +1,23 @@
 from sqlalchemy.orm import Session
-from infra.db import Base
-from sqlalchemy import Column, Integer, String, Float, DateTime
+from infra.db import Base, SessionLocal
+from sqlalchemy import Column, Integer, String, Float, DateTime, insert, select
 from datetime import datetime
-from typing import Dict, Any
+from typing import Callable, Dict, Any, List, Optional
+import atexit
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Rows buffered before a flush is triggered, and the longest a row waits for one
+USAGE_FLUSH_SIZE = int(os.getenv("USAGE_FLUSH_SIZE", "100"))
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "2.0"))
+# Rows kept while the database is unreachable; the oldest are dropped beyond this
+USAGE_MAX_BACKLOG = int(os.getenv("USAGE_MAX_BACKLOG", "50000"))
+# Most recent usage rows replayed into the anomaly detectors at startup
+ANOMALY_REPLAY_ROWS = int(os.getenv("ANOMALY_REPLAY_ROWS", "50000"))
 
 # DB Model for Token Usage
 class TokenUsage(Base):
@@ -17,21 +32,126 @@ class TokenUsage(Base):
     total_tokens = Column(Integer)
     cost_estimate = Column(Float)
 
-from finops.budget import BudgetPolicy
-from finops.anomaly import AnomalyDetector
+from finops.budget import BudgetPolicy, budget_policy
+from finops.anomaly import AnomalyDetectorBank, anomaly_detectors
 from fastapi import HTTPException
-from infra.observability import TOKEN_USAGE_TOTAL, BUDGET_SPEND_DAILY
+from infra.observability import TOKEN_USAGE_TOTAL, BUDGET_SPEND_DAILY, USAGE_FLUSH_SECONDS, USAGE_BACKLOG, USAGE_ROWS_DROPPED_TOTAL
+
+class UsageWriter:
+    """
+    Write-behind buffer for TokenUsage rows.
+    Rows are queued in memory and written by a background thread with one bulk INSERT,
+    once flush_size rows are pending or flush_interval has passed. A failed flush keeps
+    its rows for the next attempt. close() flushes what is left.
+    """
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal, flush_size: int = USAGE_FLUSH_SIZE,
+                 flush_interval: float = USAGE_FLUSH_INTERVAL, max_backlog: int = USAGE_MAX_BACKLOG):
+        self.session_factory = session_factory
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_backlog = max_backlog
+        self._rows: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        # Serializes flushes between the background thread and close()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, row: Dict[str, Any]):
+        with self._lock:
+            self._rows.append(row)
+            if len(self._rows) > self.max_backlog:
+                dropped = len(self._rows) - self.max_backlog
+                del self._rows[:dropped]
+                USAGE_ROWS_DROPPED_TOTAL.inc(dropped)
+                logger.error(f"Usage backlog over {self.max_backlog} rows, dropped the {dropped} oldest")
+            backlog = len(self._rows)
+            if self._thread is None:
+                self._start()
+        USAGE_BACKLOG.set(backlog)
+        if backlog >= self.flush_size:
+            self._wakeup.set()
+
+    def _start(self):
+        # Started on the first row, so importing the module never spawns threads
+        self._thread = threading.Thread(target=self._run, name="usage-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Writes every buffered row in one bulk INSERT. Returns the number of rows written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+            started = time.perf_counter()
+            try:
+                with self.session_factory() as db:
+                    db.execute(insert(TokenUsage), rows)
+                    db.commit()
+            except Exception as e:
+                logger.error(f"Flushing {len(rows)} usage rows failed, will retry: {e}")
+                with self._lock:
+                    # Put them back ahead of anything recorded meanwhile
+                    self._rows[:0] = rows
+                    USAGE_BACKLOG.set(len(self._rows))
+                return 0
+            finally:
+                USAGE_FLUSH_SECONDS.observe(time.perf_counter() - started)
+            with self._lock:
+                USAGE_BACKLOG.set(len(self._rows))
+            return len(rows)
+
+    @property
+    def backlog(self) -> int:
+        return len(self._rows)
+
+    def close(self):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+# Shared by every adapter in the process
+usage_writer = UsageWriter()
+
+def replay_usage_history(bank: AnomalyDetectorBank = anomaly_detectors, session_factory: Callable[[], Session] = SessionLocal,
+                         limit: int = ANOMALY_REPLAY_ROWS) -> int:
+    """
+    Seeds the anomaly detectors with the most recent usage rows, so a restarted worker
+    does not start every series from an empty window. Returns the number of rows replayed.
+    """
+    with session_factory() as db:
+        rows = db.execute(
+            select(TokenUsage.agent, TokenUsage.model, TokenUsage.total_tokens).order_by(TokenUsage.id.desc()).limit(limit)
+        ).all()
+    rows.reverse()
+    bank.bulk_update(((agent, model), total) for agent, model, total in rows)
+    logger.info(f"Replayed {len(rows)} usage rows into {len(bank.detectors)} anomaly detectors")
+    return len(rows)
 
 class TokenAccountant:
-    def __init__(self, db: Session):
-        self.db = db
+    def __init__(self, writer: Optional[UsageWriter] = None, budget: Optional[BudgetPolicy] = None):
+        # Rows are persisted write-behind; the budget decision below never waits on the database
+        self.writer = writer or usage_writer
         # Cost per 1k tokens (example)
         self.cost_per_1k = 0.002 
         
         # Initialize FinOps controls
-        # In a real app, these might be singletons injected via dependency injection
-        self.budget_policy = BudgetPolicy()
-        self.anomaly_detector = AnomalyDetector()
+        # The budget is shared by every accountant in the process (and through Redis, the deployment)
+        self.budget_policy = budget or budget_policy
+        self.anomaly_detectors = anomaly_detectors
 
     def check_and_log(self, agent: str, metadata: Dict[str, Any]):
         """
@@ -44,11 +164,12 @@ class TokenAccountant:
         completion_tokens = metadata.get("completion_tokens", 0)
         total = prompt_tokens + completion_tokens
         cost = (total / 1000) * self.cost_per_1k
+        model = metadata.get("model_version", "unknown")
 
-        # 1. Anomaly Detection
-        if self.anomaly_detector.is_anomaly(total):
+        # 1. Anomaly Detection (one series per agent and model)
+        if self.anomaly_detectors.is_anomaly((agent, model), total):
             # Log it, maybe alert. For now, we just print/log.
-            print(f"ANOMALY DETECTED: Token spike of {total} tokens for agent {agent}")
+            print(f"ANOMALY DETECTED: Token spike of {total} tokens for agent {agent} on {model}")
             # We could raise an exception to block the result, but usually we just alert.
 
         # 2. Budget Check
@@ -61,18 +182,17 @@ class TokenAccountant:
         self.budget_policy.record_spend(cost)
         
         # Metrics Update
-        TOKEN_USAGE_TOTAL.labels(model=metadata.get("model_version", "unknown"), type="prompt").inc(prompt_tokens)
-        TOKEN_USAGE_TOTAL.labels(model=metadata.get("model_version", "unknown"), type="completion").inc(completion_tokens)
+        TOKEN_USAGE_TOTAL.labels(model=model, type="prompt").inc(prompt_tokens)
+        TOKEN_USAGE_TOTAL.labels(model=model, type="completion").inc(completion_tokens)
         BUDGET_SPEND_DAILY.set(self.budget_policy.current_spend)
 
-        # 4. Persist to DB
-        usage = TokenUsage(
-            agent=agent,
-            model=metadata.get("model_version", "unknown"),
-            prompt_tokens=prompt_tokens,
-            completion_tokens=completion_tokens,
-            total_tokens=total,
-            cost_estimate=cost
-        )
-        self.db.add(usage)
-        self.db.commit()
+        # 4. Persist to DB (buffered, written in bulk by the usage writer)
+        self.writer.add({
+            "timestamp": datetime.utcnow(),
+            "agent": agent,
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": total,
+            "cost_estimate": cost
+        })
@@ -1,5 +1,25 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+from typing import Dict, Any, Callable, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import asyncio
+import contextvars
+import os
+from models.tokenizer import estimate_tokens
+
+# Bounded pool for blocking inference calls, so CPU-bound generation never runs on the event loop.
+# Sized independently from the default executor to keep a generation storm from starving other to_thread work.
+MODEL_EXECUTOR_WORKERS = int(os.getenv("MODEL_EXECUTOR_WORKERS", "4"))
+inference_executor = ThreadPoolExecutor(max_workers=MODEL_EXECUTOR_WORKERS, thread_name_prefix="inference")
+
+async def run_in_inference_executor(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Runs a blocking callable on the inference executor and awaits its result.
+    The caller's contextvars (e.g. the active tracing span) are carried over to the worker thread.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(inference_executor, partial(ctx.run, func, *args, **kwargs))
 
 class ModelAdapter(ABC):
     @abstractmethod
@@ -15,3 +35,93 @@ class ModelAdapter(ABC):
             }
         """
         pass
+
+    async def apredict(self, prompt: str, max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
+        """
+        Async variant of predict. Offloads the blocking call to the bounded inference executor.
+        """
+        return await run_in_inference_executor(self.predict, prompt, max_tokens=max_tokens, temp=temp)
+
+    def predict_stream(self, prompt: str, on_token: Callable[[str], None], max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
+        """
+        Like predict, but calls on_token with each chunk of text as it is generated.
+        Backends without streaming emit the whole completion as a single chunk.
+        """
+        result = self.predict(prompt, max_tokens=max_tokens, temp=temp)
+        on_token(result["text"])
+        return result
+
+    async def apredict_stream(self, prompt: str, on_token: Callable[[str], None], max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
+        """
+        Async variant of predict_stream. on_token is called from the inference thread.
+        """
+        return await run_in_inference_executor(self.predict_stream, prompt, on_token, max_tokens=max_tokens, temp=temp)
+
+    def predict_batch(self, prompts: List[str], max_tokens: int = 200, temp: float = 0.7,
+                      on_tokens: Optional[List[Optional[Callable[[str], None]]]] = None) -> List[Dict[str, Any]]:
+        """
+        Generates a completion for each prompt. Results are returned in input order, each with its own token metadata.
+        on_tokens optionally holds one streaming callback (or None) per prompt, as for predict_stream.
+        Backends without native batching fall back to sequential generation.
+        """
+        on_tokens = on_tokens or [None] * len(prompts)
+        return [self.predict_stream(prompt, on_token, max_tokens=max_tokens, temp=temp) if on_token
+                else self.predict(prompt, max_tokens=max_tokens, temp=temp)
+                for prompt, on_token in zip(prompts, on_tokens)]
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Number of tokens the model sees for text. Backends without a tokenizer estimate it.
+        """
+        return estimate_tokens(text)
+
+    def register_prefix(self, name: str, prefix: str):
+        """
+        Declares a static prompt prefix (e.g. a system prompt) shared by many calls, so backends
+        that can keep its evaluated state only evaluate the rest of each prompt. No-op by default.
+        """
+        pass
+
+class AdapterWrapper(ModelAdapter):
+    """
+    Base for adapters that add behaviour (batching, caching, ...) around another adapter.
+    Anything not overridden is delegated to the wrapped adapter.
+    """
+    def __init__(self, adapter: ModelAdapter):
+        self.adapter = adapter
+
+    def predict(self, prompt: str, max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
+        return self.adapter.predict(prompt, max_tokens=max_tokens, temp=temp)
+
+    async def apredict(self, prompt: str, max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
+        return await self.adapter.apredict(prompt, max_tokens=max_tokens, temp=temp)
+
+    def predict_stream(self, prompt: str, on_token: Callable[[str], None], max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
+        return self.adapter.predict_stream(prompt, on_token, max_tokens=max_tokens, temp=temp)
+
+    async def apredict_stream(self, prompt: str, on_token: Callable[[str], None], max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
+        return await self.adapter.apredict_stream(prompt, on_token, max_tokens=max_tokens, temp=temp)
+
+    def predict_batch(self, prompts: List[str], max_tokens: int = 200, temp: float = 0.7,
+                      on_tokens: Optional[List[Optional[Callable[[str], None]]]] = None) -> List[Dict[str, Any]]:
+        if on_tokens is None:
+            return self.adapter.predict_batch(prompts, max_tokens=max_tokens, temp=temp)
+        return self.adapter.predict_batch(prompts, max_tokens=max_tokens, temp=temp, on_tokens=on_tokens)
+
+    def count_tokens(self, text: str) -> int:
+        return self.adapter.count_tokens(text)
+
+    def register_prefix(self, name: str, prefix: str):
+        self.adapter.register_prefix(name, prefix)
+
+    def close(self):
+        close = getattr(self.adapter, "close", None)
+        if close:
+            close()
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes not found on the wrapper itself (model_name, accountant, ...)
+        adapter = self.__dict__.get("adapter")
+        if adapter is None:
+            raise AttributeError(name)
+        return getattr(adapter, name)
@@ -0,0 +1,79 @@
+from models.adapter import AdapterWrapper, ModelAdapter, run_in_inference_executor
+from infra.observability import INFERENCE_BATCH_SIZE
+from typing import Dict, Any, Callable, List, Optional, Tuple
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# How long the first request of a batch waits for company, and how large a batch may grow.
+# A window of 0 disables batching.
+MODEL_BATCH_WINDOW_MS = float(os.getenv("MODEL_BATCH_WINDOW_MS", "0"))
+MODEL_MAX_BATCH_SIZE = int(os.getenv("MODEL_MAX_BATCH_SIZE", "8"))
+
+class BatchingAdapter(AdapterWrapper):
+    """
+    Micro-batching scheduler in front of an adapter.
+    Concurrent apredict and apredict_stream calls with the same generation parameters are
+    gathered for up to window_ms (or until max_batch_size is reached) and run through one
+    predict_batch call. Synchronous predict calls bypass the scheduler.
+    """
+    def __init__(self, adapter: ModelAdapter, window_ms: Optional[float] = None, max_batch_size: Optional[int] = None):
+        super().__init__(adapter)
+        self.window = (window_ms if window_ms is not None else MODEL_BATCH_WINDOW_MS) / 1000
+        self.max_batch_size = max_batch_size or MODEL_MAX_BATCH_SIZE
+        # Pending requests per (event loop, max_tokens, temp); futures are bound to their loop
+        self._pending: Dict[Tuple[int, int, float], List[Tuple[str, asyncio.Future, Optional[Callable[[str], None]]]]] = {}
+        self._timers: Dict[Tuple[int, int, float], asyncio.TimerHandle] = {}
+
+    async def apredict(self, prompt: str, max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
+        return await self._submit(prompt, max_tokens, temp, None)
+
+    async def apredict_stream(self, prompt: str, on_token: Callable[[str], None], max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
+        # Streaming requests share batches with plain ones; each keeps its own callback
+        return await self._submit(prompt, max_tokens, temp, on_token)
+
+    async def _submit(self, prompt: str, max_tokens: int, temp: float,
+                      on_token: Optional[Callable[[str], None]]) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        key = (id(loop), max_tokens, temp)
+        future = loop.create_future()
+
+        batch = self._pending.setdefault(key, [])
+        batch.append((prompt, future, on_token))
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+
+        return await future
+
+    def _flush(self, key: Tuple[int, int, float]):
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if batch:
+            asyncio.get_running_loop().create_task(self._run(batch, max_tokens=key[1], temp=key[2]))
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future, Optional[Callable[[str], None]]]], max_tokens: int, temp: float):
+        INFERENCE_BATCH_SIZE.observe(len(batch))
+        prompts = [prompt for prompt, _, _ in batch]
+        kwargs = {"max_tokens": max_tokens, "temp": temp}
+        on_tokens = [on_token for _, _, on_token in batch]
+        if any(on_tokens):
+            kwargs["on_tokens"] = on_tokens
+        try:
+            results = await run_in_inference_executor(self.adapter.predict_batch, prompts, **kwargs)
+        except Exception as e:
+            logger.error(f"Batched generation of {len(batch)} prompts failed: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            # A caller may have been cancelled while the batch was running
+            if not future.done():
+                future.set_result({**result, "batch_size": len(batch)})
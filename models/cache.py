@@ -0,0 +1,155 @@
+from models.adapter import AdapterWrapper, ModelAdapter
+from infra.cache import LRUCache
+from infra.observability import CACHE_HITS_TOTAL
+from typing import Dict, Any, List, Optional, Callable
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# In-process tier size (0 disables the cache) and TTL shared by both tiers.
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "600"))
+# Set to share responses across workers through Redis.
+LLM_CACHE_REDIS = os.getenv("LLM_CACHE_REDIS", "0") == "1"
+
+class ResponseCache:
+    """
+    Two-tier cache of model responses: an in-process LRU in front of an optional RedisStore.
+    The async variants run the blocking Redis tier in a thread, so event loops never wait on it.
+    """
+    def __init__(self, max_entries: int = LLM_CACHE_SIZE, ttl: int = LLM_CACHE_TTL, redis_store=None):
+        self.memory = LRUCache(max_entries=max_entries, ttl=ttl)
+        self.redis_store = redis_store
+        self.ttl = ttl
+
+    @staticmethod
+    def make_key(model_version: str, prompt: str, max_tokens: int, temp: float) -> str:
+        payload = json.dumps([model_version, prompt, max_tokens, temp], ensure_ascii=False)
+        return "llm_cache:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _get_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        result = self.memory.get(key)
+        if result is not None:
+            CACHE_HITS_TOTAL.labels(cache_type="llm").inc()
+        return result
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        result = self._get_memory(key)
+        if result is not None or self.redis_store is None:
+            return result
+        return self._get_shared(key)
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        result = self._get_memory(key)
+        if result is not None or self.redis_store is None:
+            return result
+        return await asyncio.to_thread(self._get_shared, key)
+
+    def _get_shared(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            result = self.redis_store.get_value(key)
+        except Exception as e:
+            # The shared tier is an optimisation; a Redis outage must not fail inference
+            logger.warning(f"LLM cache lookup in Redis failed: {e}")
+            return None
+        if result is not None:
+            CACHE_HITS_TOTAL.labels(cache_type="redis").inc()
+            self.memory.set(key, result)
+        return result
+
+    def set(self, key: str, result: Dict[str, Any]):
+        self.memory.set(key, result)
+        if self.redis_store is not None:
+            self._set_shared(key, result)
+
+    async def aset(self, key: str, result: Dict[str, Any]):
+        self.memory.set(key, result)
+        if self.redis_store is not None:
+            await asyncio.to_thread(self._set_shared, key, result)
+
+    def _set_shared(self, key: str, result: Dict[str, Any]):
+        try:
+            self.redis_store.set_value(key, result, ttl=self.ttl)
+        except Exception as e:
+            logger.warning(f"LLM cache write to Redis failed: {e}")
+
+class CachingAdapter(AdapterWrapper):
+    """
+    Content-addressed response cache around an adapter.
+    Hits are served without calling the wrapped adapter, so they are never charged to the TokenAccountant.
+    """
+    def __init__(self, adapter: ModelAdapter, cache: Optional[ResponseCache] = None):
+        super().__init__(adapter)
+        self.cache = cache or ResponseCache()
+
+    def _key(self, prompt: str, max_tokens: int, temp: float) -> str:
+        model_version = getattr(self.adapter, "model_name", type(self.adapter).__name__)
+        return self.cache.make_key(model_version, prompt, max_tokens, temp)
+
+    @staticmethod
+    def _hit(result: Dict[str, Any]) -> Dict[str, Any]:
+        return {**result, "cached": True}
+
+    def predict(self, prompt: str, max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
+        key = self._key(prompt, max_tokens, temp)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return self._hit(cached)
+        result = self.adapter.predict(prompt, max_tokens=max_tokens, temp=temp)
+        self.cache.set(key, result)
+        return result
+
+    async def apredict(self, prompt: str, max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
+        key = self._key(prompt, max_tokens, temp)
+        cached = await self.cache.aget(key)
+        if cached is not None:
+            return self._hit(cached)
+        result = await self.adapter.apredict(prompt, max_tokens=max_tokens, temp=temp)
+        await self.cache.aset(key, result)
+        return result
+
+    def predict_stream(self, prompt: str, on_token: Callable[[str], None], max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
+        key = self._key(prompt, max_tokens, temp)
+        cached = self.cache.get(key)
+        if cached is not None:
+            on_token(cached["text"])
+            return self._hit(cached)
+        result = self.adapter.predict_stream(prompt, on_token, max_tokens=max_tokens, temp=temp)
+        self.cache.set(key, result)
+        return result
+
+    async def apredict_stream(self, prompt: str, on_token: Callable[[str], None], max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
+        key = self._key(prompt, max_tokens, temp)
+        cached = await self.cache.aget(key)
+        if cached is not None:
+            on_token(cached["text"])
+            return self._hit(cached)
+        result = await self.adapter.apredict_stream(prompt, on_token, max_tokens=max_tokens, temp=temp)
+        await self.cache.aset(key, result)
+        return result
+
+    def predict_batch(self, prompts: List[str], max_tokens: int = 200, temp: float = 0.7,
+                      on_tokens: Optional[List[Optional[Callable[[str], None]]]] = None) -> List[Dict[str, Any]]:
+        keys = [self._key(prompt, max_tokens, temp) for prompt in prompts]
+        results: List[Optional[Dict[str, Any]]] = []
+        misses = []
+        for i, key in enumerate(keys):
+            cached = self.cache.get(key)
+            results.append(self._hit(cached) if cached is not None else None)
+            if cached is None:
+                misses.append(i)
+            elif on_tokens and on_tokens[i]:
+                on_tokens[i](cached["text"])
+
+        # Only the misses reach the model
+        if misses:
+            miss_tokens = [on_tokens[i] for i in misses] if on_tokens else None
+            generated = super().predict_batch([prompts[i] for i in misses], max_tokens=max_tokens, temp=temp, on_tokens=miss_tokens)
+            for i, result in zip(misses, generated):
+                self.cache.set(keys[i], result)
+                results[i] = result
+        return results
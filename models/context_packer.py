@@ -0,0 +1,67 @@
+from typing import Callable, List
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Token budget for a whole prompt. The default leaves room for 200 generated tokens and the
+# prompt template in a 2048-token context window.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1536"))
+# A trimmed chunk shorter than this is dropped instead
+PACKER_MIN_CHUNK_TOKENS = int(os.getenv("PACKER_MIN_CHUNK_TOKENS", "32"))
+
+class ContextPacker:
+    """
+    Fits ranked context chunks into a prompt's token budget.
+    The fixed parts (system prompt, alert, instructions) are counted first; chunks are then
+    taken in rank order, the first one that no longer fits is trimmed to the remaining
+    budget, and everything ranked below it is dropped.
+    """
+    def __init__(self, count_tokens: Callable[[str], int], budget: int = PROMPT_TOKEN_BUDGET,
+                 min_chunk_tokens: int = PACKER_MIN_CHUNK_TOKENS):
+        self.count_tokens = count_tokens
+        self.budget = budget
+        self.min_chunk_tokens = min_chunk_tokens
+
+    def trim(self, text: str, max_tokens: int) -> str:
+        """
+        Longest word prefix of text within max_tokens tokens.
+        """
+        if self.count_tokens(text) <= max_tokens:
+            return text
+        words = text.split(" ")
+        low, high = 0, len(words)
+        # Binary search on the number of words kept; counts are cached, so this is a few tokenizer calls
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.count_tokens(" ".join(words[:mid])) <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+        return " ".join(words[:low])
+
+    def pack(self, fixed: List[str], chunks: List[str], separator: str = "\n") -> List[str]:
+        """
+        Returns the chunks (best ranked first) that fit next to the fixed parts, the last one possibly trimmed.
+        """
+        remaining = self.budget - sum(self.count_tokens(part) for part in fixed)
+        if remaining <= 0:
+            logger.warning(f"Prompt is over its {self.budget}-token budget before any context; dropping all {len(chunks)} chunks")
+            return []
+
+        separator_tokens = self.count_tokens(separator)
+        packed = []
+        for chunk in chunks:
+            cost = self.count_tokens(chunk) + (separator_tokens if packed else 0)
+            if cost <= remaining:
+                packed.append(chunk)
+                remaining -= cost
+                continue
+            available = remaining - (separator_tokens if packed else 0)
+            if available >= self.min_chunk_tokens:
+                trimmed = self.trim(chunk, available)
+                if trimmed:
+                    packed.append(trimmed)
+            logger.info(f"Packed {len(packed)} of {len(chunks)} context chunks into a {self.budget}-token prompt")
+            break
+        return packed
@@ -1,10 +1,13 @@
-from models.local_adapter import LocalAdapter
-from typing import Optional
+from models.registry import model_registry, ModelRegistry, DEFAULT_MODEL_NAME
+from typing import Optional, Callable
 
 class LocalLLM:
-    def __init__(self, model_name: str = "orca-mini-3b-gguf2-q4_0.gguf", model_path: Optional[str] = None):
-        # We now wrap the Adapter instead of raw GPT4All
-        self.adapter = LocalAdapter(model_name, model_path)
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME, model_path: Optional[str] = None, registry: Optional[ModelRegistry] = None):
+        # We wrap the shared Adapter from the registry instead of loading our own copy of the weights
+        self.model_name = model_name
+        self.model_path = model_path
+        self.registry = registry or model_registry
+        self.adapter = self.registry.acquire(model_name, model_path)
 
     def generate(self, prompt: str, max_tokens: int = 200, temp: float = 0.7) -> str:
         """
@@ -14,11 +17,53 @@ class LocalLLM:
         result = self.adapter.predict(prompt, max_tokens=max_tokens, temp=temp)
         return result["text"]
 
-    def generate_with_system_prompt(self, system_prompt: str, user_prompt: str, max_tokens: int = 200) -> str:
+    async def agenerate(self, prompt: str, max_tokens: int = 200, temp: float = 0.7) -> str:
         """
-        Generates text using a system prompt and user prompt.
+        Async variant of generate. Does not block the event loop.
         """
+        result = await self.adapter.apredict(prompt, max_tokens=max_tokens, temp=temp)
+        return result["text"]
+
+    @staticmethod
+    def _system_prefix(system_prompt: str) -> str:
+        return f"System: {system_prompt}\n"
+
+    @classmethod
+    def _format_prompt(cls, system_prompt: str, user_prompt: str) -> str:
         # Construct prompt manually to pass to adapter
-        full_prompt = f"System: {system_prompt}\nUser: {user_prompt}\nAssistant:"
-        result = self.adapter.predict(full_prompt, max_tokens=max_tokens)
+        return f"{cls._system_prefix(system_prompt)}User: {user_prompt}\nAssistant:"
+
+    def _prepare(self, system_prompt: str, user_prompt: str, prompt_name: Optional[str]) -> str:
+        if prompt_name:
+            # Lets the adapter keep the system prompt evaluated and only process the user part
+            self.adapter.register_prefix(prompt_name, self._system_prefix(system_prompt))
+        return self._format_prompt(system_prompt, user_prompt)
+
+    def generate_with_system_prompt(self, system_prompt: str, user_prompt: str, max_tokens: int = 200,
+                                    prompt_name: Optional[str] = None) -> str:
+        """
+        Generates text using a system prompt and user prompt.
+        prompt_name identifies a static system prompt (see models/prompts.py) whose evaluated state may be reused.
+        """
+        result = self.adapter.predict(self._prepare(system_prompt, user_prompt, prompt_name), max_tokens=max_tokens)
+        return result["text"]
+
+    async def agenerate_with_system_prompt(self, system_prompt: str, user_prompt: str, max_tokens: int = 200,
+                                           on_token: Optional[Callable[[str], None]] = None,
+                                           prompt_name: Optional[str] = None) -> str:
+        """
+        Async variant of generate_with_system_prompt.
+        If on_token is given, the completion is streamed to it as it is generated.
+        """
+        full_prompt = self._prepare(system_prompt, user_prompt, prompt_name)
+        if on_token:
+            result = await self.adapter.apredict_stream(full_prompt, on_token, max_tokens=max_tokens)
+        else:
+            result = await self.adapter.apredict(full_prompt, max_tokens=max_tokens)
         return result["text"]
+
+    def close(self):
+        """
+        Releases this LLM's reference on the shared adapter.
+        """
+        self.registry.release(self.model_name, self.model_path)
@@ -1,23 +1,146 @@
 from models.adapter import ModelAdapter
-from gpt4all import GPT4All
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Callable
+from models.tokenizer import TokenCounter
+from models.prefix_cache import PrefixCache, GPT4AllState, MODEL_PREFIX_CACHE, PREFIX_N_BATCH
 from middleware.accounting import TokenAccountant
-from infra.db import SessionLocal
+from infra.observability import CACHE_HITS_TOTAL
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Context length the model is run with (GPT4All's default); prompts plus max_tokens must fit in it
+MODEL_CONTEXT_WINDOW = int(os.getenv("MODEL_CONTEXT_WINDOW", "2048"))
+# Tokens kept free when reusing a prefix, for template tokens the tokenizer count does not see
+PREFIX_CONTEXT_MARGIN = int(os.getenv("PREFIX_CONTEXT_MARGIN", "64"))
+# Drift allowed between the counted and the actual n_past after a prefix-reusing generation
+PREFIX_N_PAST_TOLERANCE = 2
 
 class LocalAdapter(ModelAdapter):
-    def __init__(self, model_name: str = "orca-mini-3b-gguf2-q4_0.gguf", model_path: Optional[str] = None):
-        self.model = GPT4All(model_name, model_path=model_path, allow_download=False)
+    def __init__(self, model_name: str = "orca-mini-3b-gguf2-q4_0.gguf", model_path: Optional[str] = None, max_concurrency: int = 1):
         self.model_name = model_name
-        # In production, pass DB session properly. Here we create one.
-        self.accountant = TokenAccountant(SessionLocal())
+        self.model_path = model_path
+        # Weights are loaded on first generation (or by warmup), not when the adapter is built
+        self._model = None
+        self._load_lock = threading.Lock()
+        # Caps concurrent generations on this (possibly shared) model instance
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.context_window = MODEL_CONTEXT_WINDOW
+        self.token_counter = TokenCounter()
+        self.accountant = TokenAccountant()
+        # KV reuse for registered system prompts; disabled if the bindings cannot support it
+        self.prefix_cache = PrefixCache() if MODEL_PREFIX_CACHE else None
+        self._kv_state = None
+        # Prefix reuse mutates the model's KV state, so it never overlaps with itself
+        self._kv_lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    from gpt4all import GPT4All
+                    self._model = GPT4All(self.model_name, model_path=self.model_path, allow_download=False)
+        return self._model
 
     def predict(self, prompt: str, max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
-        output = self.model.generate(prompt, max_tokens=max_tokens, temp=temp)
-        
-        # Estimate tokens (GPT4All might not give exact counts easily without encoding)
-        # For MVP, we estimate: 1 token ~= 4 chars
-        prompt_tokens = len(prompt) // 4
-        completion_tokens = len(output) // 4
+        with self._slots:
+            output = self._generate(prompt, max_tokens, temp)
+        return self._account(prompt, output)
+
+    def predict_stream(self, prompt: str, on_token: Callable[[str], None], max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
+        with self._slots:
+            output = self._generate(prompt, max_tokens, temp, on_token=on_token)
+        return self._account(prompt, output)
+
+    def predict_batch(self, prompts: List[str], max_tokens: int = 200, temp: float = 0.7,
+                      on_tokens: Optional[List[Optional[Callable[[str], None]]]] = None) -> List[Dict[str, Any]]:
+        # The GPT4All bindings have no batched decode, so the batch runs back-to-back
+        # under a single slot acquisition instead of queueing each prompt separately.
+        on_tokens = on_tokens or [None] * len(prompts)
+        with self._slots:
+            outputs = [self._generate(prompt, max_tokens, temp, on_token=on_token) for prompt, on_token in zip(prompts, on_tokens)]
+        return [self._account(prompt, output) for prompt, output in zip(prompts, outputs)]
+
+    def register_prefix(self, name: str, prefix: str):
+        if self.prefix_cache is not None:
+            self.prefix_cache.register(name, prefix)
+
+    def _state(self) -> Optional[GPT4AllState]:
+        if self._kv_state is None and self.prefix_cache is not None:
+            try:
+                self._kv_state = GPT4AllState(self.model)
+            except Exception as e:
+                logger.warning(f"KV prefix reuse unavailable with these gpt4all bindings, evaluating full prompts: {e}")
+                self.prefix_cache = None
+        return self._kv_state
+
+    def _generate(self, prompt: str, max_tokens: int, temp: float, on_token: Optional[Callable[[str], None]] = None) -> str:
+        match = self.prefix_cache.match(prompt) if self.prefix_cache is not None else None
+        # Prefix reuse relies on nothing being evicted from the context, which can only be checked with
+        # exact token counts; prompts near the window (or with estimated counts) take the plain path
+        if (match is not None and self.token_counter.exact
+                and self.count_tokens(prompt) + max_tokens + PREFIX_CONTEXT_MARGIN <= self.context_window
+                and self._state() is not None):
+            try:
+                with self._kv_lock:
+                    return self._generate_from_prefix(match[0], match[1], prompt, max_tokens, temp, on_token)
+            except AttributeError as e:
+                # The private bindings changed shape under us
+                logger.warning(f"KV prefix reuse failed with these gpt4all bindings, evaluating full prompts: {e}")
+                self.prefix_cache, self._kv_state = None, None
+
+        if self.prefix_cache is not None:
+            # A plain generation resets the context and overwrites the resident prefix
+            self.prefix_cache.resident = None
+        if on_token is None:
+            return self.model.generate(prompt, max_tokens=max_tokens, temp=temp)
+        chunks = []
+        for token in self.model.generate(prompt, max_tokens=max_tokens, temp=temp, streaming=True):
+            chunks.append(token)
+            on_token(token)
+        return "".join(chunks)
+
+    def _generate_from_prefix(self, name: str, prefix: str, prompt: str, max_tokens: int, temp: float,
+                              on_token: Optional[Callable[[str], None]]) -> str:
+        state, cache = self._kv_state, self.prefix_cache
+        if cache.resident == name:
+            # Still in the KV cache from the previous call: drop everything after it
+            state.n_past = cache.resident_n_past
+            CACHE_HITS_TOTAL.labels(cache_type="kv_prefix").inc()
+        else:
+            cache.resident = None
+            snapshot = cache.snapshots.get(name)
+            if snapshot is not None:
+                state.restore(snapshot)
+                CACHE_HITS_TOTAL.labels(cache_type="kv_snapshot").inc()
+            else:
+                state.evaluate(prefix, reset=True, n_predict=0, temp=temp, n_batch=PREFIX_N_BATCH)
+                snapshot = state.save()
+                cache.snapshots.set(name, snapshot)
+            cache.resident, cache.resident_n_past = name, snapshot.n_past
+        # Only the part after the prefix is evaluated
+        suffix = prompt[len(prefix):]
+        try:
+            output = state.evaluate(suffix, reset=False, n_predict=max_tokens, temp=temp, on_token=on_token)
+        except BaseException:
+            cache.resident = None
+            raise
+        # If the model shifted or rebuilt its context, the prefix is no longer where we left it
+        expected = cache.resident_n_past + self.count_tokens(suffix) + state.generated
+        if abs(state.n_past - expected) > PREFIX_N_PAST_TOLERANCE:
+            logger.warning(f"KV state at n_past={state.n_past}, expected {expected}; re-evaluating the prefix next time")
+            cache.resident = None
+        return output
+
+    def count_tokens(self, text: str) -> int:
+        # Exact with MODEL_TOKENIZER_PATH set, estimated otherwise
+        return self.token_counter.count(text)
+
+    def _account(self, prompt: str, output: str) -> Dict[str, Any]:
+        prompt_tokens = self.count_tokens(prompt)
+        completion_tokens = self.count_tokens(output)
         
         result = {
             "text": output,
@@ -31,3 +154,11 @@ class LocalAdapter(ModelAdapter):
         self.accountant.check_and_log("local_agent", result)
         
         return result
+
+    def close(self):
+        """
+        Frees the model weights. Usage rows are flushed by the shared usage writer.
+        """
+        # Older gpt4all releases have no close(); the weights are freed on GC instead
+        if self._model is not None and hasattr(self._model, "close"):
+            self._model.close()
@@ -0,0 +1,136 @@
+from infra.cache import LRUCache
+from typing import Callable, Dict, Optional, Tuple
+import ctypes
+import os
+import re
+import threading
+
+# Set to 0 to evaluate every prompt from scratch
+MODEL_PREFIX_CACHE = os.getenv("MODEL_PREFIX_CACHE", "1") == "1"
+# Evaluated prefixes kept as KV snapshots. Each holds the KV cache of its prefix tokens (tens of MB for a 3B model).
+MODEL_PREFIX_SNAPSHOTS = int(os.getenv("MODEL_PREFIX_SNAPSHOTS", "4"))
+
+# Sampling defaults of GPT4All.generate, so prefix-reusing generations sample the same way
+GENERATE_DEFAULTS = {"top_k": 40, "top_p": 0.4, "repeat_penalty": 1.18, "repeat_last_n": 64, "n_batch": 8}
+# Prefixes are evaluated once, so they get a larger batch
+PREFIX_N_BATCH = 128
+# gpt4all releases whose private bindings (_pyllmodel, LLModel.prompt_model, llmodel_*_state_data)
+# match what GPT4AllState calls: [min, max)
+GPT4ALL_STATE_VERSIONS = ((2, 0), (3, 0))
+
+def gpt4all_state_supported(version: str) -> bool:
+    numbers = [int(part) for part in re.findall(r"\d+", version)[:2]]
+    return len(numbers) == 2 and GPT4ALL_STATE_VERSIONS[0] <= tuple(numbers) < GPT4ALL_STATE_VERSIONS[1]
+
+class PrefixSnapshot:
+    __slots__ = ("data", "n_past")
+
+    def __init__(self, data, n_past: int):
+        self.data = data
+        self.n_past = n_past
+
+class GPT4AllState:
+    """
+    Direct access to a GPT4All model's evaluation state through the llmodel C API:
+    save/restore of the KV cache and continuing a prompt from the current n_past.
+    Raises on construction if the installed bindings are not a known-compatible release
+    or do not expose what this needs.
+    """
+    def __init__(self, gpt4all_model):
+        from importlib.metadata import version
+        installed = version("gpt4all")
+        if not gpt4all_state_supported(installed):
+            raise RuntimeError(f"gpt4all {installed} is outside the supported range {GPT4ALL_STATE_VERSIONS}")
+        from gpt4all import _pyllmodel
+        self.llmodel = gpt4all_model.model
+        if not hasattr(self.llmodel, "prompt_model"):
+            raise AttributeError("gpt4all bindings have no LLModel.prompt_model")
+        lib = _pyllmodel.llmodel
+        self._size = lib.llmodel_get_state_size
+        self._size.argtypes = [ctypes.c_void_p]
+        self._size.restype = ctypes.c_uint64
+        self._save = lib.llmodel_save_state_data
+        self._save.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint8)]
+        self._save.restype = ctypes.c_uint64
+        self._restore = lib.llmodel_restore_state_data
+        self._restore.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint8)]
+        self._restore.restype = ctypes.c_uint64
+        # Sized for a full context once; snapshots keep only the bytes actually written
+        self._scratch = None
+        # Tokens generated by the last evaluate call
+        self.generated = 0
+
+    @property
+    def n_past(self) -> int:
+        context = self.llmodel.context
+        return context.n_past if context is not None else 0
+
+    @n_past.setter
+    def n_past(self, value: int):
+        self.llmodel.context.n_past = value
+
+    def evaluate(self, text: str, reset: bool, n_predict: int, temp: float,
+                 on_token: Optional[Callable[[str], None]] = None, n_batch: Optional[int] = None) -> str:
+        """
+        Evaluates text on top of the current state (or a fresh one if reset) and generates up to n_predict tokens.
+        """
+        chunks = []
+
+        def callback(token_id: int, response: str) -> bool:
+            chunks.append(response)
+            if on_token:
+                on_token(response)
+            return True
+
+        kwargs = dict(GENERATE_DEFAULTS)
+        if n_batch:
+            kwargs["n_batch"] = n_batch
+        self.llmodel.prompt_model(text, "%1", callback, n_predict=n_predict, temp=temp, reset_context=reset, **kwargs)
+        self.generated = len(chunks)
+        return "".join(chunks)
+
+    def save(self) -> PrefixSnapshot:
+        if self._scratch is None:
+            self._scratch = (ctypes.c_uint8 * self._size(self.llmodel.model))()
+        written = self._save(self.llmodel.model, self._scratch)
+        data = (ctypes.c_uint8 * written)()
+        ctypes.memmove(data, self._scratch, written)
+        return PrefixSnapshot(data, self.n_past)
+
+    def restore(self, snapshot: PrefixSnapshot):
+        self._restore(self.llmodel.model, snapshot.data)
+        self.n_past = snapshot.n_past
+
+class PrefixCache:
+    """
+    Static prompt prefixes (system prompts) registered by name, and the KV state they evaluate to.
+    The prefix left in the model by the last generation is reused by rewinding n_past to its end;
+    other prefixes are restored from a snapshot, or evaluated once and snapshotted.
+    """
+    def __init__(self, max_snapshots: int = MODEL_PREFIX_SNAPSHOTS):
+        self.prefixes: Dict[str, str] = {}
+        self.snapshots = LRUCache(max_entries=max_snapshots)
+        # Name of the prefix whose tokens currently sit at the start of the model's KV cache, and their count
+        self.resident: Optional[str] = None
+        self.resident_n_past = 0
+        self._lock = threading.Lock()
+
+    def register(self, name: str, prefix: str):
+        with self._lock:
+            if self.prefixes.get(name) == prefix:
+                return
+            # A changed prompt invalidates whatever was evaluated for the old text
+            self.prefixes[name] = prefix
+            self.snapshots.set(name, None)
+            if self.resident == name:
+                self.resident = None
+
+    def match(self, prompt: str) -> Optional[Tuple[str, str]]:
+        """
+        The longest registered prefix the prompt starts with, as (name, prefix).
+        """
+        best = None
+        for name, prefix in self.prefixes.items():
+            if len(prefix) < len(prompt) and prompt.startswith(prefix) and (best is None or len(prefix) > len(best[1])):
+                best = (name, prefix)
+        return best
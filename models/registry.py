@@ -0,0 +1,111 @@
+import os
+import threading
+import logging
+from typing import Callable, Dict, Optional, Tuple
+from models.adapter import ModelAdapter
+from models.batching import BatchingAdapter, MODEL_BATCH_WINDOW_MS, MODEL_MAX_BATCH_SIZE
+from models.scheduler import PrioritySchedulingAdapter, MODEL_PRIORITY_SCHEDULING
+from models.cache import CachingAdapter, ResponseCache, LLM_CACHE_SIZE, LLM_CACHE_REDIS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_NAME = "orca-mini-3b-gguf2-q4_0.gguf"
+
+# Max number of generations allowed to run at once on one shared adapter.
+# GPT4All contexts are not re-entrant, so the safe default is 1.
+MODEL_MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", "1"))
+
+AdapterFactory = Callable[[str, Optional[str], int], ModelAdapter]
+
+
+def _local_adapter_factory(model_name: str, model_path: Optional[str], max_concurrency: int) -> ModelAdapter:
+    # Imported lazily so the registry can be used (and tested) without gpt4all installed
+    from models.local_adapter import LocalAdapter
+    return LocalAdapter(model_name, model_path, max_concurrency=max_concurrency)
+
+
+class _RegistryEntry:
+    def __init__(self, adapter: ModelAdapter):
+        self.adapter = adapter
+        self.refcount = 0
+
+
+class ModelRegistry:
+    """
+    Process-wide registry handing out one shared adapter per (model_name, model_path).
+    Adapters are reference counted and closed when the last holder releases them.
+    """
+
+    def __init__(self, factory: Optional[AdapterFactory] = None, max_concurrency: Optional[int] = None, batch_window_ms: Optional[float] = None, cache_size: Optional[int] = None,
+                 priority_scheduling: Optional[bool] = None):
+        self.factory = factory or _local_adapter_factory
+        self.max_concurrency = max_concurrency or MODEL_MAX_CONCURRENCY
+        self.batch_window_ms = batch_window_ms if batch_window_ms is not None else MODEL_BATCH_WINDOW_MS
+        self.cache_size = cache_size if cache_size is not None else LLM_CACHE_SIZE
+        self.priority_scheduling = priority_scheduling if priority_scheduling is not None else MODEL_PRIORITY_SCHEDULING
+        self._entries: Dict[Tuple[str, Optional[str]], _RegistryEntry] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(model_name: str, model_path: Optional[str]) -> Tuple[str, Optional[str]]:
+        return (model_name, os.path.abspath(model_path) if model_path else None)
+
+    def acquire(self, model_name: str = DEFAULT_MODEL_NAME, model_path: Optional[str] = None) -> ModelAdapter:
+        """
+        Returns the shared adapter for the model, loading it on first use.
+        """
+        key = self._key(model_name, model_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                # Loading happens under the lock so concurrent callers never load the weights twice
+                logger.info(f"Loading model {model_name} (max_concurrency={self.max_concurrency})")
+                entry = _RegistryEntry(self._build(model_name, model_path))
+                self._entries[key] = entry
+            entry.refcount += 1
+            return entry.adapter
+
+    def _build(self, model_name: str, model_path: Optional[str]) -> ModelAdapter:
+        adapter = self.factory(model_name, model_path, self.max_concurrency)
+        if self.batch_window_ms > 0:
+            # One scheduler per shared adapter, so prompts from every node land in the same batches
+            adapter = BatchingAdapter(adapter, window_ms=self.batch_window_ms)
+        if self.priority_scheduling:
+            # Outside the batcher, so the most urgent waiting prompts are the ones that fill the next batch
+            slots = self.max_concurrency * (MODEL_MAX_BATCH_SIZE if self.batch_window_ms > 0 else 1)
+            adapter = PrioritySchedulingAdapter(adapter, slots=slots)
+        if self.cache_size > 0:
+            # Outermost, so cache hits skip batching windows and accounting entirely
+            redis_store = None
+            if LLM_CACHE_REDIS:
+                from langgraph.memory.redis_store import RedisStore
+                redis_store = RedisStore(host=os.getenv("REDIS_HOST", "localhost"), port=int(os.getenv("REDIS_PORT", "6379")))
+            adapter = CachingAdapter(adapter, ResponseCache(max_entries=self.cache_size, redis_store=redis_store))
+        return adapter
+
+    def release(self, model_name: str = DEFAULT_MODEL_NAME, model_path: Optional[str] = None):
+        """
+        Drops one reference. The adapter is closed once nobody holds it anymore.
+        """
+        key = self._key(model_name, model_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                raise ValueError(f"Model {model_name} is not held by the registry")
+            entry.refcount -= 1
+            if entry.refcount > 0:
+                return
+            del self._entries[key]
+
+        logger.info(f"Unloading model {model_name}")
+        close = getattr(entry.adapter, "close", None)
+        if close:
+            close()
+
+    def refcount(self, model_name: str = DEFAULT_MODEL_NAME, model_path: Optional[str] = None) -> int:
+        entry = self._entries.get(self._key(model_name, model_path))
+        return entry.refcount if entry else 0
+
+
+# Shared by every node in the process
+model_registry = ModelRegistry()
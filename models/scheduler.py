@@ -0,0 +1,121 @@
+from models.adapter import AdapterWrapper, ModelAdapter
+from infra.observability import INFERENCE_QUEUE_DEPTH, INFERENCE_QUEUE_WAIT_SECONDS
+from typing import Dict, Any, Callable, List, Optional
+import asyncio
+import contextvars
+import itertools
+import os
+import threading
+import time
+
+# Set to 0 to fall back to arrival order for inference slots
+MODEL_PRIORITY_SCHEDULING = os.getenv("MODEL_PRIORITY_SCHEDULING", "1") == "1"
+# A waiting request is promoted one priority level per this many seconds, so LOW work never starves
+MODEL_PRIORITY_AGING_SECONDS = float(os.getenv("MODEL_PRIORITY_AGING_SECONDS", "30"))
+
+# Lower rank is served first
+PRIORITY_RANKS = {"CRITICAL": 0, "HIGH": 1, "MEDIUM": 2, "LOW": 3}
+DEFAULT_PRIORITY = "MEDIUM"
+
+# Priority of the graph run making the current call. Set once per alert; nodes and the
+# inference executor inherit it through the copied context.
+request_priority: contextvars.ContextVar[str] = contextvars.ContextVar("request_priority", default=DEFAULT_PRIORITY)
+
+def set_request_priority(severity: str) -> contextvars.Token:
+    return request_priority.set(severity if severity in PRIORITY_RANKS else DEFAULT_PRIORITY)
+
+class _Waiter:
+    __slots__ = ("priority", "rank", "enqueued_at", "seq", "loop", "future")
+
+    def __init__(self, priority: str, seq: int, loop: asyncio.AbstractEventLoop):
+        self.priority = priority
+        self.rank = PRIORITY_RANKS[priority]
+        self.enqueued_at = time.monotonic()
+        self.seq = seq
+        self.loop = loop
+        self.future = loop.create_future()
+
+class PriorityGate:
+    """
+    Inference slots handed out by priority instead of arrival order.
+    The effective rank of a waiter is its severity rank minus one level per `aging` seconds
+    waited; ties go to the earliest arrival. Safe to release from any thread or loop.
+    """
+    def __init__(self, slots: int, aging: float = MODEL_PRIORITY_AGING_SECONDS):
+        self.slots = slots
+        self.aging = aging
+        self._in_use = 0
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def depth(self, priority: Optional[str] = None) -> int:
+        return sum(1 for w in self._waiters if priority is None or w.priority == priority)
+
+    def _effective_rank(self, waiter: _Waiter, now: float) -> float:
+        if self.aging <= 0:
+            return waiter.rank
+        return waiter.rank - (now - waiter.enqueued_at) / self.aging
+
+    async def acquire(self, priority: str = DEFAULT_PRIORITY):
+        started = time.monotonic()
+        with self._lock:
+            if self._in_use < self.slots and not self._waiters:
+                self._in_use += 1
+                INFERENCE_QUEUE_WAIT_SECONDS.labels(priority=priority).observe(0.0)
+                return
+            waiter = _Waiter(priority, next(self._seq), asyncio.get_running_loop())
+            self._waiters.append(waiter)
+            INFERENCE_QUEUE_DEPTH.labels(priority=priority).inc()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    INFERENCE_QUEUE_DEPTH.labels(priority=priority).dec()
+                    raise
+            # The slot was granted as we were cancelled; hand it on
+            self.release()
+            raise
+        INFERENCE_QUEUE_WAIT_SECONDS.labels(priority=priority).observe(time.monotonic() - started)
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self._in_use -= 1
+                return
+            # The slot passes straight to the most urgent waiter
+            now = time.monotonic()
+            waiter = min(self._waiters, key=lambda w: (self._effective_rank(w, now), w.seq))
+            self._waiters.remove(waiter)
+            INFERENCE_QUEUE_DEPTH.labels(priority=waiter.priority).dec()
+        waiter.loop.call_soon_threadsafe(_grant, waiter.future)
+
+def _grant(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+class PrioritySchedulingAdapter(AdapterWrapper):
+    """
+    Admits async generations to the wrapped adapter through a PriorityGate, using the
+    caller's request_priority. Synchronous calls bypass the scheduler.
+    """
+    def __init__(self, adapter: ModelAdapter, slots: int, aging: float = MODEL_PRIORITY_AGING_SECONDS):
+        super().__init__(adapter)
+        self.gate = PriorityGate(slots, aging=aging)
+
+    async def apredict(self, prompt: str, max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
+        await self.gate.acquire(request_priority.get())
+        try:
+            return await self.adapter.apredict(prompt, max_tokens=max_tokens, temp=temp)
+        finally:
+            self.gate.release()
+
+    async def apredict_stream(self, prompt: str, on_token: Callable[[str], None], max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
+        await self.gate.acquire(request_priority.get())
+        try:
+            return await self.adapter.apredict_stream(prompt, on_token, max_tokens=max_tokens, temp=temp)
+        finally:
+            self.gate.release()
@@ -1,11 +1,10 @@
 from models.adapter import ModelAdapter
 from typing import Dict, Any
 from middleware.accounting import TokenAccountant
-from infra.db import SessionLocal
 
 class StubAdapter(ModelAdapter):
     def __init__(self):
-        self.accountant = TokenAccountant(SessionLocal())
+        self.accountant = TokenAccountant()
 
     def predict(self, prompt: str, max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
         # Deterministic stub
@@ -18,3 +17,7 @@ class StubAdapter(ModelAdapter):
         
         self.accountant.check_and_log("stub_agent", result)
         return result
+
+    async def apredict(self, prompt: str, max_tokens: int = 200, temp: float = 0.7) -> Dict[str, Any]:
+        # Nothing CPU-bound to offload, so answer inline
+        return self.predict(prompt, max_tokens=max_tokens, temp=temp)
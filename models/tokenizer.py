@@ -0,0 +1,53 @@
+from infra.cache import LRUCache
+from infra.lazy import Lazy
+from typing import Optional
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# tokenizer.json matching the served model (Hugging Face `tokenizers` format).
+# Unset, token counts fall back to a character-based estimate.
+MODEL_TOKENIZER_PATH = os.getenv("MODEL_TOKENIZER_PATH")
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "4096"))
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text, rounded up so budgets err on the safe side
+    return (len(text) + 3) // 4
+
+class TokenCounter:
+    """
+    Counts tokens with the model's tokenizer, caching counts by text.
+    The tokenizer is loaded on first use; if it is missing or fails to load, counts are estimated.
+    """
+    def __init__(self, tokenizer_path: Optional[str] = MODEL_TOKENIZER_PATH, cache_size: int = TOKEN_COUNT_CACHE_SIZE):
+        self.tokenizer_path = tokenizer_path
+        self.cache = LRUCache(max_entries=cache_size)
+        self._tokenizer = Lazy(self._load, name="tokenizer")
+
+    def _load(self):
+        if not self.tokenizer_path:
+            return None
+        try:
+            from tokenizers import Tokenizer
+            return Tokenizer.from_file(self.tokenizer_path)
+        except Exception as e:
+            logger.warning(f"Could not load tokenizer {self.tokenizer_path}, estimating token counts: {e}")
+            return None
+
+    @property
+    def exact(self) -> bool:
+        return self._tokenizer.get() is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        count = self.cache.get(text)
+        if count is None:
+            tokenizer = self._tokenizer.get()
+            if tokenizer is None:
+                count = estimate_tokens(text)
+            else:
+                count = len(tokenizer.encode(text, add_special_tokens=False).ids)
+            self.cache.set(text, count)
+        return count
@@ -0,0 +1,381 @@
+import pytest
+from api.schemas import Alert
+from api.dedup import AlertDeduplicator, alert_fingerprint
+from api.dependencies import RATE_LIMIT_SCRIPT
+from infra.coalescing import CoalescedRuns, ATTACH_SCRIPT, CLOSE_SCRIPT
+from infra.queue import AlertQueue, QueueFull
+from langgraph.memory.redis_store import RedisStore
+
+
+class MockRedis:
+    def __init__(self):
+        self.data = {}
+        self.lists = {}
+        self.sets = {}
+        self.expired = []
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def rpush(self, key, value):
+        self.lists.setdefault(key, []).append(value)
+
+    def expire(self, key, ttl):
+        self.expired.append(key)
+        return True
+
+    def lrange(self, key, start, end):
+        return list(self.lists.get(key, []))
+
+    def delete(self, key):
+        self.data.pop(key, None)
+        self.lists.pop(key, None)
+        self.sets.pop(key, None)
+
+    def exists(self, key):
+        return int(key in self.data or key in self.lists or key in self.sets)
+
+    def sadd(self, key, *values):
+        self.sets.setdefault(key, set()).update(values)
+
+    def smembers(self, key):
+        return set(self.sets.get(key, set()))
+
+    def incrby(self, key, amount):
+        self.data[key] = self.data.get(key, 0) + amount
+        return self.data[key]
+
+    def register_script(self, script):
+        return MockScript(self, script)
+
+    def xlen(self, stream):
+        return len(self.lists.get(stream, []))
+
+    def xadd(self, stream, fields, **kwargs):
+        self.rpush(stream, fields)
+
+    def pipeline(self, transaction=True):
+        return MockPipeline(self)
+
+    def ping(self):
+        return True
+
+    def xgroup_create(self, stream, group, id="0", mkstream=False):
+        return True
+
+
+class MockScript:
+    """Python stand-ins for the Lua scripts, run against the client (or pipeline) they are called with."""
+    def __init__(self, registered, script):
+        self.registered_client = registered
+        self.run = {RATE_LIMIT_SCRIPT: self.charge, ATTACH_SCRIPT: self.attach, CLOSE_SCRIPT: self.close}[script]
+
+    def __call__(self, keys, args, client=None):
+        client = client or self.registered_client
+        if isinstance(client, MockPipeline):
+            client.calls.append((self.run, (client.client, keys, args), {}))
+            return None
+        return self.run(client, keys, args)
+
+    @staticmethod
+    def charge(redis, keys, args):
+        weight, limit = int(args[0]), int(args[1])
+        if redis.data.get(keys[0], 0) + weight > limit:
+            return 0
+        redis.incrby(keys[0], weight)
+        return 1
+
+    @staticmethod
+    def attach(redis, keys, args):
+        if not redis.exists(keys[0]):
+            return 0
+        redis.rpush(keys[1], args[0])
+        return 1
+
+    @staticmethod
+    def close(redis, keys, args):
+        for key in redis.smembers(keys[0]):
+            if redis.get(key) == args[0]:
+                redis.delete(key)
+        redis.delete(keys[0])
+        attached = redis.lrange(keys[1], 0, -1)
+        redis.delete(keys[1])
+        return attached
+
+
+class MockPipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((getattr(self.client, name), args, kwargs))
+        return queue
+
+    def execute(self):
+        return [method(*args, **kwargs) for method, args, kwargs in self.calls]
+
+
+@pytest.fixture
+def redis_store():
+    store = RedisStore()
+    store.client = MockRedis()
+    return store
+
+
+def make_alert(alert_id, summary, raw_hash="a"):
+    return Alert(
+        alert_id=alert_id,
+        source="siem",
+        severity="HIGH",
+        summary=summary,
+        raw_payload_hash="sha256:" + raw_hash * 64,
+    )
+
+
+def test_fingerprint_ignores_volatile_numbers_and_case():
+    a = make_alert("1", "Failed password for root from 10.0.0.1 port 5522 at 12:30:01")
+    b = make_alert("2", "failed password for ROOT from 10.0.0.1 port 6001 at 12:31:45")
+    c = make_alert("3", "Failed password for admin from 10.0.0.1 port 5522 at 12:30:01")
+    assert alert_fingerprint(a) == alert_fingerprint(b)
+    assert alert_fingerprint(a) != alert_fingerprint(c)
+
+
+def test_fingerprint_keeps_hosts_and_addresses_apart():
+    def fingerprint(summary):
+        return alert_fingerprint(make_alert("x", summary))
+    assert fingerprint("Brute force from 10.0.0.1") != fingerprint("Brute force from 10.0.0.2")
+    assert fingerprint("Beaconing from 2001:db8::1") != fingerprint("Beaconing from 2001:db8::2")
+    assert fingerprint("Malware on web01") != fingerprint("Malware on web02")
+
+
+def test_deduplicator_attaches_storm_to_first_run(redis_store):
+    dedup = AlertDeduplicator(redis_store, window=60)
+
+    assert dedup.claim(make_alert("ssh-1", "Brute force from 10.0.0.1, 40 attempts", raw_hash="a")) is None
+    assert dedup.claim(make_alert("ssh-2", "Brute force from 10.0.0.1, 55 attempts", raw_hash="b")) == "ssh-1"
+    # Byte-identical replay
+    assert dedup.claim(make_alert("ssh-3", "Brute force from 10.0.0.1, 40 attempts", raw_hash="a")) == "ssh-1"
+
+    # Different alert starts its own run
+    assert dedup.claim(make_alert("phish-1", "Phishing email reported", raw_hash="c")) is None
+
+
+def test_completed_run_reports_repeats_and_reopens_window(redis_store):
+    dedup = AlertDeduplicator(redis_store, window=60)
+    runs = CoalescedRuns(redis_store)
+
+    assert dedup.claim(make_alert("ssh-1", "Brute force from 10.0.0.1", raw_hash="a")) is None
+    assert dedup.claim(make_alert("ssh-2", "Brute force from 10.0.0.1", raw_hash="b")) == "ssh-1"
+    assert runs.close("ssh-1") == ["ssh-2"]
+
+    # After the run finished, neither a near-identical alert nor a replay is dropped as a duplicate
+    assert dedup.claim(make_alert("ssh-3", "Brute force from 10.0.0.1", raw_hash="b")) is None
+    assert dedup.claim(make_alert("ssh-4", "Brute force from 10.0.0.1", raw_hash="a")) == "ssh-3"
+    assert runs.close("ssh-3") == ["ssh-4"]
+
+
+def test_repeat_is_not_attached_to_a_closed_run(redis_store):
+    dedup = AlertDeduplicator(redis_store, window=60)
+    runs = CoalescedRuns(redis_store)
+    assert dedup.claim(make_alert("ssh-1", "Brute force", raw_hash="a")) is None
+    # The run completes between a repeat's lookup and its attach
+    assert runs.attach([("ssh-1", "ssh-2")], ttl=60) == [True]
+    runs.close("ssh-1")
+    assert runs.attach([("ssh-1", "ssh-3")], ttl=60) == [False]
+
+
+def test_deduplicator_disabled_with_zero_window(redis_store):
+    dedup = AlertDeduplicator(redis_store, window=0)
+    assert dedup.claim(make_alert("ssh-1", "Brute force")) is None
+    assert dedup.claim(make_alert("ssh-2", "Brute force")) is None
+
+
+def test_alert_queue_reports_position_and_backpressure(redis_store):
+    queue = AlertQueue(redis_store, stream="alerts:test", max_depth=2)
+
+    assert queue.enqueue(make_alert("a-1", "First")) == 1
+    assert queue.enqueue(make_alert("a-2", "Second")) == 2
+    with pytest.raises(QueueFull):
+        queue.enqueue(make_alert("a-3", "Third"))
+
+    # Entries round-trip through the stream payload
+    assert Alert.model_validate_json(redis_store.client.lists["alerts:test"][0]["alert"]).alert_id == "a-1"
+
+
+def test_release_frees_the_dedup_window(redis_store):
+    dedup = AlertDeduplicator(redis_store, window=60)
+    alert = make_alert("ssh-1", "Brute force")
+    assert dedup.claim(alert) is None
+    dedup.release(alert)
+    assert dedup.claim(make_alert("ssh-2", "Brute force", raw_hash="b")) is None
+
+
+@pytest.fixture
+def api_client():
+    from fastapi.testclient import TestClient
+    from api.dependencies import redis_store as api_redis_store
+    from api.main import app
+
+    original = api_redis_store.client
+    api_redis_store.client = MockRedis()
+    yield TestClient(app), api_redis_store.client
+    api_redis_store.client = original
+
+
+def test_batch_ingest_reports_each_item(api_client):
+    client, mock_redis = api_client
+    lines = [
+        '{"alert_id": "b-1", "source": "siem", "severity": "HIGH", "summary": "SSH brute force from 10.0.0.1 port 5522"}',
+        '{"alert_id": "b-2", "source": "siem", "severity": "HIGH", "summary": "SSH brute force from 10.0.0.1 port 6001"}',
+        '{"alert_id": "b-3", "source": "siem", "severity": "BOGUS", "summary": "Bad severity"}',
+        '{not json',
+        '{"alert_id": "b-4", "source": "edr", "severity": "LOW", "summary": "<b>Phishing</b> link clicked"}',
+    ]
+    response = client.post("/ingest/batch", content="\n".join(lines), headers={"X-API-Key": "secret-key-123"})
+    assert response.status_code == 200
+
+    results = response.json()["results"]
+    assert [r["status"] for r in results] == ["accepted", "duplicate", "rejected", "rejected", "accepted"]
+    assert results[1]["attached_to"] == "b-1"
+    assert results[4]["queue_position"] == 2
+    assert response.json()["summary"] == {"accepted": 2, "duplicate": 1, "rejected": 2}
+
+    # Charged once against the batch quota, weighted by batch size; the request limit is untouched
+    assert mock_redis.data["rate_limit:batch_items:secret-key-123"] == 5
+    assert "rate_limit:secret-key-123" not in mock_redis.data
+
+
+def test_batch_over_request_limit_is_accepted_and_rejections_cost_nothing(api_client, monkeypatch):
+    from api import dependencies
+    client, mock_redis = api_client
+    monkeypatch.setattr(dependencies, "RATE_LIMIT", 100)
+    lines = [f'{{"alert_id": "big-{i}", "source": "siem", "severity": "LOW", "summary": "Login {i}"}}' for i in range(150)]
+    response = client.post("/ingest/batch", content="\n".join(lines), headers={"X-API-Key": "secret-key-123"})
+    assert response.status_code == 200
+    assert response.json()["summary"]["accepted"] + response.json()["summary"]["duplicate"] == 150
+
+    # A batch that would overflow the quota is refused without being charged
+    mock_redis.data["rate_limit:batch_items:secret-key-123"] = 9990
+    response = client.post("/ingest/batch", content="\n".join(lines[:20]), headers={"X-API-Key": "secret-key-123"})
+    assert response.status_code == 429
+    assert mock_redis.data["rate_limit:batch_items:secret-key-123"] == 9990
+
+
+def test_single_ingest_dedups_and_releases_claim_when_queue_full(api_client, monkeypatch):
+    from api import main
+    client, _ = api_client
+    headers = {"X-API-Key": "secret-key-123"}
+    alert = {"alert_id": "s-1", "source": "siem", "severity": "HIGH", "summary": "SSH brute force from 10.0.0.9"}
+    assert client.post("/ingest", json=alert, headers=headers).json()["status"] == "accepted"
+    response = client.post("/ingest", json={**alert, "alert_id": "s-2"}, headers=headers)
+    assert response.json()["attached_to"] == "s-1"
+
+    monkeypatch.setattr(main.alert_queue, "max_depth", 1)
+    other = {"alert_id": "s-3", "source": "siem", "severity": "HIGH", "summary": "Malware on web01"}
+    assert client.post("/ingest", json=other, headers=headers).status_code == 503
+    # The rejected alert did not keep the window, so its retry is not mistaken for a duplicate
+    monkeypatch.setattr(main.alert_queue, "max_depth", 10)
+    assert client.post("/ingest", json={**other, "alert_id": "s-4"}, headers=headers).json()["status"] == "accepted"
+
+
+def test_rate_limit_script_registered_once(api_client):
+    client, mock_redis = api_client
+    registered = []
+    register_script = mock_redis.register_script
+    mock_redis.register_script = lambda script: registered.append(script) or register_script(script)
+    payload = [{"alert_id": f"rl-{i}", "source": "siem", "severity": "LOW", "summary": f"Login {i}"} for i in range(2)]
+    for _ in range(3):
+        assert client.post("/ingest/batch", json=payload, headers={"X-API-Key": "secret-key-123"}).status_code == 200
+    from api.dependencies import RATE_LIMIT_SCRIPT
+    assert registered.count(RATE_LIMIT_SCRIPT) == 1
+    assert mock_redis.data["rate_limit:batch_items:secret-key-123"] == 6
+
+
+def test_batch_ingest_accepts_json_array(api_client):
+    client, _ = api_client
+    payload = [{"alert_id": "arr-1", "source": "siem", "severity": "LOW", "summary": "Login"}]
+    response = client.post("/ingest/batch", json=payload, headers={"X-API-Key": "secret-key-123"})
+    assert response.status_code == 200
+    assert response.json()["results"][0]["status"] == "accepted"
+
+
+def test_ready_probe_waits_for_startup_checks(api_client):
+    import time
+    from api.main import app
+    from fastapi.testclient import TestClient
+    from infra.warmup import readiness
+
+    readiness.steps.clear()
+    assert api_client[0].get("/ready").status_code == 503
+
+    # Entering the client runs the lifespan, which checks Redis in the background
+    with TestClient(app) as client:
+        assert client.get("/health").status_code == 200
+        for _ in range(50):
+            response = client.get("/ready")
+            if response.status_code == 200:
+                break
+            time.sleep(0.01)
+        assert response.status_code == 200
+        assert response.json()["steps"] == {"redis": "ready"}
+
+
+def test_alert_events_coalesce_tokens_and_keep_order(redis_store):
+    import json
+    from infra.events import AlertEventStream, DONE_EVENT
+    # A long interval keeps the background flusher out of the way
+    events = AlertEventStream(redis_store, flush_ms=60_000)
+    on_token = events.token_publisher("a-1", "analyze")
+    for token in ["Brute", " force", " detected"]:
+        on_token(token)
+    assert "alert_events:a-1" not in redis_store.client.lists
+
+    # Buffered tokens go out as one chunk, ahead of the event that follows them
+    events.publish("a-1", "node_end", {"node": "analyze"})
+    stream = redis_store.client.lists["alert_events:a-1"]
+    assert [(e["event"], json.loads(e["data"])) for e in stream] == [
+        ("token", {"node": "analyze", "text": "Brute force detected"}), ("node_end", {"node": "analyze"})]
+
+    on_token(" again")
+    events.flush()
+    events.publish("a-1", DONE_EVENT, {"status": "completed"})
+    assert [e["event"] for e in stream] == ["token", "node_end", "token", DONE_EVENT]
+    # The TTL is set once per stream, and finished runs release their buffers
+    assert redis_store.client.expired == ["alert_events:a-1"]
+    assert events._buffers == {}
+
+
+
+def test_alert_events_publish_off_the_event_loop(redis_store):
+    import asyncio
+    import threading
+    from infra.events import AlertEventStream
+    events = AlertEventStream(redis_store, flush_ms=60_000)
+    writers = []
+    xadd = redis_store.client.xadd
+    redis_store.client.xadd = lambda *args, **kwargs: writers.append(threading.current_thread()) or xadd(*args, **kwargs)
+
+    asyncio.run(events.apublish("a-1", "node_start", {"node": "retrieve"}))
+    assert writers and writers[0] is not threading.main_thread()
+    assert redis_store.client.lists["alert_events:a-1"][0]["event"] == "node_start"
+
+
+def test_subscribe_client_keeps_credentials_and_tls():
+    import redis
+    import redis.asyncio as aioredis
+    from infra.events import async_client_for
+    client = redis.Redis(host="redis.internal", port=6380, db=2, username="soc", password="secret",
+                         ssl=True, ssl_ca_certs="/etc/ssl/ca.pem", decode_responses=True)
+    pool = async_client_for(client).connection_pool
+    assert pool.connection_class is aioredis.SSLConnection
+    assert {key: pool.connection_kwargs[key] for key in ("host", "port", "db", "username", "password", "ssl_ca_certs", "decode_responses")} == {
+        "host": "redis.internal", "port": 6380, "db": 2, "username": "soc", "password": "secret",
+        "ssl_ca_certs": "/etc/ssl/ca.pem", "decode_responses": True}
@@ -0,0 +1,579 @@
+import asyncio
+import threading
+import pytest
+from models.adapter import ModelAdapter
+from models.registry import ModelRegistry
+
+
+class FakeAdapter:
+    def __init__(self, model_name, model_path, max_concurrency):
+        self.model_name = model_name
+        self.max_concurrency = max_concurrency
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_registry_shares_one_adapter_per_model():
+    loads = []
+
+    def factory(name, path, max_concurrency):
+        loads.append(name)
+        return FakeAdapter(name, path, max_concurrency)
+
+    registry = ModelRegistry(factory=factory, max_concurrency=2)
+    a = registry.acquire("model-a.gguf")
+    b = registry.acquire("model-a.gguf")
+    c = registry.acquire("model-b.gguf")
+
+    assert a is b
+    assert a is not c
+    assert loads == ["model-a.gguf", "model-b.gguf"]
+    assert a.max_concurrency == 2
+    assert registry.refcount("model-a.gguf") == 2
+
+
+def test_registry_closes_adapter_on_last_release():
+    registry = ModelRegistry(factory=FakeAdapter)
+    adapter = registry.acquire("model-a.gguf")
+    registry.acquire("model-a.gguf")
+
+    registry.release("model-a.gguf")
+    assert not adapter.closed
+
+    registry.release("model-a.gguf")
+    assert adapter.closed
+    assert registry.refcount("model-a.gguf") == 0
+
+    # A new acquire loads a fresh instance
+    assert registry.acquire("model-a.gguf") is not adapter
+
+    with pytest.raises(ValueError):
+        registry.release("never-loaded.gguf")
+
+
+def test_apredict_runs_on_inference_executor():
+    class ThreadRecordingAdapter(ModelAdapter):
+        def predict(self, prompt, max_tokens=200, temp=0.7):
+            return {"text": threading.current_thread().name, "prompt_tokens": 0,
+                    "completion_tokens": 0, "model_version": "test"}
+
+    result = asyncio.run(ThreadRecordingAdapter().apredict("hello"))
+    assert result["text"].startswith("inference")
+
+
+class EchoAdapter(ModelAdapter):
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, prompt, max_tokens=200, temp=0.7):
+        return {"text": prompt.upper(), "prompt_tokens": len(prompt), "completion_tokens": len(prompt),
+                "model_version": "echo"}
+
+    def predict_batch(self, prompts, max_tokens=200, temp=0.7, **kwargs):
+        self.batches.append(list(prompts))
+        return super().predict_batch(prompts, max_tokens=max_tokens, temp=temp, **kwargs)
+
+
+def test_batching_adapter_gathers_concurrent_prompts():
+    from models.batching import BatchingAdapter
+
+    inner = EchoAdapter()
+    adapter = BatchingAdapter(inner, window_ms=20, max_batch_size=3)
+
+    async def run():
+        return await asyncio.gather(*[adapter.apredict(p) for p in ["a", "bb", "ccc", "dddd"]])
+
+    results = asyncio.run(run())
+
+    # Results go back to their own caller, in order, with per-request metadata
+    assert [r["text"] for r in results] == ["A", "BB", "CCC", "DDDD"]
+    assert [r["prompt_tokens"] for r in results] == [1, 2, 3, 4]
+    # The first three fill a batch immediately, the fourth is flushed by the window timer
+    assert inner.batches == [["a", "bb", "ccc"], ["dddd"]]
+    assert results[0]["batch_size"] == 3
+    # Attributes not defined on the wrapper come from the wrapped adapter
+    assert adapter.batches is inner.batches
+
+
+def test_batching_adapter_batches_streaming_requests():
+    from models.batching import BatchingAdapter
+
+    inner = EchoAdapter()
+    adapter = BatchingAdapter(inner, window_ms=20, max_batch_size=4)
+    tokens = []
+
+    async def run():
+        return await asyncio.gather(adapter.apredict_stream("stream me", tokens.append), adapter.apredict("plain"))
+
+    streamed, plain = asyncio.run(run())
+    assert inner.batches == [["stream me", "plain"]]
+    assert tokens == ["STREAM ME"]
+    assert (streamed["text"], plain["text"]) == ("STREAM ME", "PLAIN")
+
+
+class CountingAdapter(EchoAdapter):
+    def __init__(self):
+        super().__init__()
+        self.model_name = "echo-v1"
+        self.calls = 0
+
+    def predict(self, prompt, max_tokens=200, temp=0.7):
+        self.calls += 1
+        return super().predict(prompt, max_tokens=max_tokens, temp=temp)
+
+
+def test_caching_adapter_serves_repeats_without_calling_model():
+    from models.cache import CachingAdapter, ResponseCache
+
+    inner = CountingAdapter()
+    adapter = CachingAdapter(inner, ResponseCache(max_entries=2, ttl=60))
+
+    first = adapter.predict("guardrail plan", max_tokens=100, temp=0.0)
+    second = adapter.predict("guardrail plan", max_tokens=100, temp=0.0)
+    assert inner.calls == 1
+    assert second["text"] == first["text"]
+    assert second["cached"] is True
+
+    # Generation parameters are part of the key
+    adapter.predict("guardrail plan", max_tokens=50, temp=0.0)
+    assert inner.calls == 2
+
+    # Batches only send the misses to the model
+    results = adapter.predict_batch(["guardrail plan", "new"], max_tokens=100, temp=0.0)
+    assert [r["text"] for r in results] == ["GUARDRAIL PLAN", "NEW"]
+    assert inner.batches == [["new"]]
+
+
+def test_response_cache_falls_back_to_redis_tier():
+    from models.cache import ResponseCache
+
+    class DictStore:
+        def __init__(self):
+            self.data = {}
+
+        def set_value(self, key, data, ttl=None):
+            self.data[key] = data
+
+        def get_value(self, key):
+            return self.data.get(key)
+
+    shared = DictStore()
+    writer = ResponseCache(max_entries=4, ttl=60, redis_store=shared)
+    reader = ResponseCache(max_entries=4, ttl=60, redis_store=shared)
+
+    key = ResponseCache.make_key("m", "p", 10, 0.0)
+    writer.set(key, {"text": "x"})
+    assert reader.get(key) == {"text": "x"}
+    # Promoted into the reader's in-process tier
+    assert reader.memory.get(key) == {"text": "x"}
+
+
+def test_caching_adapter_async_calls_keep_redis_off_the_event_loop():
+    import threading
+    from models.cache import CachingAdapter, ResponseCache
+
+    class ThreadRecordingStore:
+        def __init__(self):
+            self.data, self.threads = {}, []
+
+        def set_value(self, key, data, ttl=None):
+            self.threads.append(threading.get_ident())
+            self.data[key] = data
+
+        def get_value(self, key):
+            self.threads.append(threading.get_ident())
+            return self.data.get(key)
+
+    shared = ThreadRecordingStore()
+    adapter = CachingAdapter(CountingAdapter(), ResponseCache(max_entries=4, ttl=60, redis_store=shared))
+
+    async def run():
+        await adapter.apredict("hello")
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert len(shared.threads) == 2 and loop_thread not in shared.threads
+    assert list(shared.data.values())[0]["text"] == "HELLO"
+
+
+def test_streaming_falls_back_to_single_chunk_and_is_cached():
+    from models.cache import CachingAdapter, ResponseCache
+
+    inner = CountingAdapter()
+    adapter = CachingAdapter(inner, ResponseCache(max_entries=4, ttl=60))
+
+    tokens = []
+    result = asyncio.run(adapter.apredict_stream("plan", tokens.append))
+    assert tokens == ["PLAN"]
+    assert result["text"] == "PLAN"
+
+    # A repeat is streamed from the cache without touching the model
+    tokens.clear()
+    adapter.predict_stream("plan", tokens.append)
+    assert tokens == ["PLAN"]
+    assert inner.calls == 1
+
+
+def test_lazy_provider_builds_once_on_first_use():
+    from infra.lazy import Lazy
+    calls = []
+    resource = Lazy(lambda: calls.append(1) or {"ready": True}, name="resource")
+    assert not resource.loaded and calls == []
+    assert resource.get() == {"ready": True}
+    assert resource.get() is resource.get()
+    assert resource.loaded and calls == [1]
+    # Attribute access is forwarded to the built resource
+    assert resource.keys() == {"ready": True}.keys()
+
+
+def test_priority_gate_serves_critical_before_queued_low():
+    from models.scheduler import PrioritySchedulingAdapter, request_priority
+
+    order = []
+
+    class RecordingAdapter(EchoAdapter):
+        async def apredict(self, prompt, max_tokens=200, temp=0.7):
+            order.append(prompt)
+            await asyncio.sleep(0.01)
+            return self.predict(prompt)
+
+    adapter = PrioritySchedulingAdapter(RecordingAdapter(), slots=1, aging=0)
+
+    async def call(prompt, priority, delay):
+        await asyncio.sleep(delay)
+        request_priority.set(priority)
+        return await adapter.apredict(prompt)
+
+    async def run():
+        # The first LOW call takes the slot; the rest queue while it runs
+        return await asyncio.gather(call("low-1", "LOW", 0), call("low-2", "LOW", 0.001),
+                                    call("high", "HIGH", 0.002), call("critical", "CRITICAL", 0.003))
+
+    results = asyncio.run(run())
+    assert order == ["low-1", "critical", "high", "low-2"]
+    assert [r["text"] for r in results] == ["LOW-1", "LOW-2", "HIGH", "CRITICAL"]
+    assert adapter.gate.depth() == 0
+
+
+def test_priority_gate_ages_long_waiting_requests():
+    import time
+    from models.scheduler import PriorityGate, _Waiter
+
+    gate = PriorityGate(slots=1, aging=10)
+    loop = asyncio.new_event_loop()
+    try:
+        old_low = _Waiter("LOW", 0, loop)
+        old_low.enqueued_at = time.monotonic() - 35
+        fresh_critical = _Waiter("CRITICAL", 1, loop)
+        now = time.monotonic()
+        # Three and a half levels of aging put the LOW request ahead of a fresh CRITICAL one
+        assert gate._effective_rank(old_low, now) < gate._effective_rank(fresh_critical, now)
+    finally:
+        loop.close()
+
+
+def test_usage_writer_buffers_rows_and_flushes_in_bulk():
+    from sqlalchemy import create_engine, select, func
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from middleware.accounting import TokenAccountant, TokenUsage, UsageWriter
+    from finops.budget import BudgetPolicy
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    TokenUsage.__table__.create(engine)
+    sessions = sessionmaker(bind=engine)
+    broken = {"down": True}
+
+    def session_factory():
+        if broken["down"]:
+            raise ConnectionError("database unavailable")
+        return sessions()
+
+    writer = UsageWriter(session_factory, flush_size=1000, flush_interval=60)
+    accountant = TokenAccountant(writer, budget=BudgetPolicy())
+    for _ in range(3):
+        accountant.check_and_log("planner", {"prompt_tokens": 10, "completion_tokens": 5, "model_version": "echo"})
+
+    # The budget is charged immediately, the rows wait in the buffer
+    assert accountant.budget_policy.current_spend > 0
+    assert writer.backlog == 3
+
+    # A failed flush keeps its rows for the next attempt
+    assert writer.flush() == 0
+    assert writer.backlog == 3
+
+    broken["down"] = False
+    writer.close()
+    assert writer.backlog == 0
+    with sessions() as db:
+        assert db.scalar(select(func.count()).select_from(TokenUsage)) == 3
+        assert db.scalar(select(func.sum(TokenUsage.total_tokens))) == 45
+
+
+class LedgerRedis:
+    """
+    Stands in for Redis, running the reserve script's logic in Python.
+    """
+    def __init__(self):
+        self.data = {}
+        self.reserve_calls = 0
+
+    def register_script(self, script):
+        def reserve(keys, args):
+            self.reserve_calls += 1
+            amount, limit = int(args[0]), int(args[1])
+            spent = self.data.get(keys[0], 0)
+            if spent + amount > limit:
+                return [0, spent]
+            self.data[keys[0]] = spent + amount
+            return [1, self.data[keys[0]]]
+        return reserve
+
+    def decrby(self, key, amount):
+        self.data[key] -= amount
+
+
+def test_budget_ledger_enforces_limit_across_processes_with_leases():
+    from finops.budget import BudgetPolicy, RedisBudgetLedger, MICRO_USD
+
+    redis = LedgerRedis()
+    workers = [BudgetPolicy(ledger=RedisBudgetLedger(redis), lease_usd=1.0) for _ in range(2)]
+    for policy in workers:
+        policy.hard_limit_daily = 3.0
+
+    # Ten 0.1 USD calls on one worker cost a single reservation
+    for _ in range(10):
+        assert workers[0].check_budget(0.1)["allowed"]
+        workers[0].record_spend(0.1)
+    assert redis.reserve_calls == 1
+
+    # The second worker leases what is left of the shared limit, then gets refused
+    assert workers[1].check_budget(1.0)["allowed"]
+    workers[1].record_spend(1.0)
+    assert workers[1].check_budget(0.5)["allowed"]
+    workers[1].record_spend(0.5)
+    assert not workers[1].check_budget(0.6)["allowed"]
+
+    # A call bigger than a lease is refused after a single reservation attempt
+    redis.reserve_calls = 0
+    assert not workers[0].check_budget(5.0)["allowed"]
+    assert redis.reserve_calls == 1
+
+    # Unused reservations go back to the shared counter on shutdown
+    workers[1].close()
+    assert sum(redis.data.values()) == int(2.5 * MICRO_USD)
+
+
+def test_budget_policy_falls_back_to_local_accounting_when_ledger_is_down():
+    from finops.budget import BudgetPolicy
+
+    class DownLedger:
+        def reserve(self, day, amount, limit):
+            raise ConnectionError("redis unavailable")
+
+    policy = BudgetPolicy(ledger=DownLedger(), lease_usd=1.0)
+    policy.hard_limit_daily = 1.0
+    assert policy.check_budget(0.6)["allowed"]
+    policy.record_spend(0.6)
+    assert not policy.check_budget(0.6)["allowed"]
+    assert policy.current_spend == pytest.approx(0.6)
+
+
+def test_streaming_anomaly_detector_matches_full_window_statistics():
+    import numpy as np
+    from finops.anomaly import AnomalyDetector
+
+    rng = np.random.default_rng(7)
+    values = rng.normal(500, 40, 400)
+    values[[120, 260, 390]] = [2000, 5, 1800]
+
+    streaming = AnomalyDetector(window_size=50)
+    flags = [streaming.is_anomaly(v) for v in values]
+
+    # Same decisions as recomputing mean/std over the window on every sample
+    expected = []
+    for i, v in enumerate(values):
+        window = values[max(0, i - 49):i + 1]
+        expected.append(len(window) >= 10 and window.std() > 0 and abs((v - window.mean()) / window.std()) > 3)
+    assert flags == expected
+    assert flags[120] and flags[260] and flags[390]
+    assert streaming.mean == pytest.approx(values[-50:].mean())
+    assert streaming.std == pytest.approx(values[-50:].std())
+
+    # The vectorized replay gives the same flags and leaves the same state
+    replayed = AnomalyDetector(window_size=50)
+    assert list(replayed.bulk_update(values[:300])) == expected[:300]
+    assert [replayed.is_anomaly(v) for v in values[300:]] == expected[300:]
+    assert replayed.std == pytest.approx(streaming.std)
+
+
+def test_anomaly_bank_keeps_one_series_per_agent_and_model():
+    from finops.anomaly import AnomalyDetectorBank
+
+    bank = AnomalyDetectorBank(window_size=20)
+    rows = [(("planner", "small"), 100 + i % 3) for i in range(30)] + [(("planner", "large"), 2000 + i % 5) for i in range(30)]
+    bank.bulk_update(rows)
+    assert set(bank.detectors) == {("planner", "small"), ("planner", "large")}
+
+    # A normal value for the large model is a spike for the small one
+    assert bank.is_anomaly(("planner", "small"), 2000)
+    assert not bank.is_anomaly(("planner", "large"), 2002)
+
+
+def test_token_counter_uses_tokenizer_file_and_caches_counts(tmp_path):
+    from tokenizers import Tokenizer
+    from tokenizers.models import WordLevel
+    from tokenizers.pre_tokenizers import Whitespace
+    from models.tokenizer import TokenCounter, estimate_tokens
+
+    tokenizer = Tokenizer(WordLevel({"[UNK]": 0, "block": 1, "ip": 2}, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = Whitespace()
+    path = tmp_path / "tokenizer.json"
+    tokenizer.save(str(path))
+
+    counter = TokenCounter(str(path))
+    assert counter.count("block the attacker ip now") == 5
+    assert counter.exact and len(counter.cache) == 1
+
+    # Without a tokenizer (or with a broken one) counts are estimated
+    assert TokenCounter(None).count("block the attacker ip now") == estimate_tokens("block the attacker ip now")
+    assert not TokenCounter(str(tmp_path / "missing.json")).exact
+
+
+def test_context_packer_keeps_best_ranked_chunks_and_trims_the_boundary():
+    from models.context_packer import ContextPacker
+
+    count_words = lambda text: len(text.split())
+    packer = ContextPacker(count_words, budget=30, min_chunk_tokens=3)
+    chunks = [" ".join([word] * 10) for word in ("one", "two", "three", "four")]
+
+    packed = packer.pack(["system prompt", "alert text here"], chunks)
+    # 25 tokens left: two chunks whole, the third trimmed to the remaining 5, the lowest-ranked dropped
+    assert packed == [chunks[0], chunks[1], "three three three three three"]
+
+    # A boundary chunk that would be trimmed below the minimum is dropped instead
+    assert packer.pack(["x " * 28], ["y " * 5]) == []
+    # Fixed parts over budget leave no room for context
+    assert packer.pack(["x " * 40], ["y"]) == []
+
+
+class FakeKVState:
+    """Mimics GPT4AllState: one token per word, n_past advancing as text is evaluated."""
+    def __init__(self):
+        self.n_past = 0
+        self.generated = 0
+        self.evaluated = []
+
+    def evaluate(self, text, reset, n_predict, temp, on_token=None, n_batch=None):
+        if reset:
+            self.n_past = 0
+        self.evaluated.append((text, self.n_past))
+        self.n_past += len(text.split())
+        self.generated = 1 if n_predict else 0
+        self.n_past += self.generated
+        if n_predict and on_token:
+            on_token("ok")
+        return "ok" if n_predict else ""
+
+    def save(self):
+        from models.prefix_cache import PrefixSnapshot
+        return PrefixSnapshot(None, self.n_past)
+
+    def restore(self, snapshot):
+        self.n_past = snapshot.n_past
+
+
+class WordCounter:
+    """Exact tokenizer stand-in matching FakeKVState: one token per word."""
+    exact = True
+    def count(self, text):
+        return len(text.split())
+
+class PlainModel:
+    def generate(self, prompt, max_tokens=200, temp=0.7):
+        return "plain"
+
+class NoAccounting:
+    def check_and_log(self, agent, metadata):
+        pass
+
+def prefix_adapter():
+    from models.local_adapter import LocalAdapter
+    adapter = LocalAdapter("fake.gguf")
+    adapter._model, adapter._kv_state, adapter.accountant = PlainModel(), FakeKVState(), NoAccounting()
+    adapter.token_counter = WordCounter()
+    return adapter
+
+def test_local_adapter_evaluates_registered_system_prompts_once():
+    from models.llm import LocalLLM
+
+    adapter = prefix_adapter()
+    analyst, planner = LocalLLM._system_prefix("You analyse alerts in depth"), LocalLLM._system_prefix("You plan")
+    adapter.register_prefix("analyst", analyst)
+    adapter.register_prefix("planner", planner)
+    state = adapter._kv_state
+
+    prompt = LocalLLM._format_prompt("You analyse alerts in depth", "alert one")
+    assert adapter.predict(prompt)["text"] == "ok"
+    assert state.evaluated == [(analyst, 0), (prompt[len(analyst):], 6)]
+
+    # Same system prompt again: rewound to the end of the prefix, only the user part is evaluated
+    state.evaluated.clear()
+    tokens = []
+    adapter.predict_stream(LocalLLM._format_prompt("You analyse alerts in depth", "alert two"), tokens.append)
+    assert tokens == ["ok"]
+    assert [n_past for _, n_past in state.evaluated] == [6]
+
+    # Switching prompts evaluates the new prefix once, switching back restores the snapshot
+    adapter.predict(LocalLLM._format_prompt("You plan", "steps"))
+    state.evaluated.clear()
+    adapter.predict(LocalLLM._format_prompt("You analyse alerts in depth", "alert three"))
+    assert [n_past for _, n_past in state.evaluated] == [6]
+
+    # Prompts without a registered prefix take the normal path
+    assert adapter.predict("no system prompt here")["text"] == "plain"
+    assert adapter.prefix_cache.resident is None
+
+def test_local_adapter_drops_resident_prefix_when_n_past_drifts():
+    from models.llm import LocalLLM
+    adapter = prefix_adapter()
+    adapter.register_prefix("analyst", LocalLLM._system_prefix("You analyse"))
+    state = adapter._kv_state
+    adapter.predict(LocalLLM._format_prompt("You analyse", "alert one"))
+    assert adapter.prefix_cache.resident == "analyst"
+
+    # The model shifted its context mid-generation: the prefix is gone from the front of the KV cache
+    evaluate = state.evaluate
+    def shifting_evaluate(*args, **kwargs):
+        output = evaluate(*args, **kwargs)
+        state.n_past //= 2
+        return output
+    state.evaluate = shifting_evaluate
+    adapter.predict(LocalLLM._format_prompt("You analyse", "alert two with a much longer body of text"))
+    assert adapter.prefix_cache.resident is None
+
+def test_local_adapter_reuses_prefixes_only_with_exact_token_counts():
+    from models.llm import LocalLLM
+    adapter = prefix_adapter()
+    adapter.token_counter.exact = False
+    adapter.register_prefix("analyst", LocalLLM._system_prefix("You analyse"))
+    assert adapter.predict(LocalLLM._format_prompt("You analyse", "alert"))["text"] == "plain"
+    assert adapter._kv_state.evaluated == []
+
+def test_local_adapter_falls_back_when_bindings_change():
+    from models.llm import LocalLLM
+    adapter = prefix_adapter()
+    adapter.register_prefix("analyst", LocalLLM._system_prefix("You analyse"))
+    def broken(*args, **kwargs):
+        raise AttributeError("LLModel has no attribute 'context'")
+    adapter._kv_state.evaluate = broken
+    assert adapter.predict(LocalLLM._format_prompt("You analyse", "alert"))["text"] == "plain"
+    assert adapter.prefix_cache is None
+
+def test_gpt4all_state_version_gate():
+    from models.prefix_cache import gpt4all_state_supported
+    assert gpt4all_state_supported("2.8.2")
+    assert not gpt4all_state_supported("3.4.0")
+    assert not gpt4all_state_supported("1.0.12")
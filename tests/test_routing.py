@@ -0,0 +1,76 @@
+import asyncio
+from api.schemas import Alert
+from langgraph.nodes.router import select_route, load_routing_rules, ROUTE_TEMPLATE, ROUTE_LLM
+from langgraph.nodes.template import template_remediation
+
+
+def make_state(severity="LOW", source="siem", context=None):
+    alert = Alert(alert_id="r-1", source=source, severity=severity, summary="Informational login event",
+                  raw_payload_hash="sha256:" + "a" * 64)
+    return {"alert": alert, "context": context or [], "route": None}
+
+
+def test_default_rules_send_low_alerts_to_template():
+    assert select_route(make_state("LOW"))["route"] == ROUTE_TEMPLATE
+    assert select_route(make_state("CRITICAL"))["route"] == ROUTE_LLM
+
+
+def test_rules_can_route_on_source_and_playbook_score(tmp_path):
+    rules_file = tmp_path / "routing.json"
+    rules_file.write_text("""[
+        {"name": "noisy-scanner", "source": ["VulnScanner"], "route": "template"},
+        {"name": "known-phish", "severity": ["MEDIUM"], "context_sources": ["playbook-phishing"], "min_context_score": 0.03, "route": "template"}
+    ]""")
+    rules = load_routing_rules(str(rules_file))
+
+    assert select_route(make_state("HIGH", source="vulnscanner"), rules)["rule"] == "noisy-scanner"
+    strong = [{"content": "...", "metadata": {"source": "playbook-phishing"}, "score": 0.033}]
+    weak = [{"content": "...", "metadata": {"source": "playbook-phishing"}, "score": 0.016}]
+    assert select_route(make_state("MEDIUM", context=strong), rules)["route"] == ROUTE_TEMPLATE
+    assert select_route(make_state("MEDIUM", context=weak), rules)["route"] == ROUTE_LLM
+    # LOW is no longer special once custom rules replace the defaults
+    assert select_route(make_state("LOW"), rules)["route"] == ROUTE_LLM
+
+
+def test_context_score_threshold_uses_the_fused_rrf_scale(tmp_path):
+    import pytest
+    rules_file = tmp_path / "routing.json"
+    # Written on a similarity scale, the rule could never match
+    rules_file.write_text('[{"name": "phish", "context_sources": ["playbook-phishing"], "min_context_score": 0.7, "route": "template"}]')
+    with pytest.raises(ValueError, match="highest fused retrieval score"):
+        load_routing_rules(str(rules_file))
+
+    # Without a threshold, a chunk must be a top hit of one retriever (1/60) or found by both
+    rules = [{"name": "phish", "context_sources": ["playbook-phishing"], "route": "template"}]
+    top = [{"content": "...", "metadata": {"source": "playbook-phishing"}, "score": 1 / 60}]
+    third = [{"content": "...", "metadata": {"source": "playbook-phishing"}, "score": 1 / 62}]
+    assert select_route(make_state("HIGH", context=top), rules)["route"] == ROUTE_TEMPLATE
+    assert select_route(make_state("HIGH", context=third), rules)["route"] == ROUTE_LLM
+
+
+def test_template_plan_is_policy_checked_without_guardrail(monkeypatch):
+    from langgraph.nodes import verifier as node
+
+    class FailingModel:
+        async def apredict(self, *args, **kwargs):
+            raise AssertionError("guardrail must not run for template plans")
+
+    monkeypatch.setattr(node.guardrail, "model", FailingModel())
+    context = [{"content": "Lock the account.", "metadata": {"source": "playbook-ssh", "chunk": 2}, "score": 0.03}]
+    state = make_state("LOW", context=context)
+    state["route"] = ROUTE_TEMPLATE
+    state.update(template_remediation(state))
+
+    remediation = state["remediation"]
+    assert remediation.model_version == "template-v1"
+    assert remediation.provenance[0].doc_id == "playbook-ssh"
+
+    result = asyncio.run(node.averify_plan(state))
+    assert result["verification_result"]["verdict"] == "PASS"
+    assert result["verification_result"]["checks"]["guardrail"]["verdict"] == "SKIPPED"
+
+    # Template text built from alert fields still goes through PolicyEngine
+    state = make_state("LOW", source="curl attacker")
+    state["route"] = ROUTE_TEMPLATE
+    state.update(template_remediation(state))
+    assert asyncio.run(node.averify_plan(state))["verification_result"]["verdict"] == "FAIL"
@@ -22,6 +22,48 @@ def test_policy_engine_allows_safe_text():
     result = engine.check_policy(text)
     assert result["verdict"] == "PASS"
 
+def test_policy_engine_reports_every_violation():
+    engine = PolicyEngine()
+    engine.forbidden_patterns = engine.forbidden_patterns + [r"drop\s+table", r"\bnc\s+-e\b"]
+    text = "Run sudo rm -rf /tmp, then DROP   TABLE users and nc -e /bin/sh"
+    result = engine.check_policy(text)
+    assert result["violations"] == ["sudo ", "rm -rf", r"drop\s+table", r"\bnc\s+-e\b"]
+
+def test_policy_engine_scales_to_large_rule_sets():
+    engine = PolicyEngine()
+    engine.forbidden_patterns = (engine.forbidden_patterns + [f"forbidden-token-{i:04d}" for i in range(1000)]
+                                 + [r"drop\s+table", r"\bnc\s+-e\b"])
+    text = "The analyst recommends isolating the host and resetting the user's credentials. " * 10
+
+    # Literal rules share one automaton; the few regex rules sit behind a single combined prefilter
+    rules = engine._rules
+    assert len(rules._literal_indices) == len(engine.forbidden_patterns) - len(rules._regexes)
+    assert len(rules._regexes) == 2 and rules._regex_prefilter is not None
+    assert engine.check_policy(text)["verdict"] == "PASS"
+    assert engine.check_policy(text + "forbidden-token-0999")["violations"] == ["forbidden-token-0999"]
+
+def test_policy_engine_hot_reloads_rules_file(tmp_path):
+    import os
+    rules = tmp_path / "policy.rules"
+    rules.write_text("# shell\nsudo \n")
+    engine = PolicyEngine(rules_path=str(rules), reload_interval=0)
+    assert engine.check_policy("sudo reboot")["verdict"] == "FAIL"
+    assert engine.check_policy("mimikatz.exe")["verdict"] == "PASS"
+
+    rules.write_text("sudo \nmimikatz\n")
+    os.utime(rules, ns=(0, os.stat(rules).st_mtime_ns + 1_000_000_000))
+    assert engine.check_policy("mimikatz.exe")["violations"] == ["mimikatz"]
+
+    # A broken file keeps the last good rule set
+    rules.write_text("mimikatz\n(unclosed\n")
+    os.utime(rules, ns=(0, os.stat(rules).st_mtime_ns + 2_000_000_000))
+    assert engine.check_policy("mimikatz.exe")["violations"] == ["mimikatz"]
+
+    # So does an empty one (e.g. truncated mid-write), rather than approving everything
+    rules.write_text("# all rules removed\n")
+    os.utime(rules, ns=(0, os.stat(rules).st_mtime_ns + 3_000_000_000))
+    assert engine.check_policy("mimikatz.exe")["violations"] == ["mimikatz"]
+
 def test_verifier_integration():
     engine = PolicyEngine()
     verifier = OutputVerifier(engine)
@@ -43,3 +85,81 @@ def test_system_prompts_are_immutable():
     # but the test checks that the *function* returns the correct value)
     # Ideally, we'd use a frozen dict or similar, but for now we check integrity.
     assert "You are a secure SOC assistant" in prompt
+
+class FakeNLI:
+    """Entails a step when it shares a word with the chunk. Logits: [contradiction, entailment, neutral]."""
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, pairs):
+        self.calls.append(len(pairs))
+        return [[0.0, 4.0, 0.0] if set(chunk.lower().split()) & set(step.lower().split()) else [0.0, -4.0, 4.0]
+                for chunk, step in pairs]
+
+def test_groundedness_scores_all_pairs_in_one_batch():
+    verifier = OutputVerifier(PolicyEngine(), mode="enforce")
+    fake = FakeNLI()
+    verifier._safety_classifier = fake
+    context = [{"content": "Block the IP at the firewall"}, {"content": "Reset credentials for the account"}]
+    steps = ["block 10.0.0.1", "reset credentials", "reimage laptop"]
+
+    result = verifier.verify("\n".join(steps), context, steps=steps)
+    assert fake.calls == [6]
+    assert result["verdict"] == "FAIL"
+    assert result["groundedness"]["ungrounded_steps"] == ["reimage laptop"]
+
+    # Scores are cached per (chunk, step); only the new step reaches the model
+    verifier.verify("block 10.0.0.1\nisolate host", context, steps=["block 10.0.0.1", "isolate host"])
+    assert fake.calls == [6, 2]
+
+def test_groundedness_report_mode_never_fails():
+    verifier = OutputVerifier(PolicyEngine(), mode="report")
+    verifier._safety_classifier = FakeNLI()
+    result = verifier.verify("reimage laptop", [{"content": "Block the IP"}])
+    assert result["verdict"] == "PASS"
+    assert result["groundedness"]["ungrounded_steps"] == ["reimage laptop"]
+
+class GuardrailModel:
+    """Answers the guardrail prompt with a fixed decision and counts calls."""
+    def __init__(self, decision="safe"):
+        self.decision = decision
+        self.calls = 0
+
+    def predict(self, prompt, max_tokens=200, temp=0.7):
+        self.calls += 1
+        return {"text": '{"decision": "%s", "reasoning": "test"}' % self.decision}
+
+    async def apredict(self, prompt, max_tokens=200, temp=0.7):
+        return self.predict(prompt, max_tokens, temp)
+
+def make_plan(steps):
+    from api.schemas import Remediation
+    return Remediation(action_id="a-1", alert_id="alert-1", title="Plan", steps=steps, confidence=0.8,
+                       provenance=[], model_version="test", prompt_hash="x", policy_verdict="PENDING")
+
+def test_verify_node_short_circuits_on_policy_failure(monkeypatch):
+    import asyncio
+    from langgraph.nodes import verifier as node
+    model = GuardrailModel()
+    monkeypatch.setattr(node.guardrail, "model", model)
+
+    state = {"remediation": make_plan(["sudo rm -rf /var/log"]), "context": []}
+    result = asyncio.run(node.averify_plan(state))
+    checks = result["verification_result"]["checks"]
+    assert result["verification_result"]["verdict"] == "FAIL"
+    assert checks["guardrail"]["verdict"] == "SKIPPED"
+    assert "duration_ms" in checks["policy"]
+    assert model.calls == 0
+
+def test_verify_node_runs_expensive_checks_when_policy_passes(monkeypatch):
+    import asyncio
+    from langgraph.nodes import verifier as node
+    model = GuardrailModel(decision="unsafe")
+    monkeypatch.setattr(node.guardrail, "model", model)
+
+    state = {"remediation": make_plan(["Block the source IP"]), "context": []}
+    result = asyncio.run(node.averify_plan(state))
+    checks = result["verification_result"]["checks"]
+    assert [checks[name]["verdict"] for name in ("policy", "groundedness", "guardrail")] == ["PASS", "PASS", "FAIL"]
+    assert result["remediation"].policy_verdict == "FAIL"
+    assert model.calls == 1